@@ -1,54 +1,19 @@
 # app/agents/compliance_agent.py
-import json
-import os
-from datetime import datetime
+import numpy as np
+import pandas as pd
+
 from app.scope.step_logger import StepLogger
-# Import the new threshold
-from app.core.app_config import DEFAULT_POLICY_DOC, CONFIDENCE_THRESHOLD, HIGH_VALUE_TRANSACTION_THRESHOLD, VIRTUAL_CARD_LIMIT, EXTREMELY_HIGH_VALUE_DEBIT_THRESHOLD
+from app.agents.rule_compiler import evaluate_condition_frame
+# Policy rules and thresholds are loaded, compiled and hot-reloaded by the registry
+# (load_policy_rules is re-exported for backtest_rules.py)
+from app.agents.policy_registry import load_policy_rules, get_rule_set
 
 # Initialize the logger for this agent
 logger = StepLogger()
 
-# Load policy rules from file
-def load_policy_rules(policy_doc_path: str = DEFAULT_POLICY_DOC) -> dict:
-    """Loads policy rules from a JSON file."""
-    if not os.path.exists(policy_doc_path):
-        print(f"Warning: Policy document not found at {policy_doc_path}. Using empty rules.")
-        return {}
-    try:
-        with open(policy_doc_path, 'r') as f:
-            rules = json.load(f)
-        return rules
-    except json.JSONDecodeError as e:
-        print(f"Error decoding policy JSON from {policy_doc_path}: {e}. Using empty rules.")
-        return {}
-    except Exception as e:
-        print(f"Error loading policy rules from {policy_doc_path}: {e}. Using empty rules.")
-        return {}
-
-# Load rules once when the module is imported
-POLICY_RULES = load_policy_rules()
-
-def check_policy_violation(transaction: dict, amount_flag: bool, location_flag: bool, merchant_flag: bool) -> dict:
-    """
-    Checks the transaction against predefined policy rules.
-    """
-    transaction_id = transaction.get("transaction_id", "unknown")
-    amount = float(transaction.get("amount", 0))
-    card_type = transaction.get("card_type", "unknown").lower()
-    user_location = transaction.get("user_location", "unknown").lower()
-    merchant_location = transaction.get("merchant_location", "unknown").lower()
-    merchant = transaction.get("merchant", "unknown").lower()
-
-    violated = False
-    policy_id = None
-    reason = "No policy violation detected."
-    confidence = 0.0
-    rule_action = "none"
-
-    # Log the input to the compliance agent
+def log_policy_check(transaction: dict, amount_flag: bool, location_flag: bool, merchant_flag: bool):
     logger.log_step(
-        transaction_id=transaction_id,
+        transaction_id=transaction.get("transaction_id", "unknown"),
         step=6,
         component="ComplianceGuard",
         input_data={"transaction_data": transaction, "flags": {"amount": amount_flag, "location": location_flag, "merchant": merchant_flag}},
@@ -56,52 +21,71 @@ def check_policy_violation(transaction: dict, amount_flag: bool, location_flag:
         confidence=0.8
     )
 
-    for rule_id, rule_details in POLICY_RULES.items():
-        rule_condition = rule_details.get("condition", "")
-        rule_action_from_rule = rule_details.get("action", "flag")
-        rule_reason = rule_details.get("reason", "Policy violation.")
-        rule_confidence = rule_details.get("confidence", 0.9)
+def log_policy_violation(transaction_id: str, rule_id: str, condition: str, action: str, reason: str, confidence: float):
+    logger.log_step(
+        transaction_id=transaction_id,
+        step=6,
+        component="ComplianceGuard",
+        input_data={"rule_id": rule_id, "condition": condition, "action": action},
+        description=f"Policy {rule_id} violated: {reason}",
+        confidence=confidence,
+        policy_violation=True,
+        policy_id=rule_id
+    )
+
+def evaluate_policy_rules_frame(transactions: pd.DataFrame, compiled_rules: list = None, thresholds: dict = None) -> pd.DataFrame:
+    """
+    Evaluates the whole rule set column-wise over a frame of transactions.
+    The frame needs the normalized (lowercased) amount, card_type, user_location,
+    merchant, merchant_location columns and the amount_flag, location_flag and
+    merchant_flag columns. Returns, for every row, the first matching policy_id
+    with its action, reason and confidence (same first-match order as the
+    rule set's policy index); rows with no match get violated=False.
+    Rules and thresholds default to the active rule set.
+    """
+    rule_set = get_rule_set()
+    if compiled_rules is None:
+        compiled_rules = rule_set.compiled_rules
+    if thresholds is None:
+        thresholds = rule_set.thresholds
+
+    length = len(transactions)
+    columns = {
+        "amount": transactions["amount"].to_numpy(dtype=float),
+        "card_type": transactions["card_type"].to_numpy(dtype=object),
+        "user_location": transactions["user_location"].to_numpy(dtype=object),
+        "merchant_location": transactions["merchant_location"].to_numpy(dtype=object),
+        "merchant": transactions["merchant"].to_numpy(dtype=object),
+        "amount_flag": transactions["amount_flag"].to_numpy(dtype=bool),
+        "location_flag": transactions["location_flag"].to_numpy(dtype=bool),
+        "merchant_flag": transactions["merchant_flag"].to_numpy(dtype=bool),
+    }
+    columns.update(thresholds)
 
+    # Index into compiled_rules of the first matching rule per row (-1: no match)
+    matched_rule = np.full(length, -1)
+    unmatched = np.ones(length, dtype=bool)
+    for rule_index, rule in enumerate(compiled_rules):
+        if not unmatched.any():
+            break
         try:
-            eval_context = {
-                "amount": amount,
-                "card_type": card_type,
-                "user_location": user_location,
-                "merchant_location": merchant_location,
-                "merchant": merchant,
-                "amount_flag": amount_flag,
-                "location_flag": location_flag,
-                "merchant_flag": merchant_flag,
-                "HIGH_VALUE_TRANSACTION_THRESHOLD": HIGH_VALUE_TRANSACTION_THRESHOLD,
-                "VIRTUAL_CARD_LIMIT": VIRTUAL_CARD_LIMIT,
-                "EXTREMELY_HIGH_VALUE_DEBIT_THRESHOLD": EXTREMELY_HIGH_VALUE_DEBIT_THRESHOLD # Pass new threshold
-            }
-            
-            if eval(rule_condition, {"__builtins__": None}, eval_context):
-                violated = True
-                policy_id = rule_id
-                reason = rule_reason
-                confidence = rule_confidence
-                rule_action = rule_action_from_rule
-                
-                logger.log_step(
-                    transaction_id=transaction_id,
-                    step=6,
-                    component="ComplianceGuard",
-                    input_data={"rule_id": rule_id, "condition": rule_condition, "action": rule_action},
-                    description=f"Policy {rule_id} violated: {rule_reason}",
-                    confidence=confidence,
-                    policy_violation=True,
-                    policy_id=rule_id
-                )
-                break
+            hits = evaluate_condition_frame(rule, columns, length) & unmatched
         except Exception as e:
-            print(f"Error evaluating policy rule {rule_id}: {e} - Condition: {rule_condition}")
+            print(f"Error evaluating policy rule {rule.rule_id} column-wise: {e} - Condition: {rule.condition}")
+            continue
+        matched_rule[hits] = rule_index
+        unmatched &= ~hits
 
-    return {
-        "violated": violated,
-        "policy_id": policy_id,
-        "reason": reason,
-        "confidence": confidence,
-        "action": rule_action
-    }
+    rule_ids = np.array([rule.rule_id for rule in compiled_rules] + [None], dtype=object)
+    actions = np.array([rule.action for rule in compiled_rules] + ["none"], dtype=object)
+    reasons = np.array([rule.reason for rule in compiled_rules] + ["No policy violation detected."], dtype=object)
+    confidences = np.array([rule.confidence for rule in compiled_rules] + [0.0], dtype=float)
+
+    # matched_rule == -1 picks the trailing "no violation" entry
+    return pd.DataFrame({
+        "violated": matched_rule >= 0,
+        "policy_id": rule_ids[matched_rule],
+        "action": actions[matched_rule],
+        "reason": reasons[matched_rule],
+        "confidence": confidences[matched_rule],
+    }, index=transactions.index)
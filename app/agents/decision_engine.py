@@ -0,0 +1,212 @@
+# app/agents/decision_engine.py
+import numpy as np
+import pandas as pd
+
+from app.core.app_config import CONFIDENCE_THRESHOLD, FALLBACK_THRESHOLD, VIRTUAL_CARD_LIMIT, HIGH_VALUE_TRANSACTION_THRESHOLD, EXTREMELY_HIGH_VALUE_DEBIT_THRESHOLD
+from app.agents.rule_compiler import ALLOWED_NAMES, CompiledRule, compile_condition, evaluate_condition_frame
+from app.agents.merchant_blacklist import is_blacklisted, blacklisted_mask
+from app.agents.merchant_fuzzy_index import fuzzy_match_merchant
+
+# Decision rows may also use the fallback outcome, the ML score and the ML thresholds
+DECISION_NAMES = ALLOWED_NAMES | {"escalated_by_fallback", "model_score", "CONFIDENCE_THRESHOLD", "FALLBACK_THRESHOLD"}
+
+# Threshold values used when no thresholds override file is loaded
+DEFAULT_THRESHOLDS = {
+    "HIGH_VALUE_TRANSACTION_THRESHOLD": HIGH_VALUE_TRANSACTION_THRESHOLD,
+    "VIRTUAL_CARD_LIMIT": VIRTUAL_CARD_LIMIT,
+    "EXTREMELY_HIGH_VALUE_DEBIT_THRESHOLD": EXTREMELY_HIGH_VALUE_DEBIT_THRESHOLD,
+    "CONFIDENCE_THRESHOLD": CONFIDENCE_THRESHOLD,
+    "FALLBACK_THRESHOLD": FALLBACK_THRESHOLD,
+}
+
+# How a row turns into a final confidence:
+# "fixed" uses the row's confidence, "score" the ML score, "score_floor" max(ML score, row confidence)
+CONFIDENCE_MODES = ("fixed", "score", "score_floor")
+
+# Rows checked before the policy file rules
+LEADING_ROWS = [
+    {"row_id": "FALLBACK", "condition": "escalated_by_fallback", "status": "escalated", "confidence": 0.1,
+     "confidence_mode": "fixed", "reason": "Required transaction fields are missing."},
+]
+
+# Rows checked after the policy file rules, in order. The last row always matches.
+TRAILING_ROWS = [
+    # E6.1 - Cross-border not caught by a stronger rule goes to manual review
+    {"row_id": "E6.1", "condition": "location_flag", "status": "escalated", "confidence": 0.65,
+     "confidence_mode": "score_floor", "reason": "Cross-border transaction detected."},
+    {"row_id": "ML.FRAUD", "condition": "model_score > CONFIDENCE_THRESHOLD", "status": "fraud", "confidence": 0.0,
+     "confidence_mode": "score", "reason": "ML model is highly confident of fraud."},
+    {"row_id": "ML.REVIEW", "condition": "model_score >= FALLBACK_THRESHOLD", "status": "escalated", "confidence": 0.0,
+     "confidence_mode": "score", "reason": "ML score is in the manual review range."},
+    {"row_id": "ML.SAFE", "condition": "True", "status": "safe", "confidence": 0.0,
+     "confidence_mode": "score", "reason": "No rule triggered and the ML score is low."},
+]
+
+class DecisionRow:
+    """One row of the decision table: a compiled condition plus the outcome it sets."""
+    __slots__ = ("rule", "source", "confidence_mode")
+
+    def __init__(self, rule: CompiledRule, source: str, confidence_mode: str = "fixed"):
+        if confidence_mode not in CONFIDENCE_MODES:
+            raise ValueError(f"Decision row {rule.rule_id}: unknown confidence_mode '{confidence_mode}'.")
+        self.rule = rule
+        self.source = source
+        self.confidence_mode = confidence_mode
+
+    @property
+    def row_id(self) -> str:
+        return self.rule.rule_id
+
+    @property
+    def status(self) -> str:
+        return self.rule.action
+
+    def resolve_confidence(self, model_score: float) -> float:
+        if self.confidence_mode == "score":
+            return model_score
+        if self.confidence_mode == "score_floor":
+            return max(model_score, self.rule.confidence)
+        return self.rule.confidence
+
+def _compile_row(row: dict, source: str) -> DecisionRow:
+    tree, code = compile_condition(row["condition"], row["row_id"], DECISION_NAMES)
+    rule = CompiledRule(
+        rule_id=row["row_id"],
+        condition=row["condition"],
+        action=row["status"],
+        reason=row["reason"],
+        confidence=row["confidence"],
+        tree=tree,
+        code=code,
+    )
+    return DecisionRow(rule, source, row["confidence_mode"])
+
+def build_decision_table(compiled_rules: list) -> list:
+    """
+    Builds the ordered decision table: the initial fallback, then the policy
+    file rules (first match wins), then cross-border escalation and the ML
+    threshold rows.
+    """
+    table = [_compile_row(row, "fallback") for row in LEADING_ROWS]
+    table += [DecisionRow(rule, "policy") for rule in compiled_rules]
+    table += [_compile_row(row, "ml" if row["row_id"].startswith("ML.") else "builtin") for row in TRAILING_ROWS]
+    return table
+
+def check_merchant(merchant: str) -> tuple:
+    """
+    Exact blacklist lookup, then the fuzzy index for near-misses.
+    Returns (merchant_flag, matched_entry, distance); distance 0 is an exact match.
+    """
+    if is_blacklisted(merchant):
+        return True, merchant, 0
+    match = fuzzy_match_merchant(merchant)
+    # Distance 0 would be an exact hit the blacklist itself does not have (e.g. a stale fuzzy index): not a near-miss
+    if match is not None and match[1] > 0:
+        return True, match[0], match[1]
+    return False, None, None
+
+def compute_flags(amount: float, card_type: str, user_location: str, merchant: str, merchant_location: str,
+                  thresholds: dict = DEFAULT_THRESHOLDS) -> dict:
+    """Amount, location and merchant checks for one normalized transaction."""
+    virtual_over_limit = card_type == "virtual" and amount > thresholds["VIRTUAL_CARD_LIMIT"]
+    merchant_flag, merchant_match, merchant_match_distance = check_merchant(merchant)
+    return {
+        "amount_flag": virtual_over_limit or amount > thresholds["HIGH_VALUE_TRANSACTION_THRESHOLD"],
+        "virtual_over_limit": virtual_over_limit,
+        "location_flag": user_location != merchant_location,
+        "merchant_flag": merchant_flag,
+        "merchant_match": merchant_match,
+        "merchant_match_distance": merchant_match_distance,
+    }
+
+def compute_flags_frame(transactions: pd.DataFrame, thresholds: dict = DEFAULT_THRESHOLDS) -> pd.DataFrame:
+    """
+    Column-wise version of compute_flags.
+    Expects normalized (lowercased) card_type, user_location, merchant and
+    merchant_location columns, and returns a frame with one row per transaction
+    (boolean flags plus the matched blacklist entry and its edit distance).
+    """
+    amount = transactions["amount"].to_numpy(dtype=float)
+    merchants = transactions["merchant"].to_numpy(dtype=object)
+    merchant_flag = blacklisted_mask(merchants)
+    merchant_match = np.where(merchant_flag, merchants, None)
+    merchant_match_distance = np.where(merchant_flag, 0, None)
+    # Fuzzy lookups only for merchants that missed the exact check, once per distinct name
+    near_matches = {merchant: fuzzy_match_merchant(merchant) for merchant in set(merchants[~merchant_flag])}
+    for i in np.flatnonzero(~merchant_flag):
+        match = near_matches[merchants[i]]
+        if match is not None and match[1] > 0:
+            merchant_flag[i] = True
+            merchant_match[i], merchant_match_distance[i] = match
+    is_virtual = (transactions["card_type"] == "virtual").to_numpy()
+
+    virtual_over_limit = is_virtual & (amount > thresholds["VIRTUAL_CARD_LIMIT"])
+    high_value = ~virtual_over_limit & (amount > thresholds["HIGH_VALUE_TRANSACTION_THRESHOLD"])
+
+    return pd.DataFrame({
+        "amount_flag": virtual_over_limit | high_value,
+        "virtual_over_limit": virtual_over_limit,
+        "location_flag": (transactions["user_location"] != transactions["merchant_location"]).to_numpy(),
+        "merchant_flag": merchant_flag,
+        "merchant_match": merchant_match,
+        "merchant_match_distance": merchant_match_distance,
+    }, index=transactions.index)
+
+def decide(fields: dict, flags: dict, model_score: float, escalated_by_fallback: bool,
+           table: list, thresholds: dict = DEFAULT_THRESHOLDS, rule_index=None) -> tuple:
+    """
+    Evaluates the decision table once for a transaction. `fields` holds the
+    normalized amount, card_type, user_location, merchant and merchant_location.
+    With a RuleIndex built over the table, only the candidate rows are evaluated.
+    Returns (row, final_status, final_confidence) for the first matching row.
+    """
+    context = dict(fields)
+    context.update(flags)
+    context.update(thresholds)
+    context["model_score"] = model_score
+    context["escalated_by_fallback"] = escalated_by_fallback
+
+    rows = table if rule_index is None else [table[position] for position in rule_index.candidates(context)]
+    for row in rows:
+        try:
+            if row.rule.matches(context):
+                return row, row.status, row.resolve_confidence(model_score)
+        except Exception as e:
+            print(f"Error evaluating decision row {row.row_id}: {e} - Condition: {row.rule.condition}")
+
+    # Only reached if the table has lost its catch-all row
+    return None, "safe", model_score
+
+def decide_frame(transactions: pd.DataFrame, model_scores: np.ndarray, escalated: np.ndarray,
+                 table: list, thresholds: dict = DEFAULT_THRESHOLDS, rule_index=None) -> np.ndarray:
+    """
+    Column-wise version of decide. `transactions` holds the normalized fields
+    and the flag columns. With a RuleIndex, only rows that are candidates for at
+    least one transaction are evaluated. Returns, per row, the index into the
+    table of the deciding row (-1 if none matched).
+    """
+    length = len(transactions)
+    columns = {name: transactions[name].to_numpy(dtype=float if name == "amount" else object)
+               for name in ("amount", "card_type", "user_location", "merchant_location", "merchant")}
+    for name in ("amount_flag", "location_flag", "merchant_flag"):
+        columns[name] = transactions[name].to_numpy(dtype=bool)
+    columns.update(thresholds)
+    columns["model_score"] = np.asarray(model_scores, dtype=float)
+    columns["escalated_by_fallback"] = np.asarray(escalated, dtype=bool)
+
+    positions = range(len(table)) if rule_index is None else rule_index.candidates_frame(columns)
+
+    decided_by = np.full(length, -1)
+    undecided = np.ones(length, dtype=bool)
+    for row_index in positions:
+        row = table[row_index]
+        if not undecided.any():
+            break
+        try:
+            hits = evaluate_condition_frame(row.rule, columns, length) & undecided
+        except Exception as e:
+            print(f"Error evaluating decision row {row.row_id} column-wise: {e} - Condition: {row.rule.condition}")
+            continue
+        decided_by[hits] = row_index
+        undecided &= ~hits
+    return decided_by
@@ -1,14 +1,24 @@
 # app/agents/fraud_agent.py
+import numpy as np
 import pandas as pd
 import pickle
 import os
+import time
 import uuid
 
-from app.scope.step_logger import StepLogger
-from app.core.app_config import CONFIDENCE_THRESHOLD, FALLBACK_THRESHOLD, RISKY_MERCHANTS, VIRTUAL_CARD_LIMIT, HIGH_VALUE_TRANSACTION_THRESHOLD
-from app.agents.fallback_agent import check_fallback
-from app.agents.compliance_agent import check_policy_violation
-from app.agents.narrative_agent import generate_narrative
+from starlette.concurrency import run_in_threadpool
+
+from app.scope.step_logger import StepLogger, batch_step_logs
+from app.scope.stage_timer import StageTimer, stage_timer, collect_stage_durations
+from app.scope.spans import start_span
+from app.core.metrics import metrics
+from app.core.app_config import NARRATIVE_MODE, NARRATIVE_DEADLINE
+from app.agents.fallback_agent import check_fallback, REQUIRED_FIELDS
+from app.agents.compliance_agent import log_policy_check, log_policy_violation
+from app.agents.decision_engine import compute_flags, compute_flags_frame, decide, decide_frame
+from app.agents.policy_registry import get_rule_set
+from app.agents.narrative_agent import generate_narrative, generate_narrative_async
+from app.agents.narrative_queue import submit_narrative
 
 # --- ML Model Loading ---
 current_file_dir = os.path.dirname(os.path.abspath(__file__))
@@ -29,16 +39,54 @@ else:
 
 logger = StepLogger()
 
-def run_fraud_pipeline(transaction: dict) -> dict:
-    """
-    Runs the fraud detection pipeline, orchestrating various agents
-    to determine the transaction's status, confidence, and narrative.
-    """
+decisions_total = metrics.counter("fraud_decisions_total", "Transactions decided, by final status.", ("status", "mode"))
+pipeline_duration = metrics.histogram("fraud_pipeline_duration_seconds", "End-to-end pipeline time up to the final decision.")
+
+def _policy_result(row) -> dict:
+    """Policy outcome passed on to the narrative: the deciding row if it came from the policy file."""
+    if row is not None and row.source == "policy":
+        return {"violated": True, "policy_id": row.row_id, "reason": row.rule.reason, "confidence": row.rule.confidence, "action": row.status}
+    return {"violated": False, "policy_id": None, "reason": "No policy violation detected.", "confidence": 0.0, "action": "safe"}
+
+def _log_policy_decision(transaction_id: str, transaction: dict, row):
+    """Logs the compliance steps for a policy row that decided the outcome."""
+    rule = row.rule
+    log_policy_violation(transaction_id, rule.rule_id, rule.condition, rule.action, rule.reason, rule.confidence)
+    logger.log_step(transaction_id, 6, "ComplianceGuardSummary", transaction,
+                    f"Policy {rule.rule_id} violated: {rule.reason}",
+                    rule.confidence, True, rule.rule_id)
+
+def _log_merchant_risk(transaction_id: str, merchant: str, matched_entry: str, distance):
+    if not distance:
+        description = "Merchant identified as high-risk."
+    else:
+        description = f"Merchant closely matches blacklisted merchant '{matched_entry}' (edit distance {distance})."
+    logger.log_step(transaction_id, 4, "MerchantRiskChecker",
+                    {"merchant": merchant, "matched_entry": matched_entry, "match_distance": distance},
+                    description, 0.91)
+
+def _ensure_transaction_id(transaction: dict) -> str:
     transaction_id = transaction.get("transaction_id")
     if not transaction_id:
         transaction_id = str(uuid.uuid4())
         transaction["transaction_id"] = transaction_id
         print(f"Generated new transaction ID: {transaction_id}")
+    return transaction_id
+
+def _pipeline_span(transaction_id: str, defer_narrative: bool):
+    """
+    Root span of a pipeline run, in a new trace, so resubmitting a transaction ID
+    starts another trace. Stage, step and Groq call spans nest under it; the
+    deferred narrative worker attaches it to log its step in the same trace.
+    """
+    return start_span("fraud_pipeline", attributes={"transaction_id": transaction_id, "narrative_deferred": defer_narrative})
+
+def _evaluate_transaction(transaction: dict) -> dict:
+    """
+    Runs every pipeline stage up to the final decision (fallback, checkers,
+    ML scoring, compliance). Shared by the sync and async pipelines.
+    """
+    transaction_id = _ensure_transaction_id(transaction)
 
     amount = float(transaction.get("amount", 0))
     card_type = transaction.get("card_type", "unknown").lower()
@@ -46,128 +94,345 @@ def run_fraud_pipeline(transaction: dict) -> dict:
     merchant = transaction.get("merchant", "").lower()
     merchant_location = transaction.get("merchant_location", "unknown").lower()
 
+    # One rule set for the whole transaction, even if a reload swaps it meanwhile
+    rule_set = get_rule_set()
+    thresholds = rule_set.thresholds
+
     is_escalated_by_initial_fallback = False
-    amount_flag = False
-    location_flag = False
-    merchant_flag = False
-    
-    policy_result = {"violated": False, "policy_id": None, "reason": "No policy violation detected.", "confidence": 0.0, "action": "safe"} 
+    flags = {"amount_flag": False, "virtual_over_limit": False, "location_flag": False, "merchant_flag": False}
     model_score = 0.5
 
-    initial_fallback_result = check_fallback(transaction, 1.0)
-    if initial_fallback_result["triggered"]:
-        is_escalated_by_initial_fallback = True
-        transaction["initial_fallback_reason"] = initial_fallback_result["reason"]
-        logger.log_step(transaction_id, 1, "InitialFallbackCheck", transaction,
-                        f"Initial fallback triggered: {initial_fallback_result['reason']}", 0.0)
-        pass
+    # Steps logged inside a stage carry its elapsed wall and CPU time
+    with stage_timer("InitialFallbackCheck"):
+        initial_fallback_result = check_fallback(transaction, 1.0)
+        if initial_fallback_result["triggered"]:
+            is_escalated_by_initial_fallback = True
+            transaction["initial_fallback_reason"] = initial_fallback_result["reason"]
+            logger.log_step(transaction_id, 1, "InitialFallbackCheck", transaction,
+                            f"Initial fallback triggered: {initial_fallback_result['reason']}", 0.0)
 
     if not is_escalated_by_initial_fallback:
-        if card_type == "virtual" and amount > VIRTUAL_CARD_LIMIT:
-            amount_flag = True
-            logger.log_step(transaction_id, 2, "AmountChecker", {"amount": amount, "card_type": card_type},
-                            f"Amount (${amount:,.2f}) exceeds limit ({VIRTUAL_CARD_LIMIT:,.2f}) for virtual card.", 0.75)
-        elif amount > HIGH_VALUE_TRANSACTION_THRESHOLD:
-            amount_flag = True 
-            logger.log_step(transaction_id, 2, "AmountChecker", {"amount": amount},
-                            f"High-value transaction (${amount:,.2f}) detected.", 0.80)
-
-        if user_location != merchant_location:
-            location_flag = True
-            logger.log_step(transaction_id, 3, "LocationValidator", {"user_loc": user_location, "merchant_loc": merchant_location},
-                            "Cross-border transaction detected.", 0.88)
-
-        if merchant in RISKY_MERCHANTS:
-            merchant_flag = True
-            logger.log_step(transaction_id, 4, "MerchantRiskChecker", {"merchant": merchant},
-                            "Merchant identified as high-risk.", 0.91)
+        # One pass computes the amount, location and merchant flags, so the three checkers share a stage
+        with stage_timer("RiskCheckers"):
+            flags = compute_flags(amount, card_type, user_location, merchant, merchant_location, thresholds)
+            if flags["virtual_over_limit"]:
+                logger.log_step(transaction_id, 2, "AmountChecker", {"amount": amount, "card_type": card_type},
+                                f"Amount (${amount:,.2f}) exceeds limit ({thresholds['VIRTUAL_CARD_LIMIT']:,.2f}) for virtual card.", 0.75)
+            elif flags["amount_flag"]:
+                logger.log_step(transaction_id, 2, "AmountChecker", {"amount": amount},
+                                f"High-value transaction (${amount:,.2f}) detected.", 0.80)
 
-    model_score = 0.5
-    if model and not is_escalated_by_initial_fallback:
-        try:
-            features = pd.DataFrame([{
-                "amount": amount,
-                "card_type_virtual": int(card_type == "virtual"),
-                "merchant_is_risky": int(merchant_flag),
-                "location_mismatch": int(location_flag)
-            }])
-            model_score = model.predict_proba(features)[0][1]
-            logger.log_step(transaction_id, 5, "MLScorer", {"features": features.to_dict('records')[0]},
-                            f"Model fraud score: {model_score:.2f}", model_score)
-        except Exception as e:
-            print(f"Model prediction error for transaction {transaction_id}: {e}. Using default score (0.5).")
-            model_score = 0.5
-            logger.log_step(transaction_id, 5, "MLScorer", {"error": str(e)},
-                            "Model prediction failed, using default score.", 0.0)
-    elif not model:
-        logger.log_step(transaction_id, 5, "MLScorer", {}, "ML model not loaded, using default score (0.5).", 0.0)
+            if flags["location_flag"]:
+                logger.log_step(transaction_id, 3, "LocationValidator", {"user_loc": user_location, "merchant_loc": merchant_location},
+                                "Cross-border transaction detected.", 0.88)
 
-    if not is_escalated_by_initial_fallback:
-        policy_result = check_policy_violation(transaction, amount_flag, location_flag, merchant_flag)
-        if policy_result["violated"]:
-            logger.log_step(transaction_id, 6, "ComplianceGuardSummary", transaction,
-                            f"Policy {policy_result['policy_id']} violated: {policy_result['reason']}",
-                            policy_result["confidence"], True, policy_result["policy_id"])
-
-    final_status = "safe"
-    final_confidence = 0.0
-
-    if is_escalated_by_initial_fallback:
-        final_status = "escalated"
-        final_confidence = 0.1
-    elif policy_result["violated"]:
-        final_status = policy_result["action"]
-        final_confidence = policy_result["confidence"]
-    elif merchant_flag: # F1.1 - Blacklisted Merchant
-        final_status = "fraud"
-        final_confidence = max(model_score, 0.95)
-    elif location_flag and card_type == "virtual" and amount > VIRTUAL_CARD_LIMIT: # F2.1 - Foreign IP + Virtual Card + High Value
-        final_status = "fraud"
-        final_confidence = max(model_score, 0.98)
-    elif merchant == "" or merchant_location == "": # F6.1 - Invalid Metadata
-        final_status = "fraud"
-        final_confidence = max(model_score, 0.90)
-    elif amount > HIGH_VALUE_TRANSACTION_THRESHOLD: # E1.1 - Amount > $5000
-        final_status = "escalated"
-        final_confidence = max(model_score, 0.80)
-    # NEW RULE: If cross-border is detected, and not caught by stronger fraud rules, escalate.
-    elif location_flag: # E6.1 - Cross-Border Without Metadata (or just general cross-border for escalation)
-        final_status = "escalated"
-        final_confidence = max(model_score, 0.65) # A confidence that pushes it to manual review range
-    else:
-        # If no specific rule or policy triggers, rely on ML model score and suggested thresholds
-        if model_score > CONFIDENCE_THRESHOLD: # > 0.85
-            final_status = "fraud" # ML is highly confident in fraud
-            final_confidence = model_score
-        elif model_score >= FALLBACK_THRESHOLD: # 0.60 - 0.85
-            final_status = "escalated" # ML uncertainty (E5)
-            final_confidence = model_score
-        else: # model_score < 0.60
-            final_status = "safe" # If ML score is low, AND no other flags, it should be SAFE.
-            final_confidence = model_score
-
-    narrative = generate_narrative(
-        transaction=transaction,
-        amount_flag=amount_flag,
-        location_flag=location_flag,
-        merchant_flag=merchant_flag,
-        policy_result=policy_result
-    )
+            if flags["merchant_flag"]:
+                _log_merchant_risk(transaction_id, merchant, flags["merchant_match"], flags["merchant_match_distance"])
+
+    amount_flag = flags["amount_flag"]
+    location_flag = flags["location_flag"]
+    merchant_flag = flags["merchant_flag"]
+
+    with stage_timer("MLScorer"):
+        if model and not is_escalated_by_initial_fallback:
+            try:
+                features = pd.DataFrame([{
+                    "amount": amount,
+                    "card_type_virtual": int(card_type == "virtual"),
+                    "merchant_is_risky": int(merchant_flag),
+                    "location_mismatch": int(location_flag)
+                }])
+                model_score = model.predict_proba(features)[0][1]
+                logger.log_step(transaction_id, 5, "MLScorer", {"features": features.to_dict('records')[0]},
+                                f"Model fraud score: {model_score:.2f}", model_score)
+            except Exception as e:
+                print(f"Model prediction error for transaction {transaction_id}: {e}. Using default score (0.5).")
+                model_score = 0.5
+                logger.log_step(transaction_id, 5, "MLScorer", {"error": str(e)},
+                                "Model prediction failed, using default score.", 0.0)
+        elif not model:
+            logger.log_step(transaction_id, 5, "MLScorer", {}, "ML model not loaded, using default score (0.5).", 0.0)
+
+    with stage_timer("ComplianceGuard"):
+        if not is_escalated_by_initial_fallback:
+            log_policy_check(transaction, amount_flag, location_flag, merchant_flag)
+
+        # Fallback, policy rules, cross-border escalation and ML thresholds in one pass
+        fields = {"amount": amount, "card_type": card_type, "user_location": user_location,
+                  "merchant": merchant, "merchant_location": merchant_location}
+        row, final_status, final_confidence = decide(fields, flags, model_score, is_escalated_by_initial_fallback,
+                                                     rule_set.decision_table, thresholds, rule_set.decision_index)
+        if row is not None and row.source == "policy":
+            _log_policy_decision(transaction_id, transaction, row)
+    policy_result = _policy_result(row)
 
+    return {
+        "transaction_id": transaction_id,
+        "final_status": final_status,
+        "final_confidence": final_confidence,
+        "decided_by": row.row_id if row is not None else None,
+        "rule_set_version": rule_set.version,
+        "narrative_kwargs": {
+            "transaction": transaction,
+            "amount_flag": amount_flag,
+            "location_flag": location_flag,
+            "merchant_flag": merchant_flag,
+            "policy_result": policy_result,
+            "final_status": final_status
+        }
+    }
+
+def _log_final_decision(transaction_id: str, final_status: str, final_confidence: float, decided_by: str = None,
+                        rule_set_version: str = None, batch: bool = False, pipeline_timer: StageTimer = None,
+                        stage_durations: dict = None):
+    """
+    Logs the final decision step (with the end-to-end pipeline time if timed, and
+    the final duration of every stage run so far) and materializes the summary.
+    """
+    input_data = {"final_status": final_status, "final_confidence": final_confidence,
+                  "decided_by": decided_by, "rule_set_version": rule_set_version}
+    if batch:
+        input_data["batch"] = True
+    if stage_durations is not None:
+        input_data["stage_durations_ms"] = dict(stage_durations)
+    timing = None
+    if pipeline_timer is not None:
+        total = pipeline_timer.timing()
+        timing = {"total_duration_ms": total["duration_ms"], "total_cpu_time_ms": total["cpu_time_ms"]}
+        pipeline_duration.observe(total["duration_ms"] / 1000)
+    decisions_total.inc(status=final_status, mode="batch" if batch else "single")
     logger.log_step(
         transaction_id=transaction_id,
         step=8,
         component="FinalDecisionAgent",
-        input_data={"final_status": final_status, "final_confidence": final_confidence},
+        input_data=input_data,
         description=f"Final decision: {final_status} with confidence {final_confidence:.2f}",
         confidence=final_confidence,
         final_decision_status=final_status,
-        final_decision_confidence=final_confidence
+        final_decision_confidence=final_confidence,
+        timing=timing
     )
+    logger.log_summary(transaction_id, final_status, final_confidence, rule_set_version,
+                       stage_durations, timing["total_duration_ms"] if timing else None)
 
+def _pipeline_result(evaluation: dict, narrative: str, narrative_status: str) -> dict:
     return {
-        "status": final_status,
-        "confidence": round(final_confidence, 2),
-        "trace_id": transaction_id,
+        "status": evaluation["final_status"],
+        "confidence": round(evaluation["final_confidence"], 2),
+        "trace_id": evaluation["transaction_id"],
         "narrative": narrative,
+        "narrative_status": narrative_status,
     }
+
+def run_fraud_pipeline(transaction: dict, defer_narrative: bool = None) -> dict:
+    """
+    Runs the fraud detection pipeline, orchestrating various agents
+    to determine the transaction's status, confidence, and narrative.
+    With defer_narrative (default: NARRATIVE_MODE == "deferred") the decision is
+    returned right away with narrative_status "pending", and the narrative is
+    generated by the background worker pool (with its own deadline). Otherwise
+    the LLM call must finish within NARRATIVE_DEADLINE of the start of the run.
+    """
+    if defer_narrative is None:
+        defer_narrative = NARRATIVE_MODE == "deferred"
+    transaction_id = _ensure_transaction_id(transaction)
+    pipeline_timer = StageTimer("pipeline")
+    # The LLM budget counts from the start of the run, so slow evaluation leaves less time for retries
+    deadline = time.monotonic() + NARRATIVE_DEADLINE
+
+    with _pipeline_span(transaction_id, defer_narrative), collect_stage_durations() as stage_durations:
+        evaluation = _evaluate_transaction(transaction)
+
+        if defer_narrative:
+            narrative = ""
+            narrative_status = "pending"
+        else:
+            with stage_timer("NarrativeAgent"):
+                narrative = generate_narrative(**evaluation["narrative_kwargs"], deadline=deadline)
+            narrative_status = "complete"
+
+        _log_final_decision(transaction_id, evaluation["final_status"], evaluation["final_confidence"],
+                            evaluation["decided_by"], evaluation["rule_set_version"], pipeline_timer=pipeline_timer,
+                            stage_durations=stage_durations)
+
+        # Queue the narrative only after the decision is logged, so it never delays it
+        if defer_narrative:
+            narrative = submit_narrative(transaction_id, **evaluation["narrative_kwargs"])
+            if narrative is not None: # Queue full: rendered from the template instead
+                narrative_status = "complete"
+            else:
+                narrative = ""
+
+    return _pipeline_result(evaluation, narrative, narrative_status)
+
+async def run_fraud_pipeline_async(transaction: dict, defer_narrative: bool = None) -> dict:
+    """
+    Async version of run_fraud_pipeline. The evaluation and the step log writes
+    run in the threadpool, off the event loop; only the Groq call is awaited on
+    the loop, on the pooled async HTTP client, so waiting on it never holds a thread.
+    """
+    if defer_narrative is None:
+        defer_narrative = NARRATIVE_MODE == "deferred"
+    transaction_id = _ensure_transaction_id(transaction)
+    # The run hops between the loop thread and threadpool threads, so no single thread's CPU time is ours;
+    # each stage still records its own CPU time in the thread that runs it
+    pipeline_timer = StageTimer("pipeline", track_cpu=False)
+    # The LLM budget counts from the start of the run, so slow evaluation leaves less time for retries
+    deadline = time.monotonic() + NARRATIVE_DEADLINE
+
+    with _pipeline_span(transaction_id, defer_narrative), collect_stage_durations() as stage_durations:
+        evaluation = await run_in_threadpool(_evaluate_transaction, transaction)
+
+        if defer_narrative:
+            narrative = ""
+            narrative_status = "pending"
+        else:
+            with stage_timer("NarrativeAgent", track_cpu=False):
+                narrative = await generate_narrative_async(**evaluation["narrative_kwargs"], deadline=deadline)
+            narrative_status = "complete"
+
+        await run_in_threadpool(_log_final_decision, transaction_id, evaluation["final_status"], evaluation["final_confidence"],
+                                evaluation["decided_by"], evaluation["rule_set_version"], pipeline_timer=pipeline_timer,
+                                stage_durations=stage_durations)
+
+        if defer_narrative:
+            narrative = await run_in_threadpool(submit_narrative, transaction_id, **evaluation["narrative_kwargs"])
+            if narrative is not None:
+                narrative_status = "complete"
+            else:
+                narrative = ""
+
+    return _pipeline_result(evaluation, narrative, narrative_status)
+
+def normalize_transactions_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Column-wise version of the field normalization at the top of the pipeline:
+    numeric amount, lowercased card type, locations and merchant.
+    """
+    return pd.DataFrame({
+        "amount": pd.to_numeric(frame["amount"], errors="coerce").fillna(0).astype(float),
+        "card_type": frame["card_type"].fillna("unknown").astype(str).str.lower(),
+        "user_location": frame["user_location"].fillna("unknown").astype(str).str.lower(),
+        "merchant": frame["merchant"].fillna("").astype(str).str.lower(),
+        "merchant_location": frame["merchant_location"].fillna("unknown").astype(str).str.lower(),
+    }, index=frame.index)
+
+def run_fraud_pipeline_batch(transactions: list) -> list:
+    """
+    Runs the fraud detection pipeline over many transactions at once.
+    Builds one feature matrix and calls the model once for the whole batch;
+    the amount, location and merchant checks and the decision table are
+    evaluated column-wise.
+    Narratives are not generated in batch mode.
+    Returns one result dict per transaction, in input order.
+    """
+    if not transactions:
+        return []
+
+    for transaction in transactions:
+        if not transaction.get("transaction_id"):
+            transaction["transaction_id"] = str(uuid.uuid4())
+
+    frame = pd.DataFrame(transactions)
+    for field in REQUIRED_FIELDS:
+        if field not in frame.columns:
+            frame[field] = None
+
+    # Same semantics as check_fallback: a field is missing if absent, None, "" or "N/A"
+    missing = frame[REQUIRED_FIELDS].isna() | frame[REQUIRED_FIELDS].isin(["", "N/A"])
+    escalated = missing.any(axis=1).to_numpy()
+
+    rule_set = get_rule_set()
+    thresholds = rule_set.thresholds
+    normalized = normalize_transactions_frame(frame)
+    flags = compute_flags_frame(normalized, thresholds)
+    # Checks are skipped for transactions escalated by the initial fallback
+    flags.loc[escalated, ["amount_flag", "virtual_over_limit", "location_flag", "merchant_flag"]] = False
+
+    model_scores = np.full(len(frame), 0.5)
+    features = pd.DataFrame({
+        "amount": normalized["amount"],
+        "card_type_virtual": (normalized["card_type"] == "virtual").astype(int),
+        "merchant_is_risky": flags["merchant_flag"].astype(int),
+        "location_mismatch": flags["location_flag"].astype(int),
+    })
+    model_error = None
+    scored = ~escalated
+    if model and scored.any():
+        try:
+            model_scores[scored] = model.predict_proba(features[scored])[:, 1]
+        except Exception as e:
+            print(f"Model prediction error for batch of {int(scored.sum())} transactions: {e}. Using default score (0.5).")
+            model_error = str(e)
+
+    # Fallback, policy rules, cross-border escalation and ML thresholds for the whole batch in one pass
+    table = rule_set.decision_table
+    decided_by = decide_frame(pd.concat([normalized, flags], axis=1), model_scores, escalated, table, thresholds,
+                              rule_set.decision_index)
+
+    results = []
+    # Steps are written in chunks of STEP_LOG_BATCH_SIZE records, not with a file open per step
+    with batch_step_logs():
+        for i, transaction in enumerate(transactions):
+            transaction_id = transaction["transaction_id"]
+            amount = float(normalized["amount"].iat[i])
+            card_type = normalized["card_type"].iat[i]
+            merchant = normalized["merchant"].iat[i]
+            merchant_location = normalized["merchant_location"].iat[i]
+            amount_flag = bool(flags["amount_flag"].iat[i])
+            location_flag = bool(flags["location_flag"].iat[i])
+            merchant_flag = bool(flags["merchant_flag"].iat[i])
+            model_score = float(model_scores[i])
+            row = table[decided_by[i]] if decided_by[i] >= 0 else None
+
+            if not model:
+                logger.log_step(transaction_id, 5, "MLScorer", {}, "ML model not loaded, using default score (0.5).", 0.0)
+
+            if escalated[i]:
+                initial_fallback_result = check_fallback(transaction, 1.0)
+                transaction["initial_fallback_reason"] = initial_fallback_result["reason"]
+                logger.log_step(transaction_id, 1, "InitialFallbackCheck", transaction,
+                                f"Initial fallback triggered: {initial_fallback_result['reason']}", 0.0)
+            else:
+                if flags["virtual_over_limit"].iat[i]:
+                    logger.log_step(transaction_id, 2, "AmountChecker", {"amount": amount, "card_type": card_type},
+                                    f"Amount (${amount:,.2f}) exceeds limit ({thresholds['VIRTUAL_CARD_LIMIT']:,.2f}) for virtual card.", 0.75)
+                elif amount_flag:
+                    logger.log_step(transaction_id, 2, "AmountChecker", {"amount": amount},
+                                    f"High-value transaction (${amount:,.2f}) detected.", 0.80)
+                if location_flag:
+                    logger.log_step(transaction_id, 3, "LocationValidator", {"user_loc": normalized["user_location"].iat[i], "merchant_loc": merchant_location},
+                                    "Cross-border transaction detected.", 0.88)
+                if merchant_flag:
+                    _log_merchant_risk(transaction_id, merchant, flags["merchant_match"].iat[i], int(flags["merchant_match_distance"].iat[i]))
+
+                if model and model_error:
+                    logger.log_step(transaction_id, 5, "MLScorer", {"error": model_error},
+                                    "Model prediction failed, using default score.", 0.0)
+                elif model:
+                    logger.log_step(transaction_id, 5, "MLScorer", {"features": {
+                                        "amount": amount,
+                                        "card_type_virtual": int(card_type == "virtual"),
+                                        "merchant_is_risky": int(merchant_flag),
+                                        "location_mismatch": int(location_flag)
+                                    }},
+                                    f"Model fraud score: {model_score:.2f}", model_score)
+
+                log_policy_check(transaction, amount_flag, location_flag, merchant_flag)
+                if row is not None and row.source == "policy":
+                    _log_policy_decision(transaction_id, transaction, row)
+
+            if row is not None:
+                final_status, final_confidence = row.status, row.resolve_confidence(model_score)
+            else:
+                final_status, final_confidence = "safe", model_score
+            _log_final_decision(transaction_id, final_status, final_confidence, row.row_id if row is not None else None,
+                                rule_set.version, batch=True)
+
+            results.append({
+                "status": final_status,
+                "confidence": round(final_confidence, 2),
+                "trace_id": transaction_id,
+            })
+
+    return results
@@ -0,0 +1,205 @@
+# app/agents/merchant_blacklist.py
+import hashlib
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from app.core.app_config import RISKY_MERCHANTS, MERCHANT_BLACKLIST_PATH, MERCHANT_BLACKLIST_RELOAD_INTERVAL, MERCHANT_BLACKLIST_BLOOM_BITS_PER_KEY
+
+# The blacklist is a .npy file of sorted, unique uint64 merchant keys, opened
+# with mmap so every worker shares the same read-only pages. An optional
+# "<path>.bloom.npy" bit array answers most misses without touching the keys.
+# The Bloom file starts with a header (key count, hash count, key fingerprint)
+# so it is only used together with the exact keys file it was built from.
+_BLOOM_HEADER_BYTES = 24
+
+def normalize_merchant(merchant: str) -> str:
+    return str(merchant).strip().lower()
+
+def merchant_key(merchant: str) -> int:
+    """64-bit key of a normalized merchant identifier (blake2b, little-endian)."""
+    digest = hashlib.blake2b(normalize_merchant(merchant).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+def merchant_keys(merchants) -> np.ndarray:
+    return np.fromiter((merchant_key(merchant) for merchant in merchants), dtype=np.uint64)
+
+def bloom_filter_path(path: str) -> str:
+    return path + ".bloom.npy"
+
+def _bloom_positions(keys: np.ndarray, bit_count: int, hash_count: int) -> np.ndarray:
+    """Bit positions for each key (rows) by double hashing the two 32-bit halves of the key."""
+    keys = np.asarray(keys, dtype=np.uint64)
+    low = (keys & np.uint64(0xFFFFFFFF))[:, None]
+    high = (keys >> np.uint64(32))[:, None] | np.uint64(1)
+    rounds = np.arange(hash_count, dtype=np.uint64)[None, :]
+    return (low + rounds * high) % np.uint64(bit_count)
+
+def _bloom_hash_count(bit_count: int, key_count: int) -> int:
+    return max(1, round(bit_count / max(key_count, 1) * math.log(2)))
+
+def _keys_fingerprint(keys: np.ndarray) -> int:
+    return int(keys[0]) ^ int(keys[-1]) ^ len(keys) if len(keys) else 0
+
+def build_blacklist(merchants, output_path: str = MERCHANT_BLACKLIST_PATH,
+                    bloom_bits_per_key: int = MERCHANT_BLACKLIST_BLOOM_BITS_PER_KEY) -> int:
+    """
+    Hashes, sorts and de-duplicates merchant identifiers and writes them (and
+    the Bloom filter, unless bloom_bits_per_key is 0) next to output_path.
+    Files are written to a temporary name and swapped in with os.replace, so
+    running workers pick up the new version on their next reload check.
+    Returns the number of unique keys.
+    """
+    keys = np.unique(merchant_keys(merchants))
+    output_directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_directory, exist_ok=True)
+
+    bloom_path = bloom_filter_path(output_path)
+    if bloom_bits_per_key > 0 and len(keys):
+        # Whole bytes, so the bit count read back from the packed file is the one hashed with
+        bit_count = max(64, -(-len(keys) * bloom_bits_per_key // 64) * 64)
+        bits = np.zeros(bit_count, dtype=bool)
+        hash_count = _bloom_hash_count(bit_count, len(keys))
+        # Set bits in chunks so tens of millions of keys do not need one huge position matrix
+        for start in range(0, len(keys), 1_000_000):
+            bits[_bloom_positions(keys[start:start + 1_000_000], bit_count, hash_count).ravel()] = True
+        header = np.array([len(keys), hash_count, _keys_fingerprint(keys)], dtype=np.uint64).view(np.uint8)
+        temporary_bloom_path = bloom_path + f".tmp-{os.getpid()}.npy"
+        np.save(temporary_bloom_path, np.concatenate([header, np.packbits(bits)]))
+        os.replace(temporary_bloom_path, bloom_path)
+    elif os.path.exists(bloom_path):
+        # A stale filter would reject keys that are in the new file
+        os.remove(bloom_path)
+
+    temporary_path = output_path + f".tmp-{os.getpid()}.npy"
+    np.save(temporary_path, keys)
+    os.replace(temporary_path, output_path)
+    return len(keys)
+
+class MerchantBlacklist:
+    """One loaded version of the blacklist: sorted keys plus an optional Bloom filter."""
+    __slots__ = ("keys", "bloom", "bloom_bit_count", "bloom_hash_count", "source", "file_stamp", "loaded_at")
+
+    def __init__(self, keys: np.ndarray, bloom: np.ndarray = None, bloom_hash_count: int = 0,
+                 source: str = "config", file_stamp=None):
+        self.keys = keys
+        self.bloom = bloom
+        self.bloom_bit_count = len(bloom) * 8 if bloom is not None else 0
+        self.bloom_hash_count = bloom_hash_count
+        self.source = source
+        self.file_stamp = file_stamp
+        self.loaded_at = time.time()
+
+    def _bloom_may_contain(self, keys: np.ndarray) -> np.ndarray:
+        positions = _bloom_positions(keys, self.bloom_bit_count, self.bloom_hash_count)
+        bits = (self.bloom[positions >> np.uint64(3)] >> (np.uint64(7) - (positions & np.uint64(7))).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+    def contains_keys(self, keys: np.ndarray) -> np.ndarray:
+        """Boolean membership for an array of merchant keys."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        found = np.zeros(len(keys), dtype=bool)
+        if not len(self.keys) or not len(keys):
+            return found
+        candidates = np.arange(len(keys))
+        if self.bloom is not None:
+            candidates = candidates[self._bloom_may_contain(keys)]
+            if not len(candidates):
+                return found
+        positions = np.searchsorted(self.keys, keys[candidates])
+        in_range = positions < len(self.keys)
+        found[candidates[in_range]] = self.keys[positions[in_range]] == keys[candidates[in_range]]
+        return found
+
+    def contains(self, merchant: str) -> bool:
+        """Single-merchant check with plain ints, avoiding array overhead per transaction."""
+        key = merchant_key(merchant)
+        if self.bloom is not None:
+            low, high = key & 0xFFFFFFFF, (key >> 32) | 1
+            for round_index in range(self.bloom_hash_count):
+                position = ((low + round_index * high) & 0xFFFFFFFFFFFFFFFF) % self.bloom_bit_count
+                if not (self.bloom[position >> 3] >> (7 - (position & 7))) & 1:
+                    return False
+        position = int(np.searchsorted(self.keys, np.uint64(key)))
+        return position < len(self.keys) and int(self.keys[position]) == key
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "keys": int(len(self.keys)),
+            "bloom_filter": self.bloom is not None,
+            "loaded_at": self.loaded_at,
+        }
+
+def _file_stamp(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def _load_bloom_filter(bloom_path: str, keys: np.ndarray) -> tuple:
+    """Memory-maps the Bloom filter if it matches the keys. Returns (bits, hash_count) or (None, 0)."""
+    if not os.path.exists(bloom_path):
+        return None, 0
+    try:
+        bloom = np.load(bloom_path, mmap_mode="r")
+        key_count, hash_count, fingerprint = np.frombuffer(bytes(bloom[:_BLOOM_HEADER_BYTES]), dtype=np.uint64)
+    except Exception as e:
+        print(f"Error loading merchant blacklist Bloom filter from {bloom_path}: {e}. Using the keys only.")
+        return None, 0
+    # Mid-swap, the filter may belong to another version of the keys: skip it rather than miss keys
+    if int(key_count) != len(keys) or int(fingerprint) != _keys_fingerprint(keys):
+        return None, 0
+    return bloom[_BLOOM_HEADER_BYTES:], int(hash_count)
+
+def load_blacklist(path: str = MERCHANT_BLACKLIST_PATH) -> MerchantBlacklist:
+    """
+    Memory-maps the blacklist file, or falls back to the RISKY_MERCHANTS set
+    from the config if there is no file (or it cannot be read).
+    """
+    file_stamp = _file_stamp(path)
+    if file_stamp is not None:
+        try:
+            keys = np.load(path, mmap_mode="r")
+            if keys.dtype != np.uint64 or keys.ndim != 1:
+                raise ValueError(f"expected a 1-D uint64 array, got {keys.dtype} with shape {keys.shape}")
+            bloom, hash_count = _load_bloom_filter(bloom_filter_path(path), keys)
+            return MerchantBlacklist(keys, bloom, hash_count, source=path, file_stamp=file_stamp)
+        except Exception as e:
+            print(f"Error loading merchant blacklist from {path}: {e}. Using RISKY_MERCHANTS from config.")
+    return MerchantBlacklist(np.unique(merchant_keys(RISKY_MERCHANTS)), source="config", file_stamp=file_stamp)
+
+_blacklist = None
+_blacklist_lock = threading.Lock()
+_next_reload_check = 0.0
+
+def get_blacklist() -> MerchantBlacklist:
+    """
+    Returns the current blacklist, remapping the file at most every
+    MERCHANT_BLACKLIST_RELOAD_INTERVAL seconds if it was swapped on disk.
+    Readers holding the previous version keep a valid mapping of the old file.
+    """
+    global _blacklist, _next_reload_check
+    now = time.monotonic()
+    if _blacklist is not None and now < _next_reload_check:
+        return _blacklist
+    with _blacklist_lock:
+        if _blacklist is None or now >= _next_reload_check:
+            _next_reload_check = now + MERCHANT_BLACKLIST_RELOAD_INTERVAL
+            if _blacklist is None or _file_stamp(MERCHANT_BLACKLIST_PATH) != _blacklist.file_stamp:
+                previous = _blacklist
+                _blacklist = load_blacklist()
+                if previous is not None:
+                    print(f"Merchant blacklist reloaded from {_blacklist.source} ({len(_blacklist.keys)} keys).")
+    return _blacklist
+
+def is_blacklisted(merchant: str) -> bool:
+    return get_blacklist().contains(merchant)
+
+def blacklisted_mask(merchants) -> np.ndarray:
+    """Column-wise blacklist check for a sequence of merchants."""
+    return get_blacklist().contains_keys(merchant_keys(merchants))
@@ -0,0 +1,234 @@
+# app/agents/merchant_fuzzy_index.py
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+from app.core.app_config import RISKY_MERCHANTS, MERCHANT_FUZZY_INDEX_PATH, MERCHANT_FUZZY_MAX_DISTANCE, MERCHANT_FUZZY_MIN_LENGTH, MERCHANT_BLACKLIST_RELOAD_INTERVAL
+from app.agents.merchant_blacklist import normalize_merchant, get_blacklist
+
+# SymSpell-style deletion index: every blacklisted name is stored under the
+# hashes of all strings reachable by deleting up to max_distance characters.
+# Two strings within that edit distance share at least one such deletion, so
+# a lookup probes the hashes of the query's deletions and only verifies the
+# few entries found there with an exact Damerau-Levenshtein check.
+#
+# One file, swapped in with os.replace and memory-mapped read-only:
+#   header   8-byte magic + uint64 entry_count, max_distance, names_bytes, delete_count
+#   names    UTF-8 names concatenated, sorted (padded to 8 bytes)
+#   offsets  uint64[entry_count + 1] start of each name in `names`
+#   keys     uint64[delete_count] sorted deletion hashes
+#   entries  uint32[delete_count] entry id for each deletion hash
+_MAGIC = b"FGFZ0001"
+_HEADER_BYTES = 40
+
+def _deletion_key(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+def deletions(text: str, max_distance: int) -> set:
+    """The string itself plus every string made by deleting up to max_distance characters."""
+    found = {text}
+    frontier = {text}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for word in frontier:
+            for i in range(len(word)):
+                next_frontier.add(word[:i] + word[i + 1:])
+        next_frontier -= found
+        found |= next_frontier
+        frontier = next_frontier
+    return found
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Damerau-Levenshtein distance (optimal string alignment) between a and b,
+    or max_distance + 1 as soon as it is known to exceed max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+def _build_arrays(merchants, max_distance: int) -> tuple:
+    names = sorted({normalize_merchant(merchant) for merchant in merchants} - {""})
+    encoded = [name.encode("utf-8") for name in names]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(name) for name in encoded], dtype=np.uint64)
+
+    delete_keys = []
+    delete_entries = []
+    for entry_id, name in enumerate(names):
+        for deletion in deletions(name, max_distance):
+            delete_keys.append(_deletion_key(deletion))
+            delete_entries.append(entry_id)
+    keys = np.array(delete_keys, dtype=np.uint64)
+    entries = np.array(delete_entries, dtype=np.uint32)
+    order = np.argsort(keys, kind="stable")
+    return b"".join(encoded), offsets, keys[order], entries[order]
+
+def build_fuzzy_index(merchants, output_path: str = MERCHANT_FUZZY_INDEX_PATH,
+                      max_distance: int = MERCHANT_FUZZY_MAX_DISTANCE) -> int:
+    """
+    Builds the deletion index file for the given merchant names and swaps it
+    in atomically. Returns the number of unique names indexed.
+    """
+    names_blob, offsets, keys, entries = _build_arrays(merchants, max_distance)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    temporary_path = output_path + f".tmp-{os.getpid()}"
+    header = np.array([len(offsets) - 1, max_distance, len(names_blob), len(keys)], dtype=np.uint64)
+    with open(temporary_path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(header.tobytes())
+        f.write(names_blob)
+        f.write(b"\0" * (-len(names_blob) % 8))
+        f.write(offsets.tobytes())
+        f.write(keys.tobytes())
+        f.write(entries.tobytes())
+    os.replace(temporary_path, output_path)
+    return len(offsets) - 1
+
+class FuzzyMerchantIndex:
+    """One loaded version of the deletion index."""
+    __slots__ = ("names", "offsets", "keys", "entries", "max_distance", "source", "file_stamp", "blacklist_stamp", "loaded_at")
+
+    def __init__(self, names: np.ndarray, offsets: np.ndarray, keys: np.ndarray, entries: np.ndarray,
+                 max_distance: int, source: str = "config", file_stamp=None, blacklist_stamp=None):
+        self.names = names
+        self.offsets = offsets
+        self.keys = keys
+        self.entries = entries
+        self.max_distance = max_distance
+        self.source = source
+        self.file_stamp = file_stamp
+        # File stamp of the exact blacklist this index was loaded for
+        self.blacklist_stamp = blacklist_stamp
+        self.loaded_at = time.time()
+
+    @classmethod
+    def from_merchants(cls, merchants, max_distance: int, source: str = "config", file_stamp=None, blacklist_stamp=None):
+        names_blob, offsets, keys, entries = _build_arrays(merchants, max_distance)
+        return cls(np.frombuffer(names_blob, dtype=np.uint8), offsets, keys, entries, max_distance, source, file_stamp,
+                   blacklist_stamp)
+
+    def name(self, entry_id: int) -> str:
+        return self.names[int(self.offsets[entry_id]):int(self.offsets[entry_id + 1])].tobytes().decode("utf-8")
+
+    def match(self, merchant: str):
+        """
+        Returns (blacklisted_name, distance) for the closest entry within
+        max_distance edits (ties broken by name), or None.
+        """
+        query = normalize_merchant(merchant)
+        if len(query) < MERCHANT_FUZZY_MIN_LENGTH or not len(self.keys):
+            return None
+        probes = np.fromiter((_deletion_key(deletion) for deletion in deletions(query, self.max_distance)), dtype=np.uint64)
+        starts = np.searchsorted(self.keys, probes, side="left")
+        ends = np.searchsorted(self.keys, probes, side="right")
+        candidate_ids = set()
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if start != end:
+                candidate_ids.update(self.entries[start:end].tolist())
+
+        best = None
+        for entry_id in candidate_ids:
+            name = self.name(entry_id)
+            distance = edit_distance(query, name, self.max_distance)
+            if distance <= self.max_distance and (best is None or (distance, name) < best[::-1]):
+                best = (name, distance)
+        return best
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "entries": int(len(self.offsets) - 1),
+            "deletions": int(len(self.keys)),
+            "max_distance": self.max_distance,
+            "loaded_at": self.loaded_at,
+        }
+
+def _file_stamp(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def load_fuzzy_index(path: str = MERCHANT_FUZZY_INDEX_PATH, blacklist=None) -> FuzzyMerchantIndex:
+    """
+    Memory-maps the deletion index file. Without a readable file, the index
+    follows the exact blacklist: built from RISKY_MERCHANTS when the blacklist
+    comes from the config, and empty (fuzzy matching off) when it was loaded
+    from a feed file, whose hashed keys cannot be turned back into names.
+    """
+    blacklist = blacklist if blacklist is not None else get_blacklist()
+    file_stamp = _file_stamp(path)
+    if file_stamp is not None:
+        try:
+            data = np.memmap(path, dtype=np.uint8, mode="r")
+            if data[:8].tobytes() != _MAGIC:
+                raise ValueError("not a merchant fuzzy index file")
+            entry_count, max_distance, names_bytes, delete_count = (int(value) for value in data[8:_HEADER_BYTES].view(np.uint64))
+            position = _HEADER_BYTES
+            names = data[position:position + names_bytes]
+            position += names_bytes + (-names_bytes % 8)
+            offsets = data[position:position + 8 * (entry_count + 1)].view(np.uint64)
+            position += 8 * (entry_count + 1)
+            keys = data[position:position + 8 * delete_count].view(np.uint64)
+            position += 8 * delete_count
+            entries = data[position:position + 4 * delete_count].view(np.uint32)
+            if len(entries) != delete_count:
+                raise ValueError("file is truncated")
+            return FuzzyMerchantIndex(names, offsets, keys, entries, max_distance, source=path, file_stamp=file_stamp,
+                                      blacklist_stamp=blacklist.file_stamp)
+        except Exception as e:
+            print(f"Error loading merchant fuzzy index from {path}: {e}.")
+    if blacklist.source != "config":
+        print(f"Warning: No merchant fuzzy index for the blacklist from {blacklist.source}. Fuzzy merchant matching is disabled.")
+        return FuzzyMerchantIndex.from_merchants((), MERCHANT_FUZZY_MAX_DISTANCE, source="disabled", file_stamp=file_stamp,
+                                                 blacklist_stamp=blacklist.file_stamp)
+    return FuzzyMerchantIndex.from_merchants(RISKY_MERCHANTS, MERCHANT_FUZZY_MAX_DISTANCE, file_stamp=file_stamp,
+                                             blacklist_stamp=blacklist.file_stamp)
+
+_fuzzy_index = None
+_fuzzy_index_lock = threading.Lock()
+_next_reload_check = 0.0
+
+def get_fuzzy_index() -> FuzzyMerchantIndex:
+    """
+    Returns the current index, remapping the file if it or the exact blacklist
+    was swapped (checked every reload interval).
+    """
+    global _fuzzy_index, _next_reload_check
+    now = time.monotonic()
+    if _fuzzy_index is not None and now < _next_reload_check:
+        return _fuzzy_index
+    with _fuzzy_index_lock:
+        if _fuzzy_index is None or now >= _next_reload_check:
+            _next_reload_check = now + MERCHANT_BLACKLIST_RELOAD_INTERVAL
+            blacklist = get_blacklist()
+            if (_fuzzy_index is None or _file_stamp(MERCHANT_FUZZY_INDEX_PATH) != _fuzzy_index.file_stamp
+                    or blacklist.file_stamp != _fuzzy_index.blacklist_stamp):
+                previous = _fuzzy_index
+                _fuzzy_index = load_fuzzy_index(blacklist=blacklist)
+                if previous is not None:
+                    print(f"Merchant fuzzy index reloaded from {_fuzzy_index.source} ({len(_fuzzy_index.offsets) - 1} entries).")
+    return _fuzzy_index
+
+def fuzzy_match_merchant(merchant: str):
+    """(blacklisted_name, distance) of the closest near-match, or None. Disabled when max distance is 0."""
+    if MERCHANT_FUZZY_MAX_DISTANCE <= 0:
+        return None
+    return get_fuzzy_index().match(merchant)
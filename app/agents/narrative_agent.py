@@ -1,85 +1,434 @@
 # app/agents/narrative_agent.py
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
+import httpx
+from starlette.concurrency import run_in_threadpool
 import json
+import random
+import threading
 import time # For exponential backoff
 
 from app.scope.step_logger import StepLogger
 # Import Groq specific configuration
-from app.core.app_config import GROQ_API_URL, GROQ_API_KEY, GROQ_MODEL_NAME
+from app.core.app_config import (GROQ_API_URL, GROQ_API_KEY, GROQ_MODEL_NAME, GROQ_MAX_CONNECTIONS, GROQ_CONNECT_TIMEOUT, GROQ_READ_TIMEOUT,
+                                 GROQ_MAX_RETRIES, GROQ_BREAKER_FAILURE_THRESHOLD, GROQ_BREAKER_RESET_TIMEOUT, GROQ_RPM_LIMIT, GROQ_TPM_LIMIT,
+                                 NARRATIVE_CACHE_SIZE, NARRATIVE_CACHE_TTL, NARRATIVE_DEADLINE)
+from app.core.lru_cache import LRUCache
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.llm_scheduler import LLMScheduler
+from app.core.metrics import metrics
+from app.scope.spans import start_span, SPAN_KIND_CLIENT
+from app.agents.narrative_templates import narrative_tier, render_template_narrative
 
 logger = StepLogger()
 
-# Function to call the Groq API with exponential backoff
-def call_groq_api(prompt: str, max_retries: int = 5, initial_delay: int = 1) -> str:
-    """
-    Calls the Groq API (OpenAI-compatible) to generate text based on a prompt,
-    with exponential backoff for retries.
-    """
+# Narrative templates keyed by flag signature (see narrative_signature)
+narrative_cache = LRUCache(maxsize=NARRATIVE_CACHE_SIZE, ttl=NARRATIVE_CACHE_TTL)
+
+# Shared by the sync and async Groq calls: while open, narratives use the built-in templates
+# A probe cannot take longer than one narrative's deadline; one that does was abandoned
+groq_breaker = CircuitBreaker("groq", GROQ_BREAKER_FAILURE_THRESHOLD, GROQ_BREAKER_RESET_TIMEOUT, probe_timeout=NARRATIVE_DEADLINE)
+
+# Coalesces identical in-flight prompts and keeps Groq calls within the provider's rate limits
+groq_scheduler = LLMScheduler("groq", GROQ_RPM_LIMIT, GROQ_TPM_LIMIT)
+
+metrics.watch_cache("narrative", narrative_cache)
+groq_calls = metrics.counter("groq_calls_total", "Groq narrative calls by outcome.", ("outcome",))
+groq_retries = metrics.counter("groq_retries_total", "Groq requests retried after a failed attempt.")
+
+# Narratives for these statuses are admitted first when the rate limit is reached; everything else has priority 1
+NARRATIVE_PRIORITIES = {"fraud": 0, "escalated": 0, "escalate": 0}
+
+GROQ_MAX_COMPLETION_TOKENS = 200
+
+# An attempt is not started with less time than this left before the deadline
+_MIN_ATTEMPT_SECONDS = 0.25
+DEADLINE_EXCEEDED_NARRATIVE = "Could not generate narrative before the deadline."
+BREAKER_OPEN_NARRATIVE = "Could not generate narrative: the Groq circuit breaker is open."
+RATE_LIMITED_NARRATIVE = "Could not generate narrative: the Groq rate limit left no time before the deadline."
+
+# Shared sync HTTP session (keep-alive connection pool), created lazily
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# Shared async HTTP client (keep-alive connection pool), created lazily per event loop
+_async_client = None
+_async_client_loop = None
+
+def _build_groq_payload(prompt: str, stream: bool = False) -> dict:
     # Groq's API expects an OpenAI-like chat completions payload
-    payload = {
+    return {
         "model": GROQ_MODEL_NAME,
         "messages": [
             {"role": "system", "content": "You are a concise and professional financial assistant who explains fraud detection results."},
             {"role": "user", "content": prompt}
         ],
         "temperature": 0.7, # Controls creativity (0.0-1.0)
-        "max_tokens": 200, # Limits the length of the generated response
-        "stream": False # We want a single, complete response
+        "max_tokens": GROQ_MAX_COMPLETION_TOKENS, # Limits the length of the generated response
+        "stream": stream # False for a single, complete response; True for incremental SSE chunks
     }
 
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {GROQ_API_KEY}' # Your Groq API Key
-    }
-    api_url = GROQ_API_URL
+def _parse_groq_response(result: dict) -> str:
+    # Parse the OpenAI-compatible response structure; None if it has no content
+    if result.get("choices") and result["choices"][0].get("message") and \
+       result["choices"][0]["message"].get("content"):
+        return result["choices"][0]["message"]["content"].strip()
+    print(f"Groq API response structure unexpected: {result}")
+    return None
+
+def _iter_stream_text(response):
+    """Yields the content deltas of an OpenAI-compatible SSE completion stream."""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        choices = json.loads(data).get("choices") or []
+        if choices:
+            text = (choices[0].get("delta") or {}).get("content")
+            if text:
+                yield text
+
+def _attempt_timeout(deadline: float):
+    """(connect, read) timeouts for one attempt, capped by the time left before the deadline, or None if it has passed."""
+    remaining = deadline - time.monotonic()
+    if remaining < _MIN_ATTEMPT_SECONDS:
+        return None
+    return min(GROQ_CONNECT_TIMEOUT, remaining), min(GROQ_READ_TIMEOUT, remaining)
+
+def _retry_delay(attempt: int, initial_delay: float, deadline: float):
+    """Full-jitter exponential backoff, cut short so another attempt still fits before the deadline (None if none does)."""
+    budget = deadline - time.monotonic() - _MIN_ATTEMPT_SECONDS
+    if budget <= 0:
+        return None
+    return min(random.uniform(0, initial_delay * (2 ** attempt)), budget)
+
+def _get_http_session() -> requests.Session:
+    """
+    Returns the shared keep-alive session. Its urllib3 pool is thread-safe, so
+    worker threads reuse up to GROQ_MAX_CONNECTIONS open connections instead of
+    a new TCP/TLS handshake per call. Retries are handled by call_groq_api.
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GROQ_MAX_CONNECTIONS, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+def close_http_session():
+    """Closes the shared sync session (called on application shutdown)."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is not None:
+            _http_session.close()
+        _http_session = None
+
+# Function to call the Groq API with jittered exponential backoff
+def _groq_span(attempt: int, stream: bool):
+    """Client span around one Groq HTTP attempt; it nests under the NarrativeAgent stage."""
+    return start_span("groq.chat_completions", SPAN_KIND_CLIENT, {
+        "http.request.method": "POST", "url.full": GROQ_API_URL, "gen_ai.request.model": GROQ_MODEL_NAME,
+        "groq.attempt": attempt + 1, "groq.stream": stream,
+    })
+
+# Transport errors worth another attempt (sync and async clients)
+_RETRYABLE_ERRORS = (requests.exceptions.RequestException, httpx.HTTPError)
+
+class _GroqAttempts:
+    """
+    Retry policy shared by every Groq call variant: the deadline and circuit
+    breaker checks before an attempt, what a failed attempt means (retry after
+    a jittered backoff, or give up with a failure narrative), and the breaker
+    and groq_calls / groq_retries bookkeeping. The variants only supply the
+    HTTP transport; _call_groq and _call_groq_async drive the attempts.
+    A streaming attempt collects its chunks in `streamed`; once any arrived,
+    the attempt is no longer retried.
+    """
+    def __init__(self, max_retries: int, initial_delay: float, deadline: float, stream: bool):
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.deadline = deadline if deadline is not None else time.monotonic() + NARRATIVE_DEADLINE
+        self.stream = stream
+        self.streamed = []
+
+    def rate_limited(self) -> str:
+        groq_calls.inc(outcome="rate_limited")
+        return RATE_LIMITED_NARRATIVE
+
+    def start(self, attempt: int) -> tuple:
+        """(timeout, None) for an attempt that may start, or (None, failure narrative)."""
+        timeout = _attempt_timeout(self.deadline)
+        if timeout is None:
+            print(f"Groq API deadline exceeded after {attempt} attempt(s).")
+            groq_calls.inc(outcome="deadline_exceeded")
+            return None, DEADLINE_EXCEEDED_NARRATIVE
+        if not groq_breaker.allow_request():
+            groq_calls.inc(outcome="breaker_open")
+            return None, BREAKER_OPEN_NARRATIVE
+        self.streamed = []
+        return timeout, None
+
+    def failed(self, attempt: int, error: Exception) -> tuple:
+        """(delay, None) to retry after `delay` seconds, or (None, failure narrative)."""
+        groq_breaker.record_failure()
+        if self.streamed:
+            print(f"Groq API stream interrupted after {len(self.streamed)} chunk(s): {error}")
+            groq_calls.inc(outcome="stream_interrupted")
+            return None, "Could not generate narrative: the Groq stream was interrupted."
+        # A malformed stream chunk is retried like a dropped connection; a malformed complete response is not
+        if not isinstance(error, _RETRYABLE_ERRORS) and not (self.stream and isinstance(error, json.JSONDecodeError)):
+            if isinstance(error, json.JSONDecodeError):
+                print(f"Groq API response not valid JSON: {error}")
+                groq_calls.inc(outcome="invalid_json")
+                return None, "Could not generate narrative due to invalid JSON response from Groq API."
+            print(f"An unexpected error occurred during Groq API call: {error}")
+            groq_calls.inc(outcome="error")
+            return None, "Could not generate narrative due to an unexpected error."
+        # No point backing off for another attempt the open breaker would reject
+        delay = (_retry_delay(attempt, self.initial_delay, self.deadline)
+                 if attempt < self.max_retries - 1 and not groq_breaker.is_open() else None)
+        if delay is None:
+            print(f"Groq API request failed after {attempt + 1} attempt(s): {error}")
+            groq_calls.inc(outcome="failed")
+            return None, "Could not generate narrative due to Groq API error after multiple retries."
+        print(f"Groq API request failed: {error}. Retrying in {delay:.2f} seconds...")
+        groq_retries.inc()
+        return delay, None
+
+    def abandoned(self):
+        # Cancelled (asyncio.CancelledError) or interrupted mid-attempt: release a half-open probe
+        groq_breaker.record_abandoned()
 
-    for i in range(max_retries):
+    def succeeded(self, text: str) -> str:
+        groq_breaker.record_success()
+        if not text:
+            groq_calls.inc(outcome="empty_response")
+            return "Could not generate narrative due to unexpected API response from Groq."
+        groq_calls.inc(outcome="success")
+        return text
+
+def _call_groq(attempts: _GroqAttempts, send, admit_retry=None) -> str:
+    """Runs send(timeout, span) -> text under the retry policy, sleeping between attempts."""
+    for i in range(attempts.max_retries):
+        # Retries pay for their own rate limit tokens, like the first attempt the scheduler admitted
+        if i > 0 and admit_retry is not None and not admit_retry():
+            return attempts.rate_limited()
+        timeout, failure = attempts.start(i)
+        if failure is not None:
+            return failure
         try:
-            response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            result = response.json()
-
-            # Parse the OpenAI-compatible response structure
-            if result.get("choices") and result["choices"][0].get("message") and \
-               result["choices"][0]["message"].get("content"):
-                return result["choices"][0]["message"]["content"].strip()
-            else:
-                print(f"Groq API response structure unexpected: {result}")
-                return "Could not generate narrative due to unexpected API response from Groq."
-
-        except requests.exceptions.RequestException as e:
-            if i < max_retries - 1:
-                delay = initial_delay * (2 ** i) # Exponential backoff
-                print(f"Groq API request failed: {e}. Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                print(f"Groq API request failed after {max_retries} retries: {e}")
-                return "Could not generate narrative due to Groq API error after multiple retries."
-        except json.JSONDecodeError as e:
-            print(f"Groq API response not valid JSON: {e}. Response: {response.text}")
-            return "Could not generate narrative due to invalid JSON response from Groq API."
+            with _groq_span(i, attempts.stream) as span:
+                text = send(timeout, span)
         except Exception as e:
-            print(f"An unexpected error occurred during Groq API call: {e}")
-            return "Could not generate narrative due to an unexpected error."
+            delay, failure = attempts.failed(i, e)
+            if failure is not None:
+                return failure
+            time.sleep(delay)
+            continue
+        except BaseException:
+            attempts.abandoned()
+            raise
+        return attempts.succeeded(text)
     return "Could not generate narrative." # Should not be reached if max_retries is hit
 
-def generate_narrative(transaction: dict, amount_flag: bool, location_flag: bool, merchant_flag: bool, policy_result: dict) -> str:
+async def _call_groq_async(attempts: _GroqAttempts, send, admit_retry=None) -> str:
+    """Async version of _call_groq; send and admit_retry are coroutine functions."""
+    for i in range(attempts.max_retries):
+        if i > 0 and admit_retry is not None and not await admit_retry():
+            return attempts.rate_limited()
+        timeout, failure = attempts.start(i)
+        if failure is not None:
+            return failure
+        try:
+            with _groq_span(i, attempts.stream) as span:
+                text = await send(timeout, span)
+        except Exception as e:
+            delay, failure = attempts.failed(i, e)
+            if failure is not None:
+                return failure
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            attempts.abandoned()
+            raise
+        return attempts.succeeded(text)
+    return "Could not generate narrative."
+
+def call_groq_api(prompt: str, max_retries: int = GROQ_MAX_RETRIES, initial_delay: float = 1, deadline: float = None,
+                  admit_retry=None) -> str:
     """
-    Generates a natural-language narrative for a transaction using an LLM,
-    based on the various flags and analysis results.
+    Calls the Groq API (OpenAI-compatible) to generate text based on a prompt,
+    with jittered exponential backoff for retries. Retries, timeouts and backoff
+    all fit within `deadline` (a time.monotonic() value, default NARRATIVE_DEADLINE
+    from now), and no request is made while the circuit breaker is open.
+    Each retry first calls admit_retry() (if given), which returns False when
+    the rate limit leaves no room for another attempt before the deadline.
     """
-    transaction_id = transaction.get("transaction_id", "unknown")
-    amount = float(transaction.get("amount", 0))
-    card_type = transaction.get("card_type", "unknown")
-    user_location = transaction.get("user_location", "unknown")
-    merchant_location = transaction.get("merchant_location", "unknown")
-    merchant = transaction.get("merchant", "unknown")
+    payload = _build_groq_payload(prompt)
+    headers = {'Authorization': f'Bearer {GROQ_API_KEY}'} # Your Groq API Key; json= sets the content type
+    session = _get_http_session()
+
+    def send(timeout, span):
+        response = session.post(GROQ_API_URL, headers=headers, json=payload, timeout=timeout)
+        span.set_attribute("http.response.status_code", response.status_code)
+        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        return _parse_groq_response(response.json())
+
+    return _call_groq(_GroqAttempts(max_retries, initial_delay, deadline, stream=False), send, admit_retry)
+
+def call_groq_api_stream(prompt: str, on_token, max_retries: int = GROQ_MAX_RETRIES, initial_delay: float = 1,
+                         deadline: float = None, admit_retry=None) -> str:
+    """
+    Streaming version of call_groq_api: requests "stream": True and calls
+    on_token(text) for each content delta as it arrives. Returns the full text.
+    Attempts are only retried before the first token; a stream that breaks
+    midway is reported as a failure, like any other Groq error.
+    """
+    payload = _build_groq_payload(prompt, stream=True)
+    headers = {'Authorization': f'Bearer {GROQ_API_KEY}'}
+    session = _get_http_session()
+    attempts = _GroqAttempts(max_retries, initial_delay, deadline, stream=True)
+
+    def send(timeout, span):
+        with session.post(GROQ_API_URL, headers=headers, json=payload, timeout=timeout, stream=True) as response:
+            span.set_attribute("http.response.status_code", response.status_code)
+            response.raise_for_status()
+            for text in _iter_stream_text(response):
+                attempts.streamed.append(text)
+                on_token(text)
+                if time.monotonic() > attempts.deadline:
+                    raise requests.exceptions.Timeout("deadline exceeded while streaming")
+        span.set_attribute("groq.stream_chunks", len(attempts.streamed))
+        return "".join(attempts.streamed).strip()
+
+    return _call_groq(attempts, send, admit_retry)
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Returns the pooled keep-alive async client for the running event loop."""
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=GROQ_MAX_CONNECTIONS, max_keepalive_connections=GROQ_MAX_CONNECTIONS),
+            timeout=httpx.Timeout(GROQ_READ_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT)
+        )
+        _async_client_loop = loop
+    return _async_client
+
+async def close_async_client():
+    """Closes the shared async client (called on application shutdown)."""
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.aclose()
+    _async_client = None
+    _async_client_loop = None
+
+async def call_groq_api_async(prompt: str, max_retries: int = GROQ_MAX_RETRIES, initial_delay: float = 1, deadline: float = None,
+                              admit_retry=None) -> str:
+    """
+    Async version of call_groq_api. Uses the pooled keep-alive client and
+    asyncio.sleep for backoff, so waiting never holds a thread. admit_retry
+    is a coroutine function.
+    """
+    payload = _build_groq_payload(prompt)
+    headers = {'Authorization': f'Bearer {GROQ_API_KEY}'}
+    client = _get_async_client()
+
+    async def send(timeout, span):
+        response = await client.post(GROQ_API_URL, headers=headers, json=payload,
+                                     timeout=httpx.Timeout(timeout[1], connect=timeout[0]))
+        span.set_attribute("http.response.status_code", response.status_code)
+        response.raise_for_status()
+        return _parse_groq_response(response.json())
+
+    return await _call_groq_async(_GroqAttempts(max_retries, initial_delay, deadline, stream=False), send, admit_retry)
+
+def narrative_values(transaction: dict) -> dict:
+    """Per-transaction values a narrative refers to, formatted as they appear in the text."""
+    return {
+        "transaction_id": str(transaction.get("transaction_id", "unknown")),
+        "amount": f"${float(transaction.get('amount', 0)):,.2f}",
+        "card_type": str(transaction.get("card_type", "unknown")),
+        "user_location": str(transaction.get("user_location", "unknown")),
+        "merchant": str(transaction.get("merchant", "unknown")),
+        "merchant_location": str(transaction.get("merchant_location", "unknown")),
+    }
+
+# Placeholders the LLM sees instead of the real values, so one narrative serves every transaction with the same flags
+NARRATIVE_PLACEHOLDERS = {name: "{" + name + "}" for name in narrative_values({})}
+
+def narrative_signature(transaction: dict, amount_flag: bool, location_flag: bool, merchant_flag: bool, policy_result: dict) -> tuple:
+    """Normalized cache key: everything in the prompt except the per-transaction values."""
+    violated = bool(policy_result.get("violated"))
+    return (
+        bool(amount_flag),
+        bool(location_flag),
+        bool(merchant_flag),
+        policy_result.get("policy_id") if violated else None,
+        policy_result.get("reason") if violated else None,
+        transaction.get("initial_fallback_reason") or None,
+    )
+
+def fill_narrative_template(template: str, values: dict) -> str:
+    # Plain replacement rather than str.format: the LLM text may contain other braces
+    for name, placeholder in NARRATIVE_PLACEHOLDERS.items():
+        template = template.replace(placeholder, values[name])
+    return template
+
+class _StreamingTemplateFiller:
+    """
+    Fills placeholders in template text that arrives in chunks. A trailing
+    "{..." that could still become a placeholder is held back until the next
+    chunk completes it.
+    """
+    _MAX_PLACEHOLDER_LENGTH = max(len(placeholder) for placeholder in NARRATIVE_PLACEHOLDERS.values())
+
+    def __init__(self, values: dict):
+        self.values = values
+        self.pending = ""
+
+    def feed(self, text: str) -> str:
+        text = self.pending + text
+        start = text.rfind("{")
+        if start != -1 and "}" not in text[start:] and len(text) - start < self._MAX_PLACEHOLDER_LENGTH:
+            text, self.pending = text[:start], text[start:]
+        else:
+            self.pending = ""
+        return fill_narrative_template(text, self.values)
+
+    def flush(self) -> str:
+        text, self.pending = self.pending, ""
+        return fill_narrative_template(text, self.values)
+
+def build_narrative_prompt(transaction: dict, amount_flag: bool, location_flag: bool, merchant_flag: bool, policy_result: dict,
+                           values: dict = None) -> tuple:
+    """
+    Builds the LLM prompt for a transaction narrative. `values` replaces the
+    transaction's own display values (see narrative_values), e.g. with
+    NARRATIVE_PLACEHOLDERS to build a reusable template prompt.
+    Returns a (llm_prompt, reasons_list_for_llm) tuple.
+    """
+    if values is None:
+        values = narrative_values(transaction)
+    transaction_id = values["transaction_id"]
+    amount = values["amount"]
+    card_type = values["card_type"]
+    user_location = values["user_location"]
+    merchant_location = values["merchant_location"]
+    merchant = values["merchant"]
 
     # Collect the specific reasons/flags for the prompt
     reasons_list_for_llm = []
 
     if amount_flag:
-        reasons_list_for_llm.append(f"- High-value payment: ${amount:,.2f} using a {card_type.lower()} card.")
+        reasons_list_for_llm.append(f"- High-value payment: {amount} using a {card_type.lower()} card.")
     if location_flag:
         reasons_list_for_llm.append(f"- Cross-border transaction: from {user_location} to {merchant_location}.")
     if merchant_flag:
@@ -91,6 +440,9 @@ def generate_narrative(transaction: dict, amount_flag: bool, location_flag: bool
     if transaction.get("initial_fallback_reason"):
         reasons_list_for_llm.append(f"- Initial data missing/invalid: {transaction['initial_fallback_reason']}.")
 
+    placeholder_note = ""
+    if values is NARRATIVE_PLACEHOLDERS:
+        placeholder_note = "Refer to transaction details only through the placeholders in curly braces, copied exactly as written. "
 
     # Construct the prompt for the LLM
     if not reasons_list_for_llm:
@@ -98,8 +450,9 @@ def generate_narrative(transaction: dict, amount_flag: bool, location_flag: bool
         llm_prompt = (
             "The following financial transaction passed all fraud checks and no unusual patterns were detected. "
             "Please generate a concise (2-3 sentences) and reassuring narrative explaining this. "
-            "Do not include a conversational opening or closing. Focus on clarity and professionalism.\n\n"
-            f"Transaction details: ID {transaction_id}, Amount ${amount:,.2f}, Card Type {card_type}, "
+            "Do not include a conversational opening or closing. Focus on clarity and professionalism. "
+            f"{placeholder_note}\n\n"
+            f"Transaction details: ID {transaction_id}, Amount {amount}, Card Type {card_type}, "
             f"User Location {user_location}, Merchant {merchant}, Merchant Location {merchant_location}."
         )
     else:
@@ -110,9 +463,10 @@ def generate_narrative(transaction: dict, amount_flag: bool, location_flag: bool
             "Based on the following flags and details, generate a concise (2-3 sentences), professional, "
             "and clear explanation of why this transaction was flagged or what unusual patterns were detected. "
             "Focus on the 'why' and provide actionable insights if possible. "
-            "Do not include a conversational opening or closing.\n\n"
+            "Do not include a conversational opening or closing. "
+            f"{placeholder_note}\n\n"
             f"Transaction ID: {transaction_id}\n"
-            f"Amount: ${amount:,.2f}\n"
+            f"Amount: {amount}\n"
             f"Card Type: {card_type}\n"
             f"User Location: {user_location}\n"
             f"Merchant: {merchant}\n"
@@ -121,17 +475,158 @@ def generate_narrative(transaction: dict, amount_flag: bool, location_flag: bool
             "Narrative:"
         )
 
-    # Call the Groq LLM to generate the narrative
-    narrative = call_groq_api(llm_prompt) # <--- Changed to call_groq_api
+    return llm_prompt, reasons_list_for_llm
+
+def _is_error_narrative(narrative: str) -> bool:
+    # call_groq_api reports failures as text; those must not be cached for other transactions
+    return narrative.startswith("Could not generate narrative")
+
+def _is_cacheable_template(template: str) -> bool:
+    """
+    True if an LLM template only uses the known NARRATIVE_PLACEHOLDERS: no
+    leftover braces once they are removed (a renamed or garbled placeholder
+    such as {Amount}) and no placeholder names written another way ([amount]).
+    """
+    for placeholder in NARRATIVE_PLACEHOLDERS.values():
+        template = template.replace(placeholder, "")
+    if "{" in template or "}" in template:
+        return False
+    lowered = template.lower()
+    return not any(f"[{name}]" in lowered or f"<{name}>" in lowered for name in NARRATIVE_PLACEHOLDERS)
+
+def _log_narrative(transaction: dict, llm_prompt: str, reasons_list_for_llm: list, narrative: str,
+                   narrative_cached: bool = False, narrative_tier: str = "llm", llm_schedule: dict = None,
+                   prompt_sent: bool = False):
+    transaction_id = transaction.get("transaction_id", "unknown")
+    values = narrative_values(transaction)
+
+    # The reasons as they read for this transaction; the prompt (with placeholders) only when it went to the LLM
+    input_data = {"transaction_details": transaction,
+                  "flags_for_llm": [fill_narrative_template(reason, values) for reason in reasons_list_for_llm],
+                  "narrative_cached": narrative_cached, "narrative_tier": narrative_tier}
+    if prompt_sent:
+        input_data["llm_prompt_template"] = llm_prompt
+    if llm_schedule is not None:
+        # Time spent queued for the rate limit (or waiting on a coalesced call) before the LLM answered
+        input_data["llm_queue_wait_ms"] = llm_schedule["queue_wait_ms"]
+        input_data["llm_coalesced"] = llm_schedule["coalesced"]
+        input_data["llm_priority"] = llm_schedule["priority"]
 
     # Log the LLM's input and output for traceability
     logger.log_step(
         transaction_id=transaction_id,
         step=7, # Consistent step number for NarrativeAgent
         component="NarrativeAgent",
-        input_data={"prompt_to_llm": llm_prompt, "transaction_details": transaction, "flags_for_llm": reasons_list_for_llm},
+        input_data=input_data,
         description=narrative,
         confidence=0.95 # Confidence in the narrative generation itself
     )
 
+def _cached_llm_template(tier: str, signature: tuple):
+    """
+    Returns (template, narrative_cached, tier) before any LLM call. The template
+    is None when the LLM has to be called; without an API key the tier drops
+    to "template_fallback" so no request (or retry delay) is made. The same
+    happens while the Groq circuit breaker is open.
+    """
+    if tier != "llm":
+        return None, False, tier
+    template = narrative_cache.get(signature)
+    if template is not None:
+        return template, True, tier
+    if not GROQ_API_KEY or groq_breaker.is_open():
+        return None, False, "template_fallback"
+    return None, False, tier
+
+def _schedule_args(llm_prompt: str, final_status: str, deadline: float) -> dict:
+    # Rough token cost: ~4 characters per prompt token plus the completion limit
+    return {
+        "key": llm_prompt,
+        "cost": len(llm_prompt) // 4 + GROQ_MAX_COMPLETION_TOKENS,
+        "priority": NARRATIVE_PRIORITIES.get(final_status, 1),
+        "deadline": deadline if deadline is not None else time.monotonic() + NARRATIVE_DEADLINE,
+    }
+
+def _finish_narrative(transaction: dict, llm_prompt: str, reasons_list_for_llm: list, final_status: str,
+                      signature: tuple, template: str, narrative_cached: bool, tier: str,
+                      llm_response: str = None, llm_schedule: dict = None) -> str:
+    # Rate limited requests never reach Groq; failed attempts did send the prompt
+    prompt_sent = llm_response is not None
+    if llm_schedule is not None and llm_response is None:
+        llm_response = RATE_LIMITED_NARRATIVE
+        groq_calls.inc(outcome="rate_limited")
+    if llm_response is not None:
+        if _is_error_narrative(llm_response):
+            tier = "template_fallback"
+        else:
+            template = llm_response
+            if _is_cacheable_template(template):
+                narrative_cache.put(signature, template)
+            else:
+                # Serve it to this transaction only: cached, a broken placeholder would reach every transaction with these flags
+                print(f"Warning: LLM narrative for transaction {transaction.get('transaction_id', 'unknown')} has unknown placeholders. Not cached.")
+    if template is None:
+        template = render_template_narrative(reasons_list_for_llm, final_status)
+
+    narrative = fill_narrative_template(template, narrative_values(transaction))
+    _log_narrative(transaction, llm_prompt, reasons_list_for_llm, narrative, narrative_cached, tier, llm_schedule, prompt_sent)
     return narrative
+
+def generate_narrative(transaction: dict, amount_flag: bool, location_flag: bool, merchant_flag: bool, policy_result: dict,
+                       final_status: str = None, deadline: float = None, on_token=None, tier: str = None) -> str:
+    """
+    Generates a natural-language narrative for a transaction, based on the
+    various flags and analysis results. Depending on the tier configured for
+    the final status it is rendered from the built-in templates or written by
+    the LLM; LLM narratives are written as templates, cached by flag signature
+    and filled in with this transaction's values. If Groq fails, the built-in
+    template is used instead. `deadline` (time.monotonic()) bounds the LLM call.
+    With on_token, the LLM response is streamed and on_token(text) receives the
+    filled-in text as it arrives (cached and template narratives are not streamed).
+    `tier` overrides the tier configured for the final status.
+    """
+    llm_prompt, reasons_list_for_llm = build_narrative_prompt(transaction, amount_flag, location_flag, merchant_flag, policy_result,
+                                                              NARRATIVE_PLACEHOLDERS)
+    signature = narrative_signature(transaction, amount_flag, location_flag, merchant_flag, policy_result)
+    template, narrative_cached, tier = _cached_llm_template(tier or narrative_tier(final_status), signature)
+
+    llm_response, llm_schedule = None, None
+    if template is None and tier == "llm":
+        # Call the Groq LLM through the scheduler (shared with identical in-flight prompts, rate limited)
+        schedule = _schedule_args(llm_prompt, final_status, deadline)
+        admit_retry = lambda: groq_scheduler.acquire(schedule["cost"], schedule["priority"], schedule["deadline"])
+        if on_token is None:
+            call = lambda: call_groq_api(llm_prompt, deadline=schedule["deadline"], admit_retry=admit_retry)
+        else:
+            filler = _StreamingTemplateFiller(narrative_values(transaction))
+
+            def call():
+                response = call_groq_api_stream(llm_prompt, lambda text: on_token(filler.feed(text)), deadline=schedule["deadline"],
+                                                admit_retry=admit_retry)
+                on_token(filler.flush())
+                return response
+        llm_response, llm_schedule = groq_scheduler.run(call=call, **schedule)
+
+    return _finish_narrative(transaction, llm_prompt, reasons_list_for_llm, final_status,
+                             signature, template, narrative_cached, tier, llm_response, llm_schedule)
+
+async def generate_narrative_async(transaction: dict, amount_flag: bool, location_flag: bool, merchant_flag: bool, policy_result: dict,
+                                   final_status: str = None, deadline: float = None) -> str:
+    """
+    Async version of generate_narrative; awaits the Groq call instead of blocking a thread.
+    Logging the narrative step writes to the trace store, so it runs in the threadpool.
+    """
+    llm_prompt, reasons_list_for_llm = build_narrative_prompt(transaction, amount_flag, location_flag, merchant_flag, policy_result,
+                                                              NARRATIVE_PLACEHOLDERS)
+    signature = narrative_signature(transaction, amount_flag, location_flag, merchant_flag, policy_result)
+    template, narrative_cached, tier = _cached_llm_template(narrative_tier(final_status), signature)
+
+    llm_response, llm_schedule = None, None
+    if template is None and tier == "llm":
+        schedule = _schedule_args(llm_prompt, final_status, deadline)
+        admit_retry = lambda: groq_scheduler.acquire_async(schedule["cost"], schedule["priority"], schedule["deadline"])
+        llm_response, llm_schedule = await groq_scheduler.run_async(
+            call=lambda: call_groq_api_async(llm_prompt, deadline=schedule["deadline"], admit_retry=admit_retry), **schedule)
+
+    return await run_in_threadpool(_finish_narrative, transaction, llm_prompt, reasons_list_for_llm, final_status,
+                                   signature, template, narrative_cached, tier, llm_response, llm_schedule)
@@ -0,0 +1,143 @@
+# app/agents/narrative_queue.py
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from app.agents.narrative_agent import generate_narrative
+from app.core.metrics import metrics
+from app.scope.stage_timer import stage_timer
+from app.scope.step_logger import StepLogger
+from app.scope.spans import attach_span, current_span
+from app.core.app_config import (NARRATIVE_WORKERS, NARRATIVE_JOBS_RETAINED, NARRATIVE_QUEUE_SIZE, NARRATIVE_CALLBACK_URL,
+                                 NARRATIVE_STREAMING)
+
+logger = StepLogger()
+
+class NarrativeStream:
+    """
+    Text chunks of one deferred narrative as they are generated. Written by
+    the worker thread and read by index from the SSE endpoint.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+
+    def append(self, text: str):
+        if text:
+            self.chunks.append(text)
+
+    def close(self):
+        self.done = True
+
+# Narrative jobs are kept in memory, keyed by trace ID, in submission order
+_jobs = OrderedDict()
+_streams = {}
+_jobs_lock = threading.Lock()
+# Jobs submitted to the executor and not finished yet; its own work queue is unbounded
+_queued_jobs = 0
+_executor = ThreadPoolExecutor(max_workers=NARRATIVE_WORKERS, thread_name_prefix="narrative-worker")
+
+metrics.callback("narrative_queue_depth", "Deferred narratives queued or being generated.", "gauge",
+                 lambda: {(): _queued_jobs})
+
+LOCAL_CALLBACK_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+def _set_job(trace_id: str, status: str, narrative: str = None) -> dict:
+    job = {"trace_id": trace_id, "narrative_status": status, "narrative": narrative}
+    with _jobs_lock:
+        _jobs[trace_id] = job
+        _jobs.move_to_end(trace_id)
+        # Drop the oldest jobs once the retention limit is exceeded. A pending job that is
+        # dropped still runs; its worker holds its own stream and records it again when done.
+        while len(_jobs) > NARRATIVE_JOBS_RETAINED:
+            oldest_id, _ = _jobs.popitem(last=False)
+            _streams.pop(oldest_id, None)
+    return dict(job)
+
+def _post_callback(job: dict):
+    """Pushes a finished narrative to the configured callback URL (local hosts only)."""
+    if not NARRATIVE_CALLBACK_URL:
+        return
+    if urlparse(NARRATIVE_CALLBACK_URL).hostname not in LOCAL_CALLBACK_HOSTS:
+        print(f"Warning: NARRATIVE_CALLBACK_URL {NARRATIVE_CALLBACK_URL} is not a local URL. Skipping callback.")
+        return
+    try:
+        requests.post(NARRATIVE_CALLBACK_URL, json=job, timeout=5)
+    except requests.exceptions.RequestException as e:
+        print(f"Narrative callback to {NARRATIVE_CALLBACK_URL} failed for {job['trace_id']}: {e}")
+
+def _run_job(trace_id: str, narrative_kwargs: dict, parent_span=None, stream: NarrativeStream = None):
+    global _queued_jobs
+    try:
+        # Timed on its own: the deferred narrative is not part of the pipeline's total,
+        # but its span nests under the pipeline span that queued it
+        with attach_span(parent_span), stage_timer("NarrativeAgent"):
+            narrative = generate_narrative(**narrative_kwargs, on_token=stream.append if stream is not None else None)
+        # Cached and template narratives arrive in one piece
+        if stream is not None and not stream.chunks:
+            stream.append(narrative)
+        job = _set_job(trace_id, "complete", narrative)
+    except Exception as e:
+        print(f"Deferred narrative generation failed for transaction {trace_id}: {e}")
+        job = _set_job(trace_id, "failed", f"Could not generate narrative: {e}")
+        # The trace still gets its NarrativeAgent step, so trace viewers know the narrative is over
+        with attach_span(parent_span):
+            logger.log_step(
+                transaction_id=trace_id,
+                step=7,
+                component="NarrativeAgent",
+                input_data={"narrative_status": "failed", "error": str(e)},
+                description=job["narrative"],
+                confidence=0.0
+            )
+    finally:
+        with _jobs_lock:
+            _queued_jobs -= 1
+    if stream is not None:
+        stream.close()
+    _post_callback(job)
+
+def submit_narrative(trace_id: str, **narrative_kwargs):
+    """
+    Queues narrative generation for a transaction on the background worker pool.
+    Accepts the same keyword arguments as generate_narrative. Returns None when
+    the job was queued. When NARRATIVE_QUEUE_SIZE jobs are already waiting, the
+    narrative is rendered from the built-in template right away and returned.
+    """
+    global _queued_jobs
+    with _jobs_lock:
+        queue_full = _queued_jobs >= NARRATIVE_QUEUE_SIZE
+        if not queue_full:
+            _queued_jobs += 1
+    if queue_full:
+        print(f"Warning: Narrative queue full ({NARRATIVE_QUEUE_SIZE} jobs). Using the template narrative for {trace_id}.")
+        with stage_timer("NarrativeAgent"):
+            narrative = generate_narrative(**narrative_kwargs, tier="template")
+        _set_job(trace_id, "complete", narrative)
+        return narrative
+
+    stream = NarrativeStream() if NARRATIVE_STREAMING else None
+    if stream is not None:
+        with _jobs_lock:
+            _streams[trace_id] = stream
+    _set_job(trace_id, "pending")
+    _executor.submit(_run_job, trace_id, narrative_kwargs, current_span(), stream)
+    return None
+
+def get_narrative_job(trace_id: str) -> dict:
+    """Returns the narrative job for a trace ID, or None if it is not known to this process."""
+    with _jobs_lock:
+        job = _jobs.get(trace_id)
+        return dict(job) if job else None
+
+def get_narrative_stream(trace_id: str) -> NarrativeStream:
+    """Returns the token stream of a deferred narrative, or None if it is not streamed by this process."""
+    with _jobs_lock:
+        return _streams.get(trace_id)
+
+def shutdown_narrative_workers(wait: bool = True):
+    """Stops accepting narrative jobs and optionally waits for queued ones to finish."""
+    _executor.shutdown(wait=wait)
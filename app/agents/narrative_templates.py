@@ -0,0 +1,61 @@
+# app/agents/narrative_templates.py
+from app.core.app_config import NARRATIVE_TIERS, NARRATIVE_DEFAULT_TIER
+
+NARRATIVE_TIER_NAMES = ("template", "llm")
+
+# Template texts use the same placeholders as the LLM templates (see narrative_agent.NARRATIVE_PLACEHOLDERS)
+STATUS_OPENINGS = {
+    "safe": "Transaction {transaction_id} for {amount} was approved.",
+    "fraud": "Transaction {transaction_id} for {amount} was flagged as likely fraud.",
+    "escalated": "Transaction {transaction_id} for {amount} was escalated for manual review.",
+}
+DEFAULT_OPENING = "Transaction {transaction_id} for {amount} was processed."
+
+STATUS_CLOSINGS = {
+    "safe": "These signals were not strong enough to stop the payment, but may be worth monitoring.",
+    "fraud": "The payment should stay blocked until the cardholder confirms it.",
+    "escalated": "An analyst should verify these signals before the payment is released.",
+}
+
+NO_REASONS_TEXT = ("It passed all fraud checks, and no unusual patterns were found for the {card_type} card payment "
+                   "from {user_location} to {merchant} in {merchant_location}.")
+
+def _canonical_status(final_status: str) -> str:
+    # Policy rules use the action "escalate" for the escalated status
+    return "escalated" if final_status == "escalate" else final_status
+
+def parse_narrative_tiers(spec: str) -> dict:
+    """Parses "status:tier,status:tier" into a dict, skipping malformed entries."""
+    tiers = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        status, _, tier = entry.partition(":")
+        status, tier = status.strip().lower(), tier.strip().lower()
+        if not status or tier not in NARRATIVE_TIER_NAMES:
+            print(f"Warning: Ignoring narrative tier entry '{entry.strip()}'. Expected status:{'|'.join(NARRATIVE_TIER_NAMES)}.")
+            continue
+        tiers[status] = tier
+    return tiers
+
+narrative_tiers = parse_narrative_tiers(NARRATIVE_TIERS)
+
+def narrative_tier(final_status: str) -> str:
+    """The configured tier ("template" or "llm") for a final status."""
+    return narrative_tiers.get(_canonical_status(final_status), NARRATIVE_DEFAULT_TIER)
+
+def render_template_narrative(reasons_list_for_llm: list, final_status: str = None) -> str:
+    """
+    Deterministic narrative built from the same reasons list as the LLM prompt.
+    Returns a template with placeholders, filled in like a cached LLM narrative.
+    """
+    status = _canonical_status(final_status)
+    sentences = [STATUS_OPENINGS.get(status, DEFAULT_OPENING)]
+    if not reasons_list_for_llm:
+        sentences.append(NO_REASONS_TEXT)
+    else:
+        sentences.append("The following was detected:")
+        sentences.extend(reason.lstrip("- ").strip() for reason in reasons_list_for_llm)
+        if status in STATUS_CLOSINGS:
+            sentences.append(STATUS_CLOSINGS[status])
+    return " ".join(sentences)
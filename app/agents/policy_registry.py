@@ -0,0 +1,185 @@
+# app/agents/policy_registry.py
+import hashlib
+import json
+import os
+import threading
+import time
+
+from app.core.app_config import DEFAULT_POLICY_DOC, POLICY_THRESHOLDS_DOC, POLICY_RELOAD_INTERVAL
+from app.agents.rule_compiler import compile_policy_rules
+from app.agents.decision_engine import DEFAULT_THRESHOLDS, build_decision_table
+from app.agents.rule_index import RuleIndex
+
+class RuleSet:
+    """
+    One compiled version of the policy rules and thresholds. Never mutated
+    after it is built: a reload builds a new RuleSet and swaps the reference.
+    """
+    __slots__ = ("version", "rules", "compiled_rules", "decision_table", "thresholds",
+                 "policy_index", "decision_index", "file_stamps", "loaded_at")
+
+    def __init__(self, version: str, rules: dict, compiled_rules: list, decision_table: list,
+                 thresholds: dict, file_stamps: tuple, loaded_at: float):
+        self.version = version
+        self.rules = rules
+        self.compiled_rules = compiled_rules
+        self.decision_table = decision_table
+        self.thresholds = thresholds
+        # Thresholds are fixed per rule set, so amount bounds can be resolved when indexing
+        self.policy_index = RuleIndex(compiled_rules, thresholds)
+        self.decision_index = RuleIndex([row.rule for row in decision_table], thresholds)
+        self.file_stamps = file_stamps
+        self.loaded_at = loaded_at
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "rules": len(self.compiled_rules),
+            "thresholds": dict(self.thresholds),
+            "index": self.policy_index.stats(),
+            "loaded_at": self.loaded_at,
+        }
+
+def _file_stamp(path: str):
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _read_json(path: str) -> dict:
+    with open(path, "r") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must contain a JSON object.")
+    return data
+
+def load_policy_rules(policy_doc_path: str = DEFAULT_POLICY_DOC) -> dict:
+    """Loads policy rules from a JSON file."""
+    if not os.path.exists(policy_doc_path):
+        print(f"Warning: Policy document not found at {policy_doc_path}. Using empty rules.")
+        return {}
+    try:
+        return _read_json(policy_doc_path)
+    except json.JSONDecodeError as e:
+        print(f"Error decoding policy JSON from {policy_doc_path}: {e}. Using empty rules.")
+        return {}
+    except Exception as e:
+        print(f"Error loading policy rules from {policy_doc_path}: {e}. Using empty rules.")
+        return {}
+
+def load_thresholds(thresholds_path: str = POLICY_THRESHOLDS_DOC) -> dict:
+    """
+    Returns the default thresholds with any overrides from the optional
+    thresholds file applied. Raises ValueError on unknown keys or bad values.
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    if not os.path.exists(thresholds_path):
+        return thresholds
+    overrides = _read_json(thresholds_path)
+    for name, value in overrides.items():
+        if name not in thresholds:
+            raise ValueError(f"Unknown threshold '{name}' in {thresholds_path}.")
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Threshold '{name}' in {thresholds_path} must be a number.")
+        thresholds[name] = float(value)
+    if thresholds["FALLBACK_THRESHOLD"] > thresholds["CONFIDENCE_THRESHOLD"]:
+        raise ValueError("FALLBACK_THRESHOLD must not be above CONFIDENCE_THRESHOLD.")
+    return thresholds
+
+def build_rule_set(policy_doc_path: str = DEFAULT_POLICY_DOC, thresholds_path: str = POLICY_THRESHOLDS_DOC,
+                   strict: bool = True) -> RuleSet:
+    """
+    Loads, validates and compiles a rule set. With strict=True a missing or
+    unreadable policy file, a rule that fails to compile or a bad threshold
+    raises ValueError, so a broken edit never replaces a working rule set.
+    """
+    file_stamps = (_file_stamp(policy_doc_path), _file_stamp(thresholds_path))
+    if strict:
+        try:
+            rules = _read_json(policy_doc_path)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Could not load policy rules from {policy_doc_path}: {e}") from e
+        compiled_rules = compile_policy_rules(rules)
+        if len(compiled_rules) != len(rules):
+            raise ValueError(f"{len(rules) - len(compiled_rules)} policy rule(s) in {policy_doc_path} failed to compile.")
+        thresholds = load_thresholds(thresholds_path)
+    else:
+        rules = load_policy_rules(policy_doc_path)
+        compiled_rules = compile_policy_rules(rules)
+        try:
+            thresholds = load_thresholds(thresholds_path)
+        except (OSError, ValueError) as e:
+            print(f"Error loading thresholds from {thresholds_path}: {e}. Using defaults.")
+            thresholds = dict(DEFAULT_THRESHOLDS)
+
+    # Content hash, so every worker that loads the same files reports the same version
+    payload = json.dumps({"rules": rules, "thresholds": thresholds}, sort_keys=True, default=str)
+    version = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+    return RuleSet(version, rules, compiled_rules, build_decision_table(compiled_rules),
+                   thresholds, file_stamps, time.time())
+
+# The active rule set. Readers take one reference per transaction and use it
+# throughout, so a swap never mixes two versions within one decision.
+_current_rule_set = build_rule_set(strict=False)
+_reload_lock = threading.Lock()
+# File stamps of the last rejected edit, so a broken file is not re-parsed on every poll
+_rejected_file_stamps = None
+
+def get_rule_set() -> RuleSet:
+    return _current_rule_set
+
+def reload_rule_set(force: bool = False) -> dict:
+    """
+    Rebuilds the rule set if the policy or thresholds file changed (or always
+    with force=True) and swaps it in. On a validation error the current rule
+    set stays active. Returns {"reloaded", "version", "previous_version", "error"}.
+    """
+    global _current_rule_set, _rejected_file_stamps
+    with _reload_lock:
+        current = _current_rule_set
+        file_stamps = (_file_stamp(DEFAULT_POLICY_DOC), _file_stamp(POLICY_THRESHOLDS_DOC))
+        if not force and file_stamps in (current.file_stamps, _rejected_file_stamps):
+            return {"reloaded": False, "version": current.version, "previous_version": current.version, "error": None}
+        try:
+            new_rule_set = build_rule_set()
+        except Exception as e:
+            print(f"Policy reload rejected, keeping version {current.version}: {e}")
+            _rejected_file_stamps = file_stamps
+            return {"reloaded": False, "version": current.version, "previous_version": current.version, "error": str(e)}
+        _current_rule_set = new_rule_set
+
+    if new_rule_set.version != current.version:
+        print(f"Policy rule set {current.version} replaced by {new_rule_set.version} ({len(new_rule_set.compiled_rules)} rules).")
+    return {"reloaded": True, "version": new_rule_set.version, "previous_version": current.version, "error": None}
+
+_watcher_thread = None
+_watcher_stop = threading.Event()
+
+def _watch_policy_files(interval: float):
+    while not _watcher_stop.wait(interval):
+        try:
+            reload_rule_set()
+        except Exception as e:
+            print(f"Error checking policy files for changes: {e}")
+
+def start_policy_watcher(interval: float = POLICY_RELOAD_INTERVAL):
+    """
+    Starts a daemon thread that polls the policy and thresholds files and
+    reloads on change. Every worker process runs its own watcher, so editing
+    the files updates all workers. interval <= 0 disables it.
+    """
+    global _watcher_thread
+    if interval <= 0 or (_watcher_thread is not None and _watcher_thread.is_alive()):
+        return
+    _watcher_stop.clear()
+    _watcher_thread = threading.Thread(target=_watch_policy_files, args=(interval,), name="policy-watcher", daemon=True)
+    _watcher_thread.start()
+
+def stop_policy_watcher():
+    global _watcher_thread
+    _watcher_stop.set()
+    if _watcher_thread is not None:
+        _watcher_thread.join(timeout=5)
+        _watcher_thread = None
@@ -34,10 +34,11 @@ def upload_policy_docs(name: str = None, content: str = None):
         print(f"Error loading policy docs: {e}")
         return False
 
-def fetch_policy_evidence(query: str, transaction_id: str = "unknown") -> str:
+def fetch_policy_evidence(query: str, transaction_id: str = "unknown", trace_id: str = None) -> str:
     """
     Simple policy retrieval - searches in stored documents
     In production, this would use vector similarity search
+    Pass the pipeline run's trace_id (from its step records) to put the lookup's span in that trace.
     """
     try:
         # Simple keyword matching for demo
@@ -62,7 +63,8 @@ def fetch_policy_evidence(query: str, transaction_id: str = "unknown") -> str:
             component="RAGPolicyRetriever",
             input_data={"query": query},
             description=reason,
-            confidence=0.87
+            confidence=0.87,
+            trace_id=trace_id
         )
         
         return reason
@@ -75,7 +77,8 @@ def fetch_policy_evidence(query: str, transaction_id: str = "unknown") -> str:
             component="RAGPolicyRetriever",
             input_data={"query": query},
             description=error_msg,
-            confidence=0.1
+            confidence=0.1,
+            trace_id=trace_id
         )
         return error_msg
 
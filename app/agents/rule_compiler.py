@@ -0,0 +1,148 @@
+# app/agents/rule_compiler.py
+import ast
+import operator
+
+import numpy as np
+
+# Names a policy condition may reference: transaction fields, checker flags and thresholds
+TRANSACTION_NAMES = {"amount", "card_type", "user_location", "merchant_location", "merchant"}
+FLAG_NAMES = {"amount_flag", "location_flag", "merchant_flag"}
+THRESHOLD_NAMES = {"HIGH_VALUE_TRANSACTION_THRESHOLD", "VIRTUAL_CARD_LIMIT", "EXTREMELY_HIGH_VALUE_DEBIT_THRESHOLD"}
+ALLOWED_NAMES = TRANSACTION_NAMES | FLAG_NAMES | THRESHOLD_NAMES
+
+# Boolean logic, comparisons, arithmetic and literals only: no calls, attributes,
+# subscripts, comprehensions or lambdas
+ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div,
+    ast.Name, ast.Load, ast.Constant, ast.Tuple, ast.List, ast.Set,
+)
+
+# Column-wise equivalents of the whitelisted operators
+_COMPARE_OPERATORS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+    ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+_BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+# Python's `in` applied row by row, for containers that are not literal collections (e.g. substring checks)
+_contains_frame = np.frompyfunc(lambda item, container: item in container, 2, 1)
+
+class RuleCompileError(ValueError):
+    """Raised when a policy condition uses syntax or names outside the whitelist."""
+
+class CompiledRule:
+    """A policy rule whose condition has been parsed, validated and compiled once."""
+    __slots__ = ("rule_id", "condition", "action", "reason", "confidence", "tree", "code")
+
+    def __init__(self, rule_id: str, condition: str, action: str, reason: str, confidence: float,
+                 tree: ast.Expression, code):
+        self.rule_id = rule_id
+        self.condition = condition
+        self.action = action
+        self.reason = reason
+        self.confidence = confidence
+        self.tree = tree
+        self.code = code
+
+    def matches(self, eval_context: dict) -> bool:
+        return bool(eval(self.code, {"__builtins__": {}}, eval_context))
+
+def validate_condition(tree: ast.AST, rule_id: str = "?", allowed_names: set = ALLOWED_NAMES):
+    """Rejects any node type or name outside the whitelist."""
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise RuleCompileError(f"Rule {rule_id}: '{type(node).__name__}' is not allowed in policy conditions.")
+        if isinstance(node, ast.Name) and node.id not in allowed_names:
+            raise RuleCompileError(f"Rule {rule_id}: unknown name '{node.id}' in policy condition.")
+
+def compile_condition(condition: str, rule_id: str = "?", allowed_names: set = ALLOWED_NAMES):
+    """Parses, validates and compiles a condition string. Returns (tree, code)."""
+    try:
+        tree = ast.parse(condition.strip() or "False", mode="eval")
+    except SyntaxError as e:
+        raise RuleCompileError(f"Rule {rule_id}: invalid condition syntax: {e}") from e
+    validate_condition(tree, rule_id, allowed_names)
+    return tree, compile(tree, f"<policy rule {rule_id}>", "eval")
+
+def _membership_frame(left, right, comparator: ast.AST):
+    """
+    Column-wise `left in right`, with the per-row semantics of CompiledRule.matches:
+    equality with an element of a literal tuple/list/set, otherwise Python's
+    `in` on each row's container (a string on the right is a substring check).
+    """
+    if isinstance(comparator, (ast.Tuple, ast.List, ast.Set)):
+        if all(isinstance(element, ast.Constant) for element in comparator.elts):
+            return np.isin(left, right)
+        # Elements referencing columns are compared row by row
+        return np.logical_or.reduce(np.broadcast_arrays(False, *[np.asarray(left == element, dtype=bool) for element in right]))
+    return np.asarray(_contains_frame(left, right), dtype=bool)
+
+def _evaluate_node_frame(node: ast.AST, columns: dict):
+    """Evaluates a validated condition node over NumPy columns (or scalars)."""
+    if isinstance(node, ast.Expression):
+        return _evaluate_node_frame(node.body, columns)
+    if isinstance(node, ast.Name):
+        return columns[node.id]
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        return [_evaluate_node_frame(element, columns) for element in node.elts]
+    if isinstance(node, ast.BoolOp):
+        values = [np.asarray(_evaluate_node_frame(value, columns), dtype=bool) for value in node.values]
+        reducer = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return reducer.reduce(np.broadcast_arrays(*values))
+    if isinstance(node, ast.UnaryOp):
+        operand = _evaluate_node_frame(node.operand, columns)
+        if isinstance(node.op, ast.Not):
+            return np.logical_not(np.asarray(operand, dtype=bool))
+        return -operand if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.BinOp):
+        return _BINARY_OPERATORS[type(node.op)](_evaluate_node_frame(node.left, columns), _evaluate_node_frame(node.right, columns))
+    if isinstance(node, ast.Compare):
+        result = True
+        left = _evaluate_node_frame(node.left, columns)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _evaluate_node_frame(comparator, columns)
+            if isinstance(op, (ast.In, ast.NotIn)):
+                matched = _membership_frame(left, right, comparator)
+                matched = np.logical_not(matched) if isinstance(op, ast.NotIn) else matched
+            else:
+                matched = _COMPARE_OPERATORS[type(op)](left, right)
+            result = np.logical_and(result, matched)
+            left = right
+        return result
+    raise RuleCompileError(f"'{type(node).__name__}' cannot be evaluated column-wise.")
+
+def evaluate_condition_frame(rule: CompiledRule, columns: dict, length: int) -> np.ndarray:
+    """
+    Evaluates a compiled rule over whole columns at once. `columns` maps each
+    allowed name to a NumPy array (transaction fields, flags) or a scalar
+    (thresholds). Returns a boolean array of `length` rows.
+    """
+    result = _evaluate_node_frame(rule.tree, columns)
+    return np.broadcast_to(np.asarray(result, dtype=bool), (length,))
+
+def compile_policy_rules(rules: dict) -> list:
+    """
+    Compiles the loaded policy rules into CompiledRule objects, keeping file
+    order (first match wins). Rules that fail validation are reported and skipped.
+    """
+    compiled_rules = []
+    for rule_id, rule_details in rules.items():
+        condition = rule_details.get("condition", "")
+        try:
+            tree, code = compile_condition(condition, rule_id)
+        except RuleCompileError as e:
+            print(f"Error compiling policy rule {rule_id}: {e} - Condition: {condition}. Rule skipped.")
+            continue
+        compiled_rules.append(CompiledRule(
+            rule_id=rule_id,
+            condition=condition,
+            action=rule_details.get("action", "flag"),
+            reason=rule_details.get("reason", "Policy violation."),
+            confidence=rule_details.get("confidence", 0.9),
+            tree=tree,
+            code=code,
+        ))
+    return compiled_rules
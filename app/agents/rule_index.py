@@ -0,0 +1,203 @@
+# app/agents/rule_index.py
+import ast
+import math
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+# Fields a rule can be bucketed on, most selective first. A rule goes in the
+# bucket of the first of these it pins with == or `in` at the top level.
+INDEXED_FIELDS = ("merchant", "merchant_location", "user_location", "card_type")
+
+# Comparisons of the form `amount <op> bound`, as (is_lower_bound, inclusive)
+_AMOUNT_BOUNDS = {ast.Gt: (True, False), ast.GtE: (True, True), ast.Lt: (False, False), ast.LtE: (False, True)}
+# The same bounds when amount is on the right: `bound <op> amount`
+_MIRRORED = {ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Lt: ast.Gt, ast.LtE: ast.GtE}
+
+class _AmountBucket:
+    """Rules sharing a bucket, sorted by amount lower bound for bisect lookups."""
+    __slots__ = ("entries", "lows")
+
+    def __init__(self):
+        self.entries = []
+        self.lows = []
+
+    def add(self, position: int, bounds: tuple):
+        self.entries.append((bounds[0], bounds[1], bounds[2], bounds[3], position))
+
+    def freeze(self):
+        self.entries.sort(key=lambda entry: (entry[0], entry[4]))
+        self.lows = [entry[0] for entry in self.entries]
+
+    def lookup(self, amount, out: list):
+        if amount is None:
+            out.extend(entry[4] for entry in self.entries)
+            return
+        # Only rules whose lower bound is <= amount can match
+        for index in range(bisect_right(self.lows, amount)):
+            low, low_inclusive, high, high_inclusive, position = self.entries[index]
+            if amount == low and not low_inclusive:
+                continue
+            if amount > high or (amount == high and not high_inclusive):
+                continue
+            out.append(position)
+
+    def lookup_frame(self, amounts: np.ndarray, out: set):
+        """Adds the rules that could match at least one of the sorted amounts (NaN: unknown)."""
+        if len(amounts) == 0:
+            return
+        if np.isnan(amounts[-1]): # NaN sorts last
+            out.update(entry[4] for entry in self.entries)
+            return
+        for low, low_inclusive, high, high_inclusive, position in self.entries:
+            # Smallest amount above the lower bound must not exceed the upper bound
+            start = np.searchsorted(amounts, low, side="left" if low_inclusive else "right")
+            if start < len(amounts) and (amounts[start] < high or (high_inclusive and amounts[start] == high)):
+                out.add(position)
+
+def _conjuncts(tree: ast.AST) -> list:
+    """Top-level AND terms of a condition: each must hold for the rule to match."""
+    node = tree.body if isinstance(tree, ast.Expression) else tree
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        terms = []
+        for value in node.values:
+            terms.extend(_conjuncts(value))
+        return terms
+    return [node]
+
+def _constant(node: ast.AST, thresholds: dict):
+    """Value of a literal or threshold name, or None if not known before evaluation."""
+    if isinstance(node, ast.Constant) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.Name) and node.id in thresholds:
+        return thresholds[node.id]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        value = _constant(node.operand, thresholds)
+        return -value if isinstance(value, (int, float)) else None
+    return None
+
+def analyze_condition(tree: ast.AST, thresholds: dict) -> tuple:
+    """
+    Extracts the discriminating predicates of a condition from its top-level
+    conjunction. Returns (field, values, bounds): the bucket field and the
+    values it must equal (None if unindexed), and amount bounds as
+    (low, low_inclusive, high, high_inclusive).
+    """
+    pinned = {}
+    low, low_inclusive, high, high_inclusive = -math.inf, True, math.inf, True
+
+    for term in _conjuncts(tree):
+        if not isinstance(term, ast.Compare):
+            continue
+        operands = [term.left] + list(term.comparators)
+        for left, op, right in zip(operands, term.ops, operands[1:]):
+            if isinstance(op, ast.Eq):
+                for name_node, value_node in ((left, right), (right, left)):
+                    if isinstance(name_node, ast.Name) and name_node.id in INDEXED_FIELDS:
+                        value = _constant(value_node, {})
+                        if isinstance(value, str):
+                            pinned.setdefault(name_node.id, {value})
+            elif isinstance(op, ast.In) and isinstance(left, ast.Name) and left.id in INDEXED_FIELDS:
+                if isinstance(right, (ast.Tuple, ast.List, ast.Set)) and right.elts:
+                    values = [_constant(element, {}) for element in right.elts]
+                    if all(isinstance(value, str) for value in values):
+                        pinned.setdefault(left.id, set(values))
+            elif type(op) in _AMOUNT_BOUNDS:
+                if isinstance(left, ast.Name) and left.id == "amount":
+                    bound, bound_op = _constant(right, thresholds), type(op)
+                elif isinstance(right, ast.Name) and right.id == "amount":
+                    bound, bound_op = _constant(left, thresholds), _MIRRORED[type(op)]
+                else:
+                    continue
+                if not isinstance(bound, (int, float)) or isinstance(bound, bool):
+                    continue
+                is_lower, inclusive = _AMOUNT_BOUNDS[bound_op]
+                # Keep the tightest bound on each side
+                if is_lower and (bound > low or (bound == low and not inclusive)):
+                    low, low_inclusive = bound, inclusive
+                elif not is_lower and (bound < high or (bound == high and not inclusive)):
+                    high, high_inclusive = bound, inclusive
+
+    for field in INDEXED_FIELDS:
+        if field in pinned:
+            return field, pinned[field], (low, low_inclusive, high, high_inclusive)
+    return None, None, (low, low_inclusive, high, high_inclusive)
+
+class RuleIndex:
+    """
+    Groups compiled rules by their discriminating predicates (merchant,
+    location or card type equality, amount range) so a transaction only
+    evaluates the rules that could match it. Candidates come back in rule
+    order, so first-match priority is unchanged.
+    """
+    def __init__(self, rules: list, thresholds: dict):
+        self.rules = rules
+        self.buckets = {}
+        self.unindexed = _AmountBucket()
+        for position, rule in enumerate(rules):
+            field, values, bounds = analyze_condition(rule.tree, thresholds)
+            if field is None:
+                self.unindexed.add(position, bounds)
+                continue
+            for value in values:
+                bucket = self.buckets.get((field, value))
+                if bucket is None:
+                    bucket = self.buckets[(field, value)] = _AmountBucket()
+                bucket.add(position, bounds)
+        self.unindexed.freeze()
+        for bucket in self.buckets.values():
+            bucket.freeze()
+        self.indexed_fields = tuple(field for field in INDEXED_FIELDS if any(key[0] == field for key in self.buckets))
+        self.bucket_values = {field: [key[1] for key in self.buckets if key[0] == field] for field in self.indexed_fields}
+
+    def candidates(self, context: dict) -> list:
+        """Positions of the rules that could match this evaluation context, in rule order."""
+        amount = context.get("amount")
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool) or amount != amount:
+            amount = None
+        positions = []
+        self.unindexed.lookup(amount, positions)
+        for field in self.indexed_fields:
+            bucket = self.buckets.get((field, context.get(field)))
+            if bucket is not None:
+                bucket.lookup(amount, positions)
+        # Each rule sits in one field's buckets, so positions are unique; restore rule order
+        positions.sort()
+        return positions
+
+    def candidates_frame(self, columns: dict) -> list:
+        """
+        Column-wise version of candidates: positions of the rules that could
+        match at least one row (the union of candidates over the rows), in rule order.
+        `columns` maps field names to equal-length arrays, as in decide_frame.
+        """
+        amounts = pd.Series(np.asarray(columns["amount"], dtype=float))
+        positions = set()
+        self.unindexed.lookup_frame(np.sort(amounts.to_numpy()), positions)
+        for field in self.indexed_fields:
+            values = pd.Series(np.asarray(columns[field], dtype=object))
+            bucketed = values.isin(self.bucket_values[field]).to_numpy()
+            if not bucketed.any():
+                continue
+            for value, group in amounts[bucketed].groupby(values[bucketed].to_numpy()):
+                self.buckets[(field, value)].lookup_frame(np.sort(group.to_numpy()), positions)
+        return sorted(positions)
+
+    def first_match(self, context: dict):
+        """Returns the first rule (in rule order) whose condition matches, or None."""
+        for position in self.candidates(context):
+            rule = self.rules[position]
+            try:
+                if rule.matches(context):
+                    return rule
+            except Exception as e:
+                print(f"Error evaluating policy rule {rule.rule_id}: {e} - Condition: {rule.condition}")
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(self.rules),
+            "buckets": len(self.buckets),
+            "unindexed_rules": len(self.unindexed.entries),
+        }
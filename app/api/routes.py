@@ -1,13 +1,36 @@
 # app/api/routes.py
-from fastapi import APIRouter, HTTPException
+import asyncio
+import hashlib
+import json
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 
-from app.agents.fraud_agent import run_fraud_pipeline
-from app.scope.trace_reader import get_trace_summary, get_trace_verbose
+from app.agents.fraud_agent import run_fraud_pipeline_async, run_fraud_pipeline_batch
+from app.agents.narrative_queue import get_narrative_job, get_narrative_stream
+from app.agents.narrative_agent import narrative_cache, groq_breaker, groq_scheduler
+from app.agents.policy_registry import get_rule_set, reload_rule_set
+from app.agents.merchant_blacklist import get_blacklist
+from app.agents.merchant_fuzzy_index import get_fuzzy_index
+from app.scope.trace_reader import get_trace_summary, get_trace_verbose, get_trace_version
+from app.scope.step_logger import step_log_writer_stats, wait_for_trace_logs
+from app.scope.trace_pubsub import trace_pubsub
+from app.scope.span_exporter import span_exporter_stats
+from app.core.lru_cache import LRUCache
+from app.core.metrics import metrics
+from app.core.app_config import TRACE_CACHE_SIZE, TRACE_STREAM_IDLE_TIMEOUT
 
 router = APIRouter()
 
+# How often an open narrative stream checks for new tokens (seconds)
+NARRATIVE_STREAM_POLL_INTERVAL = 0.05
+
+# Serialized trace responses keyed by (endpoint, transaction_id, trace version)
+trace_response_cache = LRUCache(maxsize=TRACE_CACHE_SIZE)
+metrics.watch_cache("trace_response", trace_response_cache)
+
 # Pydantic model for incoming transaction data
 class TransactionInput(BaseModel):
     transaction_id: str = None
@@ -23,6 +46,19 @@ class SimulationResponse(BaseModel):
     confidence: float
     trace_id: str
     narrative: str
+    narrative_status: str = "complete" # "pending" while a deferred narrative is being generated
+
+# Pydantic model for a deferred narrative lookup
+class NarrativeOutput(BaseModel):
+    trace_id: str
+    narrative_status: str
+    narrative: Optional[str] = None
+
+# Pydantic model for a single result of the batch simulation
+class BatchSimulationItem(BaseModel):
+    status: str
+    confidence: float
+    trace_id: str
 
 # Pydantic model for a single trace step (for verbose output)
 class TraceStep(BaseModel):
@@ -37,6 +73,18 @@ class TraceStep(BaseModel):
     # Add these new fields, making them Optional as they only appear in FinalDecisionAgent step
     final_decision_status: Optional[str] = None
     final_decision_confidence: Optional[float] = None
+    # Wall and CPU time elapsed in the stage that logged the step when it was logged, in milliseconds
+    # (absent for untimed steps); each stage's final duration is in the FinalDecisionAgent step's
+    # input_data["stage_durations_ms"]
+    duration_ms: Optional[float] = None
+    cpu_time_ms: Optional[float] = None
+    # End-to-end pipeline time, only on the FinalDecisionAgent step
+    total_duration_ms: Optional[float] = None
+    total_cpu_time_ms: Optional[float] = None
+    # Span the step was exported as, for joining records with the OTLP span files
+    trace_id: Optional[str] = None
+    span_id: Optional[str] = None
+    parent_span_id: Optional[str] = None
 
 # Pydantic model for verbose trace output
 class VerboseTraceOutput(BaseModel):
@@ -50,40 +98,79 @@ class SummaryTraceOutput(BaseModel):
     final_confidence: float
     final_decision: str
     violations_count: int
+    # Final wall time of each pipeline stage and the pipeline total, in milliseconds, as measured by the
+    # stage timers (the FinalDecisionAgent step's stage_durations_ms); absent for untimed (batch) runs
+    stage_timings_ms: Optional[Dict[str, float]] = None
+    total_duration_ms: Optional[float] = None
+    rule_set_version: Optional[str] = None # Policy rule set that decided the transaction
 
 
 @router.post("/simulate_transaction", response_model=SimulationResponse)
-def simulate_transaction_endpoint(transaction: TransactionInput):
+async def simulate_transaction_endpoint(transaction: TransactionInput, defer_narrative: Optional[bool] = None):
     """
     Receives transaction input, runs the fraud detection pipeline,
-    and returns the result.
+    and returns the result. With defer_narrative=true the narrative is
+    generated in the background and fetched from /narrative/{trace_id}.
     """
     transaction_dict = transaction.dict()
     
-    result = run_fraud_pipeline(transaction_dict)
+    result = await run_fraud_pipeline_async(transaction_dict, defer_narrative=defer_narrative)
     
     return SimulationResponse(
         status=result["status"],
         confidence=result["confidence"],
         trace_id=result["trace_id"],
-        narrative=result["narrative"]
+        narrative=result["narrative"],
+        narrative_status=result["narrative_status"]
     )
 
-@router.get("/trace/summary/{transaction_id}", response_model=SummaryTraceOutput)
-def get_summary_trace(transaction_id: str):
+@router.post("/simulate_transactions/batch", response_model=List[BatchSimulationItem])
+def simulate_transactions_batch_endpoint(transactions: List[TransactionInput]):
     """
-    Retrieves a summary of the agent trace for a given transaction ID.
+    Receives a list of transactions, scores them in one vectorized pass,
+    and returns per-item results in input order.
+    """
+    transaction_dicts = [transaction.dict() for transaction in transactions]
+
+    results = run_fraud_pipeline_batch(transaction_dicts)
+
+    return [BatchSimulationItem(**result) for result in results]
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def _cached_trace_response(request: Request, kind: str, transaction_id: str, build: Callable[[], BaseModel]) -> Response:
+    """
+    Serves a trace response from the LRU cache when the trace version (file
+    size/mtime, index extents or row ids) is unchanged, and answers
+    If-None-Match with 304 when the strong ETag still matches. A trace with
+    records still queued by the buffered writer is built but not cached.
     """
+    version = get_trace_version(transaction_id) if wait_for_trace_logs(transaction_id) else None
+    cache_key = (kind, transaction_id, version)
+    cached = trace_response_cache.get(cache_key) if version is not None else None
+    if cached is None:
+        body = build().json().encode("utf-8")
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        cached = (body, etag)
+        if version is not None:
+            trace_response_cache.put(cache_key, cached)
+
+    body, etag = cached
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+def _build_summary_trace(transaction_id: str) -> SummaryTraceOutput:
     summary = get_trace_summary(transaction_id)
     if not summary or summary.get("final_decision") == "No trace data":
         raise HTTPException(status_code=404, detail="Trace summary not found for this transaction ID.")
     return SummaryTraceOutput(**summary)
 
-@router.get("/trace/verbose/{transaction_id}", response_model=VerboseTraceOutput)
-def get_verbose_trace(transaction_id: str):
-    """
-    Retrieves the detailed verbose agent trace for a given transaction ID.
-    """
+def _build_verbose_trace(transaction_id: str) -> VerboseTraceOutput:
     verbose_data = get_trace_verbose(transaction_id)
     if not verbose_data or not verbose_data.get("steps"):
         raise HTTPException(status_code=404, detail="Verbose trace not found for this transaction ID.")
@@ -97,3 +184,172 @@ def get_verbose_trace(transaction_id: str):
             raise HTTPException(status_code=500, detail=f"Invalid trace step data encountered: {e}")
 
     return VerboseTraceOutput(transaction_id=transaction_id, steps=validated_steps)
+
+@router.get("/trace/summary/{transaction_id}", response_model=SummaryTraceOutput)
+def get_summary_trace(transaction_id: str, request: Request):
+    """
+    Retrieves a summary of the agent trace for a given transaction ID.
+    """
+    return _cached_trace_response(request, "summary", transaction_id, lambda: _build_summary_trace(transaction_id))
+
+@router.get("/trace/verbose/{transaction_id}", response_model=VerboseTraceOutput)
+def get_verbose_trace(transaction_id: str, request: Request):
+    """
+    Retrieves the detailed verbose agent trace for a given transaction ID.
+    """
+    return _cached_trace_response(request, "verbose", transaction_id, lambda: _build_verbose_trace(transaction_id))
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _step_key(step: dict) -> tuple:
+    return step.get("timestamp"), step.get("step"), step.get("component")
+
+def _trace_finished(components: set, batch: bool) -> bool:
+    # Done once the decision and its narrative are both logged (batch decisions have no narrative)
+    return "FinalDecisionAgent" in components and ("NarrativeAgent" in components or batch)
+
+@router.get("/trace/stream/{transaction_id}")
+async def stream_trace(transaction_id: str):
+    """
+    Streams a transaction's trace as server-sent events: one "step" event per
+    logged step (steps already logged first, then each new one as soon as it
+    is logged), then a "done" event once the final decision and the narrative
+    are in, or after TRACE_STREAM_IDLE_TIMEOUT seconds without a new step.
+    Live steps are pushed by the process that logs them. A failed deferred
+    narrative logs a NarrativeAgent step too, so it also ends the stream.
+    """
+    history, subscription = trace_pubsub.subscribe(transaction_id)
+
+    async def events():
+        try:
+            # The store has the steps logged before we subscribed (and those of other processes)
+            stored = (await run_in_threadpool(get_trace_verbose, transaction_id)).get("steps", [])
+            stored_keys = {_step_key(step) for step in stored}
+            steps = stored + [step for step in history if _step_key(step) not in stored_keys]
+
+            seen, components, batch = set(), set(), False
+            reason = "idle"
+            while True:
+                for step in steps:
+                    if _step_key(step) in seen:
+                        continue
+                    seen.add(_step_key(step))
+                    components.add(step.get("component"))
+                    batch = batch or bool(step.get("input_data", {}).get("batch"))
+                    yield _sse_event("step", step)
+                if _trace_finished(components, batch):
+                    reason = "complete"
+                    break
+                try:
+                    steps = [await asyncio.wait_for(subscription.queue.get(), TRACE_STREAM_IDLE_TIMEOUT)]
+                except asyncio.TimeoutError:
+                    break
+            yield _sse_event("done", {"transaction_id": transaction_id, "reason": reason, "steps": len(seen)})
+        finally:
+            trace_pubsub.unsubscribe(transaction_id, subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/narrative/{trace_id}", response_model=NarrativeOutput)
+def get_narrative(trace_id: str):
+    """
+    Retrieves the narrative for a transaction. Deferred narratives report
+    narrative_status "pending" until the background worker has finished.
+    """
+    job = get_narrative_job(trace_id)
+    if job:
+        return NarrativeOutput(**job)
+
+    # Not queued in this process: fall back to the NarrativeAgent step of the trace
+    verbose_data = get_trace_verbose(trace_id)
+    for step_dict in verbose_data.get("steps", []):
+        if step_dict.get("component") == "NarrativeAgent":
+            status = step_dict.get("input_data", {}).get("narrative_status", "complete")
+            return NarrativeOutput(trace_id=trace_id, narrative_status=status, narrative=step_dict.get("description"))
+    raise HTTPException(status_code=404, detail="Narrative not found for this transaction ID.")
+
+@router.get("/narrative/stream/{trace_id}")
+async def stream_narrative(trace_id: str):
+    """
+    Streams a deferred narrative as server-sent events: "token" events with
+    {"text"} while Groq generates it, then one "done" event with the final
+    {"trace_id", "narrative_status", "narrative"}. The done event is
+    authoritative: if the stream broke off and the template fallback was used,
+    its narrative replaces the tokens. Finished narratives arrive as one token.
+    Only deferred narratives (NARRATIVE_MODE=deferred or defer_narrative=true,
+    with NARRATIVE_STREAMING on) are streamed as they are generated; in the
+    default sync mode the narrative is complete before the decision is
+    returned, so this endpoint replays the finished text as a single token.
+    """
+    stream = get_narrative_stream(trace_id)
+    if stream is None:
+        narrative = (await run_in_threadpool(get_narrative, trace_id)).dict()
+        events = [_sse_event("token", {"text": narrative["narrative"] or ""}), _sse_event("done", narrative)]
+        return StreamingResponse(iter(events), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    async def events():
+        sent = 0
+        while True:
+            # Read the flag before the chunks, so the last chunks are never skipped
+            done = stream.done
+            chunks = stream.chunks[sent:]
+            for text in chunks:
+                yield _sse_event("token", {"text": text})
+            sent += len(chunks)
+            if done:
+                break
+            await asyncio.sleep(NARRATIVE_STREAM_POLL_INTERVAL)
+        job = get_narrative_job(trace_id) or {"trace_id": trace_id, "narrative_status": "complete", "narrative": "".join(stream.chunks)}
+        yield _sse_event("done", job)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/stats")
+def get_stats():
+    """
+    Returns operational counters, such as the step log writer's queue depth
+    and dropped records, the trace response and narrative cache hit ratios,
+    the Groq circuit breaker and scheduler state, the span exporter, the
+    active policy rule set version and the loaded merchant blacklist.
+    """
+    return {
+        "step_logger": step_log_writer_stats(),
+        "trace_cache": trace_response_cache.stats(),
+        "narrative_cache": narrative_cache.stats(),
+        "groq_circuit_breaker": groq_breaker.stats(),
+        "groq_scheduler": groq_scheduler.stats(),
+        "trace_streams": trace_pubsub.stats(),
+        "span_exporter": span_exporter_stats(),
+        "policy_rule_set": get_rule_set().info(),
+        "merchant_blacklist": get_blacklist().stats(),
+        "merchant_fuzzy_index": get_fuzzy_index().stats(),
+    }
+
+@router.get("/metrics")
+def get_metrics():
+    """
+    Prometheus text format: decisions by status, per-stage latency histograms
+    (including trace store writes), Groq call outcomes and retries, the step
+    log queue depth and cache hits/misses. With METRICS_MULTIPROC_DIR set,
+    the samples of every worker process are merged.
+    """
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/admin/policies")
+def get_policies():
+    """Returns the active policy rule set: version hash, rule count and thresholds."""
+    return get_rule_set().info()
+
+@router.post("/admin/policies/reload")
+def reload_policies():
+    """
+    Re-reads the policy and thresholds files, validates and compiles them, and
+    swaps the new rule set in without a restart. A rule set that fails
+    validation is rejected and the current one stays active.
+    Only this worker reloads; the file watcher picks up edits in every worker.
+    """
+    result = reload_rule_set(force=True)
+    if result["error"]:
+        raise HTTPException(status_code=422, detail=f"Policy reload rejected: {result['error']}")
+    return result
@@ -23,9 +23,41 @@ FRAUD_MODEL_PATH = os.path.join(MODEL_DIR, "fraud_model.pkl")
 
 # --- Policy Files ---
 DEFAULT_POLICY_DOC = os.path.join(POLICY_DIR, "fraud_rules.txt")
+# Optional JSON object overriding the rule thresholds below, e.g. {"HIGH_VALUE_TRANSACTION_THRESHOLD": 7500}
+POLICY_THRESHOLDS_DOC = os.path.join(POLICY_DIR, "thresholds.json")
+POLICY_RELOAD_INTERVAL = float(os.getenv("POLICY_RELOAD_INTERVAL", "5")) # Seconds between policy file checks; 0 disables hot reload
 
 # --- Logging ---
 LOG_FILE_EXTENSION = ".jsonl"
+# "files" writes one JSONL file per transaction; "segments" appends to rolling segment files with an offset index
+TRACE_STORE_BACKEND = os.getenv("TRACE_STORE_BACKEND", "files")
+TRACE_SEGMENT_DIR = os.path.join(LOG_DIR, "segments")
+TRACE_SEGMENT_MAX_BYTES = int(os.getenv("TRACE_SEGMENT_MAX_BYTES", str(256 * 1024 * 1024)))
+TRACE_SEGMENT_INDEX_CACHE = int(os.getenv("TRACE_SEGMENT_INDEX_CACHE", "100000")) # Traces whose segment extents are kept in memory by readers
+TRACE_CACHE_SIZE = int(os.getenv("TRACE_CACHE_SIZE", "1024")) # Parsed trace responses kept per process
+TRACE_GZIP_MIN_BYTES = 1024 # Responses larger than this are gzipped for clients that accept it
+TRACE_ACCUMULATORS_RETAINED = 10000 # In-flight traces whose running totals are kept for materialized summaries
+TRACE_STREAM_IDLE_TIMEOUT = float(os.getenv("TRACE_STREAM_IDLE_TIMEOUT", "60")) # Seconds without a new step before a trace stream closes
+# "sync" writes each step on the calling thread; "buffered" hands steps to a background writer thread
+STEP_LOG_WRITE_MODE = os.getenv("STEP_LOG_WRITE_MODE", "sync")
+STEP_LOG_QUEUE_SIZE = int(os.getenv("STEP_LOG_QUEUE_SIZE", "10000")) # Records beyond this are dropped (and counted)
+STEP_LOG_BATCH_SIZE = 1000 # Max records written per flush of the buffered writer
+STEP_LOG_FSYNC_INTERVAL = float(os.getenv("STEP_LOG_FSYNC_INTERVAL", "1.0")) # Seconds between fsyncs
+STEP_LOG_FSYNC_RECORDS = int(os.getenv("STEP_LOG_FSYNC_RECORDS", "1000")) # ...or after this many records
+STEP_LOG_READ_WAIT = float(os.getenv("STEP_LOG_READ_WAIT", "2.0")) # Seconds a trace read waits for that trace's queued records
+# Finished spans (pipeline stages, logged steps, Groq HTTP calls) are written as OTLP/JSON batches to local files
+SPAN_EXPORT_DIR = os.getenv("SPAN_EXPORT_DIR", "") # Opt-in: set a directory (e.g. app/agent_logs/spans) to export spans
+SPAN_EXPORT_QUEUE_SIZE = int(os.getenv("SPAN_EXPORT_QUEUE_SIZE", "10000")) # Spans beyond this are dropped (and counted)
+SPAN_EXPORT_BATCH_SIZE = 512 # Max spans per export request line
+SPAN_EXPORT_INTERVAL = float(os.getenv("SPAN_EXPORT_INTERVAL", "1.0")) # Seconds a batch waits to fill up
+SPAN_EXPORT_MAX_FILE_BYTES = int(os.getenv("SPAN_EXPORT_MAX_FILE_BYTES", str(64 * 1024 * 1024))) # A new span file is started past this size
+SPAN_SERVICE_NAME = os.getenv("SPAN_SERVICE_NAME", "finguard-agents")
+
+# --- Metrics ---
+# Shared directory for GET /metrics across uvicorn workers: each worker writes its samples there and any
+# worker merges them. Empty serves only the answering process's metrics. Clear it when the server starts.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5")) # Seconds between a worker's snapshot writes
 
 # --- Suggested Confidence Thresholds (from your rules) ---
 CONFIDENCE_THRESHOLD = 0.85 # Transactions > 0.85 are "Approve" (Safe) or "Fraud"
@@ -35,15 +67,57 @@ FALLBACK_THRESHOLD = 0.60  # Transactions 0.60 - 0.85 are "Manual Review" (Escal
 VIRTUAL_CARD_LIMIT = 3000.0 # Example value for virtual card limit (for F2.1)
 HIGH_VALUE_TRANSACTION_THRESHOLD = 5000.0 # For E1.1: Amount > $5000
 EXTREMELY_HIGH_VALUE_DEBIT_THRESHOLD = 100000.0 # New: For extremely high value debit transactions
-RISKY_MERCHANTS = {"fraud_kirlin", "shady_importsng", "unverified_gadgetx"} # For F1.1
+RISKY_MERCHANTS = {"fraud_kirlin", "shady_importsng", "unverified_gadgetx"} # For F1.1; used only when there is no blacklist file
+
+# --- Merchant Blacklist ---
+# Sorted hashed merchant keys built with build_merchant_blacklist.py, memory-mapped by every worker
+MERCHANT_BLACKLIST_PATH = os.getenv("MERCHANT_BLACKLIST_PATH", os.path.join(POLICY_DIR, "merchant_blacklist.npy"))
+MERCHANT_BLACKLIST_RELOAD_INTERVAL = float(os.getenv("MERCHANT_BLACKLIST_RELOAD_INTERVAL", "5")) # Seconds between checks for a swapped file
+MERCHANT_BLACKLIST_BLOOM_BITS_PER_KEY = 10 # ~1% false positive Bloom filter in front of the keys; 0 disables it
+# Deletion index of the blacklisted names, for near-matches such as "fraud_kirl1n"
+MERCHANT_FUZZY_INDEX_PATH = os.getenv("MERCHANT_FUZZY_INDEX_PATH", MERCHANT_BLACKLIST_PATH + ".fuzzy")
+MERCHANT_FUZZY_MAX_DISTANCE = int(os.getenv("MERCHANT_FUZZY_MAX_DISTANCE", "1")) # Max edits for a near-match; 0 disables fuzzy matching
+MERCHANT_FUZZY_MIN_LENGTH = 5 # Shorter merchant names are only matched exactly
 
 # --- LLM API Configuration (for Groq) ---
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
 # IMPORTANT: Read API key from environment variable for security
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
-    print("WARNING: GROQ_API_KEY environment variable not set. Narrative generation may fail.")
+    print("WARNING: GROQ_API_KEY environment variable not set. Narratives will use the built-in templates.")
 GROQ_MODEL_NAME = "llama3-8b-8192"
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "100")) # Keep-alive pool size of the shared sync session and the async client
+GROQ_CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "3")) # Seconds to establish a connection
+GROQ_READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "10")) # Seconds to wait for the response
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "5"))
+# Consecutive failed Groq calls before the circuit breaker opens, and seconds before a half-open probe
+GROQ_BREAKER_FAILURE_THRESHOLD = int(os.getenv("GROQ_BREAKER_FAILURE_THRESHOLD", "5"))
+GROQ_BREAKER_RESET_TIMEOUT = float(os.getenv("GROQ_BREAKER_RESET_TIMEOUT", "30"))
+# Provider rate limits enforced before every Groq attempt, retries included (requests and tokens per minute);
+# 0 disables a limit. The buckets are per process: N uvicorn workers together allow N times these limits.
+GROQ_RPM_LIMIT = int(os.getenv("GROQ_RPM_LIMIT", "30"))
+GROQ_TPM_LIMIT = int(os.getenv("GROQ_TPM_LIMIT", "30000"))
+
+# --- Narrative Generation ---
+# "sync" generates the narrative before the decision is returned;
+# "deferred" returns the decision right away and generates the narrative in the background.
+NARRATIVE_MODE = os.getenv("NARRATIVE_MODE", "sync")
+NARRATIVE_WORKERS = int(os.getenv("NARRATIVE_WORKERS", "4")) # Background narrative worker threads
+NARRATIVE_JOBS_RETAINED = 10000 # Narrative jobs kept in memory for GET /narrative/{trace_id}
+# Deferred narratives waiting for a worker; past this, the narrative is rendered from the built-in template instead
+NARRATIVE_QUEUE_SIZE = int(os.getenv("NARRATIVE_QUEUE_SIZE", "1000"))
+# Optional local URL the narrative worker POSTs {"trace_id", "narrative_status", "narrative"} to when done
+NARRATIVE_CALLBACK_URL = os.getenv("NARRATIVE_CALLBACK_URL")
+# Deferred narratives stream Groq tokens to GET /narrative/stream/{trace_id} as they are generated
+NARRATIVE_STREAMING = os.getenv("NARRATIVE_STREAMING", "true").lower() == "true"
+# Narratives are cached as templates keyed by the flag signature (amount/location/merchant flags, policy, fallback reason)
+NARRATIVE_CACHE_SIZE = int(os.getenv("NARRATIVE_CACHE_SIZE", "512")) # Templates kept per process; 0 disables the cache
+NARRATIVE_CACHE_TTL = float(os.getenv("NARRATIVE_CACHE_TTL", "3600")) # Seconds before a template is regenerated
+# Narrative tier per final status: "template" renders the built-in text without calling the LLM,
+# "llm" asks Groq (and falls back to the template if Groq fails or GROQ_API_KEY is not set)
+NARRATIVE_TIERS = os.getenv("NARRATIVE_TIERS", "safe:template,fraud:llm,escalated:llm")
+NARRATIVE_DEFAULT_TIER = "llm" # For statuses not listed in NARRATIVE_TIERS
+NARRATIVE_DEADLINE = float(os.getenv("NARRATIVE_DEADLINE", "8")) # Seconds a pipeline run may spend on the LLM, retries included
 
 # --- Backend API URL Configuration ---
 # This is crucial for your Streamlit frontend to connect to the FastAPI backend.
@@ -0,0 +1,113 @@
+# app/core/circuit_breaker.py
+import threading
+import time
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker. After `failure_threshold` consecutive
+    failures it opens and rejects calls for `reset_timeout` seconds, then lets
+    a single half-open probe through: success closes it, failure reopens it.
+    A probe that reports no outcome within `probe_timeout` seconds (e.g. its
+    caller was cancelled) is treated as failed.
+    """
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, probe_timeout: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout if probe_timeout is not None else reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._probe_in_flight and time.monotonic() - self._probe_started >= self.probe_timeout:
+            print(f"Circuit breaker '{self.name}' probe reported no outcome within {self.probe_timeout}s. Reopening.")
+            self._open()
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return self._state
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected (open and not yet due for a probe)."""
+        with self._lock:
+            state = self._current_state()
+            return state == "open" or (state == "half_open" and self._probe_in_flight)
+
+    def allow_request(self) -> bool:
+        """Claims permission for one call. Every allowed call must report record_success or record_failure."""
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probe_in_flight:
+                self._state = "half_open"
+                self._probe_in_flight = True
+                self._probe_started = time.monotonic()
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+            if self._state != "closed":
+                print(f"Circuit breaker '{self.name}' closed after a successful probe.")
+            self._state = "closed"
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            was_probe = self._probe_in_flight
+            self._probe_in_flight = False
+            if was_probe or (self._state == "closed" and self._consecutive_failures >= self.failure_threshold):
+                if self._state == "closed":
+                    print(f"Circuit breaker '{self.name}' opened after {self._consecutive_failures} consecutive failures.")
+                    self.times_opened += 1
+                self._open()
+
+    def record_abandoned(self):
+        """
+        For an allowed call that ended without an outcome (cancelled or
+        interrupted): a probe counts as failed, so the breaker reopens instead
+        of waiting on it; other calls are not counted either way.
+        """
+        with self._lock:
+            if self._probe_in_flight:
+                self.failures += 1
+                self._consecutive_failures += 1
+                self._open()
+
+    def _open(self):
+        self._probe_in_flight = False
+        self._state = "open"
+        self._opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            state = self._current_state()
+            return {
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "seconds_until_probe": round(max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)), 2) if state == "open" else 0.0,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+            }
@@ -0,0 +1,213 @@
+# app/core/llm_scheduler.py
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# Waiters that are not first in line re-check the queue this often (seconds)
+_POLL_INTERVAL = 0.02
+
+class TokenBucket:
+    """Refills continuously at `per_minute` per minute up to a burst of `per_minute`. Not locked; the scheduler holds its lock."""
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (a request larger than the burst waits for a full bucket)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+class LLMScheduler:
+    """
+    Sits in front of an LLM call. Identical in-flight requests (same key) are
+    coalesced into one call whose result every caller receives, and calls
+    are admitted through request- and token-per-minute buckets. When the
+    buckets are empty, waiters are admitted by priority (lower first), then
+    in arrival order. A limit of 0 disables that bucket.
+    """
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int):
+        self.name = name
+        self._buckets = []
+        if requests_per_minute > 0:
+            self._buckets.append((TokenBucket(requests_per_minute), False))
+        if tokens_per_minute > 0:
+            self._buckets.append((TokenBucket(tokens_per_minute), True))
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._waiting = [] # Heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self.calls = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # --- Admission -------------------------------------------------------
+
+    def _enqueue(self, priority: int) -> tuple:
+        ticket = (priority, next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _abandon(self, ticket: tuple):
+        with self._lock:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+
+    def _try_admit(self, ticket: tuple, cost: float) -> float:
+        """Admits the ticket if it is first in line and the buckets allow it. Returns 0 if admitted, else seconds to wait."""
+        with self._lock:
+            if self._waiting[0] != ticket:
+                return _POLL_INTERVAL
+            now = time.monotonic()
+            wait = max((bucket.wait_time(cost if by_tokens else 1, now) for bucket, by_tokens in self._buckets), default=0.0)
+            if wait > 0:
+                return wait
+            for bucket, by_tokens in self._buckets:
+                bucket.take(cost if by_tokens else 1)
+            heapq.heappop(self._waiting)
+            return 0.0
+
+    def _record_wait(self, waited: float, admitted: bool):
+        with self._lock:
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            if not admitted:
+                self.rate_limited += 1
+
+    def acquire(self, cost: float, priority: int, deadline: float) -> bool:
+        """Blocks until admitted (True) or until the deadline leaves no time (False)."""
+        ticket = self._enqueue(priority)
+        while True:
+            wait = self._try_admit(ticket, cost)
+            if wait == 0:
+                return True
+            if wait > deadline - time.monotonic():
+                self._abandon(ticket)
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, cost: float, priority: int, deadline: float) -> bool:
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                wait = self._try_admit(ticket, cost)
+                if wait == 0:
+                    return True
+                if wait > deadline - time.monotonic():
+                    self._abandon(ticket)
+                    return False
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self._abandon(ticket)
+            raise
+
+    # --- Single flight ---------------------------------------------------
+
+    def _join(self, key) -> tuple:
+        """Returns (future, is_leader): the leader makes the call, everyone else waits on its future."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._in_flight[key] = Future()
+            self.calls += 1
+            return future, True
+
+    def _finish(self, key, future: Future, result=None, error: BaseException = None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    @staticmethod
+    def _info(start: float, coalesced: bool, priority: int) -> dict:
+        return {"queue_wait_ms": round((time.monotonic() - start) * 1000, 2), "coalesced": coalesced, "priority": priority}
+
+    def run(self, key, call, cost: float, priority: int, deadline: float) -> tuple:
+        """
+        Runs call() through the scheduler. Returns (result, info), where result
+        is None if the call could not start (or finish, for coalesced callers)
+        before the deadline, and info holds queue_wait_ms, coalesced and priority.
+        """
+        start = time.monotonic()
+        future, is_leader = self._join(key)
+        if not is_leader:
+            try:
+                result = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except FutureTimeoutError:
+                result = None
+            return result, self._info(start, True, priority)
+
+        result = None
+        try:
+            admitted = self.acquire(cost, priority, deadline)
+            info = self._info(start, False, priority)
+            self._record_wait(info["queue_wait_ms"] / 1000, admitted)
+            if admitted:
+                result = call()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, info
+
+    async def run_async(self, key, call, cost: float, priority: int, deadline: float) -> tuple:
+        """Async version of run; `call` is a coroutine function."""
+        start = time.monotonic()
+        future, is_leader = self._join(key)
+        if not is_leader:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                result = None
+            return result, self._info(start, True, priority)
+
+        result = None
+        try:
+            admitted = await self.acquire_async(cost, priority, deadline)
+            info = self._info(start, False, priority)
+            self._record_wait(info["queue_wait_ms"] / 1000, admitted)
+            if admitted:
+                result = await call()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, info
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            levels = {}
+            for bucket, by_tokens in self._buckets:
+                bucket.wait_time(0, now)
+                levels["tokens_available" if by_tokens else "requests_available"] = round(bucket.tokens, 1)
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "rate_limited": self.rate_limited,
+                "waiting": len(self._waiting),
+                "in_flight": len(self._in_flight),
+                "avg_queue_wait_ms": round(self.total_wait / self.calls * 1000, 2) if self.calls else 0.0,
+                "max_queue_wait_ms": round(self.max_wait * 1000, 2),
+                **levels,
+            }
@@ -0,0 +1,288 @@
+# app/core/metrics.py
+import bisect
+import glob
+import json
+import math
+import os
+import threading
+
+from app.core.app_config import METRICS_MULTIPROC_DIR, METRICS_FLUSH_INTERVAL
+
+# Latency buckets in seconds, from sub-millisecond stages up to slow LLM calls
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names, values, extra: tuple = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _ThreadShards:
+    """
+    One dict of samples per thread. Recording only touches the calling
+    thread's dict, so the hot path takes no lock; the lock is only held to
+    register a new thread and to list the dicts when collecting.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+
+    def shard(self) -> dict:
+        shard = getattr(self._local, "samples", None)
+        if shard is None:
+            shard = self._local.samples = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def shards(self) -> list:
+        with self._lock:
+            # dict.copy runs without releasing the GIL, so a concurrent writer cannot tear it
+            return [shard.copy() for shard in self._shards]
+
+class Counter:
+    """Monotonic counter, optionally split by labels: counter.inc(status="fraud")."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._samples = _ThreadShards()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        shard = self._samples.shard()
+        shard[key] = shard.get(key, 0) + amount
+
+    def collect(self) -> dict:
+        totals = {}
+        for shard in self._samples.shards():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+class Histogram:
+    """Cumulative-bucket histogram: histogram.observe(seconds, stage="MLScorer")."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._samples = _ThreadShards()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        shard = self._samples.shard()
+        counts = shard.get(key)
+        if counts is None:
+            # One count per bucket plus the +Inf bucket, then the sum
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self) -> dict:
+        totals = {}
+        for shard in self._samples.shards():
+            for key, counts in shard.items():
+                merged = totals.setdefault(key, [0] * len(counts))
+                for i, value in enumerate(list(counts)):
+                    merged[i] += value
+        return totals
+
+class CallbackMetric:
+    """
+    Counter or gauge whose samples are read from `callback()` at collection
+    time, as {label_values_tuple: value}. Used for values other components
+    already keep, such as queue depth and cache hit counts.
+    """
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: tuple, callback):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def collect(self) -> dict:
+        try:
+            return {tuple(str(value) for value in key): value for key, value in self.callback().items()}
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return {}
+
+class MetricsRegistry:
+    """
+    Process-wide set of metrics rendered in the Prometheus text format.
+    With METRICS_MULTIPROC_DIR set, every worker process writes its samples
+    to <dir>/metrics-<pid>.json (every METRICS_FLUSH_INTERVAL seconds and on
+    shutdown), and render() merges all files, so any worker answers /metrics
+    for the whole server. Counters and histograms are summed over every file;
+    gauges only over processes that are still running. Clear the directory
+    when the server (re)starts.
+    """
+    def __init__(self, multiprocess_directory: str = METRICS_MULTIPROC_DIR):
+        self.multiprocess_directory = multiprocess_directory
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._caches = {}
+        self._flush_stop = threading.Event()
+        self._flush_thread = None
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, kind: str, callback, labelnames: tuple = ()) -> CallbackMetric:
+        return self._register(CallbackMetric(name, documentation, kind, labelnames, callback))
+
+    def watch_cache(self, name: str, cache):
+        """Exports an LRUCache's hit and miss counts as cache_hits_total / cache_misses_total{cache=name}."""
+        with self._lock:
+            self._caches[name] = cache
+        self.callback("cache_hits_total", "Cache lookups that found an entry.", "counter",
+                      lambda: {(cache_name,): c.stats()["hits"] for cache_name, c in list(self._caches.items())}, ("cache",))
+        self.callback("cache_misses_total", "Cache lookups that missed.", "counter",
+                      lambda: {(cache_name,): c.stats()["misses"] for cache_name, c in list(self._caches.items())}, ("cache",))
+
+    # --- Collection ------------------------------------------------------
+
+    def collect(self) -> dict:
+        """This process's samples: {name: {kind, help, labelnames, buckets, samples: [[labels, value], ...]}}."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        families = {}
+        for metric in metrics:
+            families[metric.name] = {
+                "kind": metric.kind,
+                "help": metric.documentation,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": [[list(key), value] for key, value in metric.collect().items()],
+            }
+        return families
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiprocess_directory, f"metrics-{pid}.json")
+
+    def write_snapshot(self):
+        """Writes this process's samples to the multiprocess directory (atomically)."""
+        if not self.multiprocess_directory:
+            return
+        os.makedirs(self.multiprocess_directory, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"pid": os.getpid(), "families": self.collect()}, f)
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def _process_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _merged_families(self) -> dict:
+        if not self.multiprocess_directory:
+            return self.collect()
+        try:
+            self.write_snapshot()
+        except OSError as e:
+            print(f"Error writing metrics snapshot: {e}")
+        merged = {}
+        for path in sorted(glob.glob(os.path.join(self.multiprocess_directory, "metrics-*.json"))):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error reading metrics snapshot {path}: {e}")
+                continue
+            alive = snapshot.get("pid") == os.getpid() or self._process_alive(snapshot.get("pid", 0))
+            for name, family in snapshot["families"].items():
+                if family["kind"] == "gauge" and not alive:
+                    continue
+                target = merged.setdefault(name, dict(family, samples=[]))
+                samples = {tuple(labels): value for labels, value in target["samples"]}
+                for labels, value in family["samples"]:
+                    key = tuple(labels)
+                    if family["kind"] == "histogram":
+                        current = samples.get(key) or [0] * len(value)
+                        samples[key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        samples[key] = samples.get(key, 0) + value
+                target["samples"] = [[list(key), value] for key, value in samples.items()]
+        return merged
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, family in sorted(self._merged_families().items()):
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            labelnames = family["labelnames"]
+            for labels, value in sorted(family["samples"], key=lambda sample: sample[0]):
+                if family["kind"] != "histogram":
+                    lines.append(f"{name}{_label_text(labelnames, labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(family["buckets"]) + [math.inf], value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_label_text(labelnames, labels, ('le', _format_value(bound)))} {cumulative}")
+                lines.append(f"{name}_sum{_label_text(labelnames, labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_label_text(labelnames, labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    # --- Multiprocess flushing -------------------------------------------
+
+    def _flush_periodically(self, interval: float):
+        while not self._flush_stop.wait(interval):
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                print(f"Error writing metrics snapshot: {e}")
+
+    def start_flusher(self, interval: float = METRICS_FLUSH_INTERVAL):
+        """Starts the thread that writes this worker's snapshot. Does nothing without a multiprocess directory."""
+        if not self.multiprocess_directory or interval <= 0 or (self._flush_thread is not None and self._flush_thread.is_alive()):
+            return
+        self._flush_stop.clear()
+        self._flush_thread = threading.Thread(target=self._flush_periodically, args=(interval,), name="metrics-flusher", daemon=True)
+        self._flush_thread.start()
+
+    def stop_flusher(self):
+        """Stops the flusher and writes a last snapshot, so counts recorded before shutdown are kept."""
+        self._flush_stop.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join(timeout=5)
+            self._flush_thread = None
+        try:
+            self.write_snapshot()
+        except OSError as e:
+            print(f"Error writing metrics snapshot: {e}")
+
+# Shared by every module in the process
+metrics = MetricsRegistry()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from app.db.base import Base
 import os
@@ -15,6 +15,17 @@ engine = create_engine(
     connect_args={"check_same_thread": False}  # Required for SQLite with FastAPI
 )
 
+# Tune SQLite for a write-heavy trace log: WAL lets readers run alongside the single writer
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000") # ~20 MB page cache
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 # Create a configured session class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -30,4 +30,28 @@ class AgentScopeLog(Base):
     confidence = Column(Float)
     policy_violation = Column(Boolean, default=False)
     policy_id = Column(String, nullable=True)
+    timestamp = Column(String) # ISO timestamp as written by StepLogger
+    final_decision_status = Column(String, nullable=True)
+    final_decision_confidence = Column(Float, nullable=True)
+    duration_ms = Column(Float, nullable=True) # Wall time elapsed in the stage that logged the step, when it was logged
+    cpu_time_ms = Column(Float, nullable=True)
+    total_duration_ms = Column(Float, nullable=True) # End-to-end pipeline time, on FinalDecisionAgent only
+    total_cpu_time_ms = Column(Float, nullable=True)
+    trace_id = Column(String, nullable=True) # Span the step was exported as (see app/scope/spans.py)
+    span_id = Column(String, nullable=True)
+    parent_span_id = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class TraceSummary(Base):
+    __tablename__ = "trace_summaries"
+
+    transaction_id = Column(String, primary_key=True)
+    agents_triggered = Column(JSON)
+    violations_count = Column(Integer)
+    final_decision = Column(String)
+    final_confidence = Column(Float)
+    stage_timings_ms = Column(JSON, nullable=True) # Final wall time of each pipeline stage (StageTimer)
+    total_duration_ms = Column(Float, nullable=True) # End-to-end pipeline time
+    rule_set_version = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,7 +1,15 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from app.api.routes import router
 from app.db.database import init_db
+from app.core.app_config import TRACE_GZIP_MIN_BYTES
+from app.agents.narrative_queue import shutdown_narrative_workers
+from app.agents.narrative_agent import close_async_client, close_http_session
+from app.scope.step_logger import flush_step_logs
+from app.scope.span_exporter import flush_spans
+from app.agents.policy_registry import start_policy_watcher, stop_policy_watcher
+from app.core.metrics import metrics
 
 # Initialize database tables
 init_db()
@@ -21,9 +29,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses (mostly verbose traces) for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=TRACE_GZIP_MIN_BYTES)
+
 # Include all API routes
 app.include_router(router)
 
+# Pick up policy rule and threshold edits without restarting the worker,
+# and share this worker's metrics with the others (multiprocess mode only)
+@app.on_event("startup")
+def on_startup():
+    start_policy_watcher()
+    metrics.start_flusher()
+
+# Let queued deferred narratives finish and flush buffered step logs before the worker exits
+@app.on_event("shutdown")
+async def on_shutdown():
+    stop_policy_watcher()
+    shutdown_narrative_workers(wait=True)
+    await close_async_client()
+    close_http_session()
+    flush_step_logs()
+    flush_spans()
+    metrics.stop_flusher()
+
 # Health check route
 @app.get("/")
 def root():
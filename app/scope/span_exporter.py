@@ -0,0 +1,168 @@
+# app/scope/span_exporter.py
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from app.core.app_config import (
+    SPAN_EXPORT_DIR, SPAN_EXPORT_QUEUE_SIZE, SPAN_EXPORT_BATCH_SIZE, SPAN_EXPORT_INTERVAL,
+    SPAN_EXPORT_MAX_FILE_BYTES, SPAN_SERVICE_NAME
+)
+
+def _attribute_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)} # int64 values are strings in OTLP/JSON
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, str):
+        return {"stringValue": value}
+    return {"stringValue": json.dumps(value, default=str)}
+
+def _attributes(attributes: dict) -> list:
+    return [{"key": key, "value": _attribute_value(value)} for key, value in attributes.items() if value is not None]
+
+def encode_span(span) -> dict:
+    """One span in the OTLP/JSON encoding (hex IDs, nanosecond timestamps as strings)."""
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _attributes(span.attributes),
+        "status": {"code": span.status_code},
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    if span.status_message:
+        encoded["status"]["message"] = span.status_message
+    return encoded
+
+def encode_batch(spans: list, service_name: str = SPAN_SERVICE_NAME) -> dict:
+    """An OTLP ExportTraceServiceRequest holding the spans."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": service_name, "process.pid": os.getpid()})},
+            "scopeSpans": [{
+                "scope": {"name": "app.scope.spans"},
+                "spans": [encode_span(span) for span in spans],
+            }],
+        }],
+    }
+
+class SpanFileExporter:
+    """
+    Background exporter for finished spans. export() puts spans on a bounded
+    queue (dropping and counting them when it is full, like the step log
+    writer); a daemon thread writes them in batches as OTLP/JSON export
+    requests, one JSON object per line, to spans-<pid>-<timestamp>.jsonl files
+    under `directory`, starting a new file past max_file_bytes. This is the
+    file format of the OpenTelemetry Collector's otlpjsonfile receiver.
+    """
+    def __init__(self, directory: str = SPAN_EXPORT_DIR, queue_size: int = SPAN_EXPORT_QUEUE_SIZE,
+                 batch_size: int = SPAN_EXPORT_BATCH_SIZE, interval: float = SPAN_EXPORT_INTERVAL,
+                 max_file_bytes: int = SPAN_EXPORT_MAX_FILE_BYTES):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_file_bytes = max_file_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stats_lock = threading.Lock()
+        self._dropped_spans = 0
+        self._exported_spans = 0
+        self._batches = 0
+        self._path = None
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            with self._stats_lock:
+                self._dropped_spans += 1
+                if self._dropped_spans == 1:
+                    print(f"WARNING: Span export queue full ({self._queue.maxsize} spans). Dropping spans.")
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.interval)]
+            except queue.Empty:
+                continue
+            # Wait up to one interval for a fuller batch, so files get fewer, larger export requests
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"ERROR: Failed to export {len(batch)} spans: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _current_path(self) -> str:
+        if self._path is None or (os.path.exists(self._path) and os.path.getsize(self._path) >= self.max_file_bytes):
+            self._path = os.path.join(self.directory, f"spans-{os.getpid()}-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}.jsonl")
+        return self._path
+
+    def _write_batch(self, batch: list):
+        line = json.dumps(encode_batch(batch), separators=(",", ":")) + "\n"
+        with open(self._current_path(), "a", encoding="utf-8") as f:
+            f.write(line)
+        with self._stats_lock:
+            self._exported_spans += len(batch)
+            self._batches += 1
+
+    def flush(self):
+        """Blocks until every queued span has been written."""
+        self._queue.join()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "directory": self.directory,
+                "queue_depth": self._queue.qsize(),
+                "dropped_spans": self._dropped_spans,
+                "exported_spans": self._exported_spans,
+                "batches": self._batches,
+            }
+
+# One exporter thread per process, started on the first finished span
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def get_span_exporter():
+    """The process's exporter, or None when SPAN_EXPORT_DIR is empty (export disabled)."""
+    global _exporter
+    if _exporter is None and SPAN_EXPORT_DIR:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = SpanFileExporter()
+    return _exporter
+
+def export_span(span):
+    exporter = get_span_exporter()
+    if exporter is not None:
+        exporter.export(span)
+
+def flush_spans():
+    """Writes out any queued spans. Called on application shutdown."""
+    if _exporter is not None:
+        _exporter.flush()
+
+def span_exporter_stats() -> dict:
+    stats = {"enabled": bool(SPAN_EXPORT_DIR)}
+    if _exporter is not None:
+        stats.update(_exporter.stats())
+    return stats
@@ -0,0 +1,131 @@
+# app/scope/spans.py
+import random
+import time
+from contextvars import ContextVar
+
+from app.scope.span_exporter import export_span
+
+# OTLP span kinds used here
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+# OTLP status codes
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+# Innermost open span in this thread / asyncio task
+_current_span = ContextVar("current_span", default=None)
+
+_random = random.Random()
+
+def _new_span_id() -> str:
+    return f"{_random.getrandbits(64) or 1:016x}"
+
+class Span:
+    """
+    One timed operation: trace_id, span_id, parent_id, start and end (Unix
+    nanoseconds) plus attributes. A root span starts at the wall clock time;
+    children and ends add perf_counter elapsed time, so durations are monotonic.
+    `child_cursor_ns` is the end of the last child that finished; a step span
+    starts there, covering the work since the previous child.
+    """
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "start_ns", "end_ns",
+                 "attributes", "status_code", "status_message", "child_cursor_ns", "_parent", "_started_perf", "_token")
+
+    def __init__(self, name: str, trace_id: str, parent=None, kind: int = SPAN_KIND_INTERNAL,
+                 attributes: dict = None, start_ns: int = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_span_id()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.kind = kind
+        if start_ns is None:
+            # Children read the parent's clock, so the whole trace is on one monotonic timeline
+            start_ns = parent.now_ns() if parent is not None else time.time_ns()
+        self.start_ns = start_ns
+        self.end_ns = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.status_code = STATUS_UNSET
+        self.status_message = None
+        self.child_cursor_ns = self.start_ns
+        self._parent = parent
+        self._started_perf = time.perf_counter_ns()
+        self._token = None
+
+    def now_ns(self) -> int:
+        """Current time on this span's clock (its start plus the monotonic elapsed time)."""
+        return self.start_ns + (time.perf_counter_ns() - self._started_perf)
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_error(self, message: str):
+        self.status_code = STATUS_ERROR
+        self.status_message = message
+
+    def end(self, end_ns: int = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns if end_ns is not None else self.now_ns()
+        if self._parent is not None:
+            self._parent.child_cursor_ns = max(self._parent.child_cursor_ns, self.end_ns)
+        export_span(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.set_error(f"{exc_type.__name__}: {exc}")
+        self.end()
+        return False
+
+def current_span():
+    return _current_span.get()
+
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, attributes: dict = None, trace_id: str = None) -> Span:
+    """
+    A span to use as a context manager. It is a child of the current span;
+    without one it starts a trace (trace_id, or a random one).
+    """
+    parent = _current_span.get()
+    if parent is not None and (trace_id is None or trace_id == parent.trace_id):
+        return Span(name, parent.trace_id, parent, kind, attributes)
+    return Span(name, trace_id or f"{_random.getrandbits(128) or 1:032x}", None, kind, attributes)
+
+class attach_span:
+    """
+    Makes `span` the current span for the block without ending it, so work
+    handed to another thread (e.g. a deferred narrative) nests under it.
+    """
+    def __init__(self, span):
+        self.span = span
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        return False
+
+def record_step_span(transaction_id: str, name: str, attributes: dict, trace_id: str = None) -> Span:
+    """
+    Exports a logged step as a finished span. Inside a span of the pipeline
+    run (also attached in deferred narrative workers) it is a child that
+    starts where the previous child ended. Otherwise it is a zero-length span
+    in `trace_id`, the run's trace passed explicitly (e.g. for a later RAG
+    lookup), or in a trace of its own.
+    """
+    parent = _current_span.get()
+    if parent is not None and (trace_id is None or trace_id == parent.trace_id):
+        now = parent.now_ns()
+        span = Span(name, parent.trace_id, parent, attributes=attributes, start_ns=min(parent.child_cursor_ns, now))
+    else:
+        now = time.time_ns()
+        span = Span(name, trace_id or f"{_random.getrandbits(128) or 1:032x}", attributes=attributes, start_ns=now)
+    span.attributes.setdefault("transaction_id", transaction_id)
+    span.end(now)
+    return span
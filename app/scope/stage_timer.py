@@ -0,0 +1,92 @@
+# app/scope/stage_timer.py
+import time
+from contextvars import ContextVar
+
+from app.core.metrics import metrics
+from app.scope.spans import start_span
+
+# Innermost stage being timed in this thread / asyncio task
+_current_stage = ContextVar("current_stage", default=None)
+# Final wall time of each stage exited in the current pipeline run, by stage name (see collect_stage_durations)
+_stage_durations = ContextVar("stage_durations", default=None)
+
+stage_duration = metrics.histogram("pipeline_stage_duration_seconds", "Wall time of each pipeline stage.", ("stage",))
+
+def _elapsed_ms(start: float, now: float) -> float:
+    return round((now - start) * 1000, 3)
+
+class StageTimer:
+    """
+    Times one pipeline stage with the monotonic perf_counter clock and, with
+    track_cpu, the CPU time of the current thread. Used as a context manager,
+    it becomes the current stage, so every step logged inside it carries the
+    stage's elapsed wall and CPU time (see current_stage_timing), and its
+    wall time is recorded in the pipeline_stage_duration_seconds histogram
+    and, inside collect_stage_durations, in the run's stage durations.
+    Each entered stage is also a span, a child of the current span.
+    Leave track_cpu off when the stage awaits on an event loop: the loop
+    thread's CPU time also counts every other task it runs meanwhile.
+    """
+    __slots__ = ("name", "track_cpu", "started", "cpu_started", "span", "_token")
+
+    def __init__(self, name: str, track_cpu: bool = True):
+        self.name = name
+        self.track_cpu = track_cpu
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time() if track_cpu else None
+        self.span = None
+        self._token = None
+
+    def timing(self) -> dict:
+        """{"duration_ms", "cpu_time_ms"} elapsed since the stage started; cpu_time_ms is None without track_cpu."""
+        return {
+            "duration_ms": _elapsed_ms(self.started, time.perf_counter()),
+            "cpu_time_ms": _elapsed_ms(self.cpu_started, time.thread_time()) if self.track_cpu else None,
+        }
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        if self.track_cpu:
+            self.cpu_started = time.thread_time()
+        self.span = start_span(self.name).__enter__()
+        self._token = _current_stage.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_stage.reset(self._token)
+        elapsed = time.perf_counter() - self.started
+        stage_duration.observe(elapsed, stage=self.name)
+        durations = _stage_durations.get()
+        if durations is not None:
+            durations[self.name] = round(durations.get(self.name, 0.0) + elapsed * 1000, 3)
+        if self.track_cpu:
+            self.span.set_attribute("cpu_time_ms", self.timing()["cpu_time_ms"])
+        self.span.__exit__(exc_type, exc, tb)
+        return False
+
+def stage_timer(name: str, track_cpu: bool = True) -> StageTimer:
+    return StageTimer(name, track_cpu)
+
+def current_stage_timing():
+    """Timing of the innermost active stage, or None outside of any stage."""
+    stage = _current_stage.get()
+    return stage.timing() if stage is not None else None
+
+class collect_stage_durations:
+    """
+    Collects the final wall time (ms) of every stage that exits inside the
+    block, including stages that log no step, into the dict it returns.
+    Threadpool work started inside the block copies the context, so its
+    stages are collected too.
+    """
+    def __init__(self):
+        self.durations = {}
+        self._token = None
+
+    def __enter__(self) -> dict:
+        self._token = _stage_durations.set(self.durations)
+        return self.durations
+
+    def __exit__(self, exc_type, exc, tb):
+        _stage_durations.reset(self._token)
+        return False
@@ -1,32 +1,329 @@
 # app/scope/step_logger.py
-import json
 import os
+import queue
+import threading
+import time
+from collections import defaultdict, OrderedDict
+from contextvars import ContextVar
 from datetime import datetime
 # Import LOG_DIR and LOG_FILE_EXTENSION from app_config
-from app.core.app_config import LOG_DIR, LOG_FILE_EXTENSION
+from app.core.app_config import (
+    LOG_DIR, LOG_FILE_EXTENSION, STEP_LOG_WRITE_MODE, STEP_LOG_QUEUE_SIZE, STEP_LOG_BATCH_SIZE,
+    STEP_LOG_FSYNC_INTERVAL, STEP_LOG_FSYNC_RECORDS, STEP_LOG_READ_WAIT, TRACE_STORE_BACKEND, TRACE_ACCUMULATORS_RETAINED
+)
+from app.scope.trace_store import get_trace_store
+from app.scope.trace_pubsub import trace_pubsub
+from app.scope.stage_timer import current_stage_timing, stage_duration
+from app.scope.spans import record_step_span
+from app.core.metrics import metrics
+
+class BufferedStepWriter:
+    """
+    Background writer for step records. log_step puts (store, kind, record)
+    items on a bounded queue (kind is "step" or "summary"); a dedicated thread drains it in batches, appends each store's
+    records with one write per file per batch, and fsyncs written files every fsync_interval seconds or
+    fsync_records records (group commit). Records are dropped and counted when
+    the queue is full, so the request thread never blocks on disk. Queued
+    records are counted per transaction, so a read can wait for one trace
+    to reach the store (wait_for_trace) without draining the whole queue.
+    """
+    def __init__(self, queue_size: int = STEP_LOG_QUEUE_SIZE, batch_size: int = STEP_LOG_BATCH_SIZE,
+                 fsync_interval: float = STEP_LOG_FSYNC_INTERVAL, fsync_records: int = STEP_LOG_FSYNC_RECORDS):
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.fsync_records = fsync_records
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stats_lock = threading.Lock()
+        self._dropped_records = 0
+        self._written_records = 0
+        self._flushes = 0
+        self._unsynced_paths = set()
+        self._unsynced_records = 0
+        self._last_fsync = time.monotonic()
+        # Queued records per transaction ID; notified whenever a batch is written
+        self._pending = defaultdict(int)
+        self._pending_written = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="step-log-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, store, record: dict, kind: str = "step"):
+        transaction_id = record["transaction_id"]
+        with self._pending_written:
+            self._pending[transaction_id] += 1
+        try:
+            self._queue.put_nowait((store, kind, record))
+        except queue.Full:
+            self._written(transaction_id)
+            with self._stats_lock:
+                self._dropped_records += 1
+                if self._dropped_records == 1:
+                    print(f"WARNING: Step log queue full ({self._queue.maxsize} records). Dropping step records.")
+
+    def _written(self, *transaction_ids):
+        with self._pending_written:
+            for transaction_id in transaction_ids:
+                self._pending[transaction_id] -= 1
+                if self._pending[transaction_id] <= 0:
+                    del self._pending[transaction_id]
+            self._pending_written.notify_all()
+
+    def wait_for_trace(self, transaction_id: str, timeout: float) -> bool:
+        """Waits until no record of the transaction is queued. False if some still are after timeout seconds."""
+        with self._pending_written:
+            return self._pending_written.wait_for(lambda: transaction_id not in self._pending, timeout)
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=max(self.fsync_interval, 0.1))]
+            except queue.Empty:
+                self._fsync_if_due()
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            finally:
+                self._written(*(record["transaction_id"] for _, _, record in batch))
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: list):
+        entries_by_store = defaultdict(list)
+        summaries_by_store = defaultdict(dict)
+        for store, kind, record in batch:
+            if kind == "summary":
+                # Only the latest summary of a trace in this batch needs writing
+                summaries_by_store[store][record["transaction_id"]] = record
+            else:
+                entries_by_store[store].append(record)
+
+        for store, entries in entries_by_store.items():
+            try:
+                started = time.perf_counter()
+                self._unsynced_paths.update(store.append(entries))
+                stage_duration.observe(time.perf_counter() - started, stage="StepLogWrite")
+            except Exception as e:
+                print(f"ERROR: Failed to write {len(entries)} buffered log records: {e}")
+        # Summaries are written after the steps they describe
+        for store, summaries in summaries_by_store.items():
+            try:
+                self._unsynced_paths.update(store.put_summaries(list(summaries.values())))
+            except Exception as e:
+                print(f"ERROR: Failed to write {len(summaries)} buffered trace summaries: {e}")
+
+        with self._stats_lock:
+            self._written_records += len(batch)
+            self._flushes += 1
+        self._unsynced_records += len(batch)
+        self._fsync_if_due()
+
+    def _fsync_if_due(self):
+        if not self._unsynced_paths:
+            return
+        due = (self._unsynced_records >= self.fsync_records or
+               time.monotonic() - self._last_fsync >= self.fsync_interval)
+        if not due:
+            return
+        for path in self._unsynced_paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                print(f"ERROR: Failed to fsync log file {path}: {e}")
+        self._unsynced_paths.clear()
+        self._unsynced_records = 0
+        self._last_fsync = time.monotonic()
+
+    def flush(self):
+        """Blocks until every queued record has been written."""
+        self._queue.join()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "dropped_records": self._dropped_records,
+                "written_records": self._written_records,
+                "flushes": self._flushes,
+            }
+
+# One writer thread per process, shared by every StepLogger in buffered mode
+_buffered_writer = None
+_buffered_writer_lock = threading.Lock()
+
+def get_buffered_writer() -> BufferedStepWriter:
+    global _buffered_writer
+    if _buffered_writer is None:
+        with _buffered_writer_lock:
+            if _buffered_writer is None:
+                _buffered_writer = BufferedStepWriter()
+    return _buffered_writer
+
+def flush_step_logs():
+    """Writes out any buffered step records. Called on application shutdown."""
+    if _buffered_writer is not None:
+        _buffered_writer.flush()
+
+def wait_for_trace_logs(transaction_id: str, timeout: float = STEP_LOG_READ_WAIT) -> bool:
+    """
+    Called before reading a trace: in buffered mode, waits until the trace's
+    queued records are in the store. False if some are still queued after
+    timeout seconds, so the trace read may be partial and must not be cached.
+    """
+    if _buffered_writer is None:
+        return True
+    return _buffered_writer.wait_for_trace(transaction_id, timeout)
+
+def _writer_stat(name: str) -> dict:
+    return {(): _buffered_writer.stats()[name]} if _buffered_writer is not None else {}
+
+metrics.callback("step_log_queue_depth", "Step records waiting for the buffered writer.", "gauge",
+                 lambda: _writer_stat("queue_depth"))
+metrics.callback("step_log_dropped_records_total", "Step records dropped because the writer queue was full.", "counter",
+                 lambda: _writer_stat("dropped_records"))
+
+def step_log_writer_stats() -> dict:
+    """Queue depth and dropped/written record counts of the buffered writer."""
+    stats = {"write_mode": STEP_LOG_WRITE_MODE}
+    if _buffered_writer is not None:
+        stats.update(_buffered_writer.stats())
+    return stats
+
+class _StepLogBatch:
+    """
+    Step records and summaries collected by batch_step_logs() in sync write
+    mode, written with one append (and one summary upsert) per store every
+    STEP_LOG_BATCH_SIZE records instead of one write per record.
+    """
+    def __init__(self):
+        self.entries = defaultdict(list)
+        self.summaries = defaultdict(dict)
+        self.pending = 0
+
+    def add(self, store, record: dict, kind: str = "step"):
+        if kind == "summary":
+            self.summaries[store][record["transaction_id"]] = record
+        else:
+            self.entries[store].append(record)
+            self.pending += 1
+            if self.pending >= STEP_LOG_BATCH_SIZE:
+                self.flush()
+
+    def flush(self):
+        for store, entries in self.entries.items():
+            try:
+                started = time.perf_counter()
+                store.append(entries)
+                stage_duration.observe(time.perf_counter() - started, stage="StepLogWrite")
+            except Exception as e:
+                print(f"ERROR: Failed to write {len(entries)} batched log records: {e}")
+        # Summaries are written after the steps they describe
+        for store, summaries in self.summaries.items():
+            try:
+                store.put_summaries(list(summaries.values()))
+            except Exception as e:
+                print(f"ERROR: Failed to write {len(summaries)} batched trace summaries: {e}")
+        self.entries.clear()
+        self.summaries.clear()
+        self.pending = 0
+
+_step_log_batch = ContextVar("step_log_batch", default=None)
+
+class batch_step_logs:
+    """
+    Context manager for bulk runs (run_fraud_pipeline_batch): sync-mode step
+    writes from every StepLogger in this thread are grouped into a few large
+    appends, and whatever is left is written on exit.
+    """
+    def __enter__(self):
+        self.batch = _StepLogBatch()
+        self._token = _step_log_batch.set(self.batch)
+        return self.batch
+
+    def __exit__(self, exc_type, exc, tb):
+        _step_log_batch.reset(self._token)
+        self.batch.flush()
+        return False
+
+# Running totals per in-flight transaction, shared by every StepLogger,
+# used to materialize the trace summary when the final decision is logged
+_trace_accumulators = OrderedDict()
+_trace_accumulators_lock = threading.Lock()
+
+def _build_summary(transaction_id: str, accumulator: dict) -> dict:
+    return {
+        "transaction_id": transaction_id,
+        "agents_triggered": sorted(accumulator["components"]),
+        "final_confidence": accumulator["final_confidence"],
+        "final_decision": accumulator["final_decision"],
+        "violations_count": accumulator["violations_count"],
+        "stage_timings_ms": accumulator["stage_timings_ms"],
+        "total_duration_ms": accumulator["total_duration_ms"],
+        "rule_set_version": accumulator["rule_set_version"],
+    }
+
+def _accumulate_step(log_entry: dict):
+    """
+    Adds a step to its transaction's running totals. Returns an updated summary
+    when the step arrives after the summary was materialized (e.g. a deferred
+    narrative), otherwise None.
+    """
+    transaction_id = log_entry["transaction_id"]
+    with _trace_accumulators_lock:
+        accumulator = _trace_accumulators.get(transaction_id)
+        if accumulator is None:
+            accumulator = {
+                "components": set(), "violations_count": 0, "stage_timings_ms": None, "total_duration_ms": None,
+                "final_decision": None, "final_confidence": 0.0, "rule_set_version": None,
+            }
+            _trace_accumulators[transaction_id] = accumulator
+            while len(_trace_accumulators) > TRACE_ACCUMULATORS_RETAINED:
+                _trace_accumulators.popitem(last=False)
+
+        accumulator["components"].add(log_entry["component"])
+        if log_entry.get("policy_violation"):
+            accumulator["violations_count"] += 1
+
+        if accumulator["final_decision"] is None:
+            return None
+        return _build_summary(transaction_id, accumulator)
 
 class StepLogger:
     """
-    A utility class for logging steps of the fraud detection pipeline
-    to separate JSONL files for each transaction ID, ensuring clear traceability.
+    A utility class for logging steps of the fraud detection pipeline,
+    ensuring clear traceability. Steps go to a trace store backend: separate
+    JSONL files for each transaction ID ("files") or rolling segment files
+    with an offset index ("segments").
     """
-    def __init__(self, log_directory: str = LOG_DIR, log_file_extension: str = LOG_FILE_EXTENSION):
+    def __init__(self, log_directory: str = LOG_DIR, log_file_extension: str = LOG_FILE_EXTENSION,
+                 write_mode: str = STEP_LOG_WRITE_MODE, backend: str = TRACE_STORE_BACKEND):
         self.log_directory = log_directory
         self.log_file_extension = log_file_extension
+        self.write_mode = write_mode
         # Ensure the log directory exists
         os.makedirs(self.log_directory, exist_ok=True)
-
-    def _get_transaction_log_path(self, transaction_id: str) -> str:
-        """Constructs the full path for a specific transaction's log file."""
-        file_name = f"{transaction_id}{self.log_file_extension}"
-        return os.path.join(self.log_directory, file_name)
+        self.store = get_trace_store(backend, log_directory, log_file_extension)
 
     def log_step(self, transaction_id: str, step: int, component: str,
                  input_data: dict, description: str, confidence: float,
                  policy_violation: bool = False, policy_id: str = None,
-                 final_decision_status: str = None, final_decision_confidence: float = None):
+                 final_decision_status: str = None, final_decision_confidence: float = None,
+                 timing: dict = None, trace_id: str = None):
         """
-        Logs a single step of the fraud detection process to its dedicated transaction log file.
+        Logs a single step of the fraud detection process to the trace store.
+        Steps logged inside a timed stage record its duration_ms and cpu_time_ms
+        so far; `timing` adds further fields (e.g. the pipeline totals).
+        Each step is also exported as a span (see record_step_span), in the
+        current pipeline run's trace or `trace_id`, and the record keeps its
+        trace_id, span_id and parent_span_id. Batch rows get no span.
         """
         log_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -43,12 +340,77 @@ class StepLogger:
             log_entry["final_decision_status"] = final_decision_status
         if final_decision_confidence is not None:
             log_entry["final_decision_confidence"] = round(final_decision_confidence, 2)
+        stage_timing = current_stage_timing()
+        if stage_timing is not None:
+            log_entry.update(stage_timing)
+        if timing:
+            log_entry.update(timing)
+        # One span per batch row would flood the exporter for no timing information (rows are not timed)
+        if _step_log_batch.get() is None:
+            span = record_step_span(transaction_id, component, {
+                "agentscope.step": step, "agentscope.description": description, "agentscope.confidence": log_entry["confidence"],
+                "agentscope.policy_violation": policy_violation, "agentscope.policy_id": policy_id,
+                "agentscope.final_decision_status": final_decision_status,
+            }, trace_id)
+            log_entry["trace_id"] = span.trace_id
+            log_entry["span_id"] = span.span_id
+            log_entry["parent_span_id"] = span.parent_id
+
+        updated_summary = _accumulate_step(log_entry)
+
+        if self.write_mode == "buffered":
+            try:
+                get_buffered_writer().enqueue(self.store, log_entry)
+            except Exception as e:
+                print(f"ERROR: Failed to buffer log for transaction {transaction_id}: {e}")
+        elif _step_log_batch.get() is not None:
+            _step_log_batch.get().add(self.store, log_entry)
+        else:
+            try:
+                started = time.perf_counter()
+                self.store.append([log_entry])
+                stage_duration.observe(time.perf_counter() - started, stage="StepLogWrite")
+            except Exception as e:
+                print(f"ERROR: Failed to write log for transaction {transaction_id}: {e}")
+        # After the write or enqueue, so a viewer that subscribes meanwhile finds the step in the store or gets it live
+        trace_pubsub.publish(log_entry)
+
+        if updated_summary is not None:
+            self._write_summary(updated_summary)
+
+    def log_summary(self, transaction_id: str, final_decision: str, final_confidence: float,
+                    rule_set_version: str = None, stage_timings_ms: dict = None, total_duration_ms: float = None):
+        """
+        Materializes the trace summary (agents triggered, violations count,
+        final decision, the rule set version that decided it and, for timed
+        runs, each stage's final duration and the pipeline total as measured
+        by the stage timers) so summary reads never parse steps.
+        Called by the pipeline right after it logs the final decision.
+        """
+        with _trace_accumulators_lock:
+            accumulator = _trace_accumulators.get(transaction_id)
+            if accumulator is None:
+                print(f"Warning: No logged steps for transaction {transaction_id}. Summary not materialized.")
+                return
+            accumulator["final_decision"] = final_decision
+            accumulator["final_confidence"] = round(final_confidence, 2)
+            accumulator["rule_set_version"] = rule_set_version
+            accumulator["stage_timings_ms"] = dict(stage_timings_ms) if stage_timings_ms is not None else None
+            accumulator["total_duration_ms"] = total_duration_ms
+            summary = _build_summary(transaction_id, accumulator)
+        self._write_summary(summary)
 
-        # Write to the specific transaction's log file (append mode)
-        log_file_path = self._get_transaction_log_path(transaction_id)
+    def _write_summary(self, summary: dict):
+        if self.write_mode == "buffered":
+            try:
+                get_buffered_writer().enqueue(self.store, summary, kind="summary")
+            except Exception as e:
+                print(f"ERROR: Failed to buffer trace summary for transaction {summary['transaction_id']}: {e}")
+            return
+        if _step_log_batch.get() is not None:
+            _step_log_batch.get().add(self.store, summary, kind="summary")
+            return
         try:
-            with open(log_file_path, 'a') as f:
-                f.write(json.dumps(log_entry) + '\n')
-            # print(f"Logged step {step} for {transaction_id} to {file_name}") # Optional: for debugging
+            self.store.put_summaries([summary])
         except Exception as e:
-            print(f"ERROR: Failed to write log for transaction {transaction_id} to {log_file_path}: {e}")
+            print(f"ERROR: Failed to write trace summary for transaction {summary['transaction_id']}: {e}")
@@ -0,0 +1,95 @@
+# app/scope/trace_pubsub.py
+import asyncio
+import threading
+
+class TraceSubscription:
+    """One viewer's queue of steps, filled from the logging threads and read on the viewer's event loop."""
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def push(self, log_entry: dict) -> bool:
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, log_entry)
+            return True
+        except RuntimeError:
+            # The viewer's event loop is closed; it will be unsubscribed when its stream ends
+            return False
+
+class _Topic:
+    __slots__ = ("steps", "subscribers")
+
+    def __init__(self):
+        # Steps published while the trace is watched, for viewers that join later
+        self.steps = []
+        self.subscribers = set()
+
+class TracePubSub:
+    """
+    In-process fan-out of logged steps, one topic per watched transaction.
+    StepLogger publishes each step once, after writing it; every viewer of
+    that transaction gets its own queue fed from the topic. Topics only exist
+    while someone is subscribed, so publishing a step nobody watches is a
+    dictionary lookup without a lock, and nothing is kept for unwatched
+    traces. Steps logged before a viewer subscribed are read from the store.
+    """
+    def __init__(self):
+        self._topics = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+
+    def publish(self, log_entry: dict):
+        transaction_id = log_entry["transaction_id"]
+        # Unlocked fast path: a single dict lookup is atomic, and a viewer subscribing right now reads the store
+        if transaction_id not in self._topics:
+            return
+        with self._lock:
+            topic = self._topics.get(transaction_id)
+            if topic is None:
+                return
+            topic.steps.append(log_entry)
+            subscribers = list(topic.subscribers)
+            self.published += 1
+        delivered = sum(1 for subscription in subscribers if subscription.push(log_entry))
+        if delivered:
+            with self._lock:
+                self.delivered += delivered
+
+    def subscribe(self, transaction_id: str) -> tuple:
+        """
+        Registers a viewer on the running event loop. Returns (history,
+        subscription): the steps published since the trace started being
+        watched in this process, and the subscription whose queue receives
+        every later step. The caller reads earlier steps from the trace store
+        and merges them with the history.
+        """
+        subscription = TraceSubscription(asyncio.get_running_loop())
+        with self._lock:
+            topic = self._topics.get(transaction_id)
+            if topic is None:
+                topic = self._topics[transaction_id] = _Topic()
+            history = list(topic.steps)
+            topic.subscribers.add(subscription)
+        return history, subscription
+
+    def unsubscribe(self, transaction_id: str, subscription: TraceSubscription):
+        with self._lock:
+            topic = self._topics.get(transaction_id)
+            if topic is None:
+                return
+            topic.subscribers.discard(subscription)
+            if not topic.subscribers:
+                del self._topics[transaction_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "traces": len(self._topics),
+                "subscribers": sum(len(topic.subscribers) for topic in self._topics.values()),
+                "published_steps": self.published,
+                "delivered_steps": self.delivered,
+            }
+
+# One fan-out per process, fed by every StepLogger
+trace_pubsub = TracePubSub()
@@ -3,47 +3,97 @@ import json
 import os
 from datetime import datetime
 # Import LOG_DIR and LOG_FILE_EXTENSION from app_config
-from app.core.app_config import LOG_DIR, LOG_FILE_EXTENSION, CONFIDENCE_THRESHOLD, FALLBACK_THRESHOLD
+from app.core.app_config import LOG_DIR, LOG_FILE_EXTENSION, CONFIDENCE_THRESHOLD, FALLBACK_THRESHOLD, TRACE_STORE_BACKEND
+from app.scope.trace_store import get_trace_store
+from app.scope.step_logger import wait_for_trace_logs
 
 def _get_transaction_log_path(transaction_id: str) -> str:
     """Constructs the full path for a specific transaction's log file."""
     file_name = f"{transaction_id}{LOG_FILE_EXTENSION}"
     return os.path.join(LOG_DIR, file_name)
 
+def _read_trace_lines(transaction_id: str):
+    """
+    Returns the raw JSONL lines of a trace. Uses the segment index when it exists,
+    and falls back to the legacy per-transaction file.
+    """
+    segmented_store = get_trace_store("segments")
+    if segmented_store.has_index():
+        lines = segmented_store.read_trace_lines(transaction_id)
+        if lines is not None:
+            return lines
+    return get_trace_store("files").read_trace_lines(transaction_id)
+
+def get_trace_version(transaction_id: str):
+    """
+    Returns a cheap, hashable version of a trace (file sizes/mtimes, index
+    extents or row ids, depending on the stores holding it) that changes
+    whenever a step or summary is added. None if no store has the trace.
+    """
+    versions = []
+    if TRACE_STORE_BACKEND == "sqlite":
+        versions.append(get_trace_store("sqlite").trace_version(transaction_id))
+    segmented_store = get_trace_store("segments")
+    if segmented_store.has_index():
+        versions.append(segmented_store.trace_version(transaction_id))
+    versions.append(get_trace_store("files").trace_version(transaction_id))
+    return tuple(versions) if any(versions) else None
+
+def _read_materialized_summary(transaction_id: str):
+    """Looks up the summary written at decision time, starting with the configured backend."""
+    backends = [TRACE_STORE_BACKEND] + [backend for backend in ("segments", "files") if backend != TRACE_STORE_BACKEND]
+    for backend in backends:
+        try:
+            summary = get_trace_store(backend).read_summary(transaction_id)
+        except Exception as e:
+            print(f"Error reading materialized summary for {transaction_id} from {backend} store: {e}")
+            continue
+        if summary is not None:
+            return summary
+    return None
+
 def get_trace_verbose(transaction_id: str) -> dict:
     """
-    Retrieves the verbose log entries for a given transaction ID from its dedicated file.
+    Retrieves the verbose log entries for a given transaction ID from the trace store.
+    Records still queued by the buffered writer are waited for first.
     """
+    wait_for_trace_logs(transaction_id)
     verbose_steps = []
     log_file_path = _get_transaction_log_path(transaction_id)
 
-    if not os.path.exists(log_file_path):
+    if TRACE_STORE_BACKEND == "sqlite":
+        entries = get_trace_store("sqlite").read_trace_entries(transaction_id)
+        if entries is not None:
+            # Rows come back ordered by step with every TraceStep field present
+            return {"transaction_id": transaction_id, "steps": entries}
+
+    lines = _read_trace_lines(transaction_id)
+    if lines is None:
         print(f"Warning: Log file not found for transaction ID: {transaction_id} at {log_file_path}")
         return {"transaction_id": transaction_id, "steps": []}
 
-    with open(log_file_path, 'r') as f:
-        for line in f:
-            try:
-                log_entry = json.loads(line.strip())
-                # No need to filter by transaction_id here, as the file itself is for that ID
-                # Ensure all fields expected by TraceStep Pydantic model are present,
-                # or provide sensible defaults if they might be missing.
-                log_entry.setdefault('timestamp', datetime.now().isoformat())
-                log_entry.setdefault('input_data', {})
-                log_entry.setdefault('policy_violation', False)
-                log_entry.setdefault('policy_id', None)
-                log_entry.setdefault('component', "Unknown")
-                log_entry.setdefault('description', "No description provided.")
-                log_entry.setdefault('confidence', 0.0)
-                log_entry.setdefault('step', 0)
-                log_entry.setdefault('final_decision_status', None)
-                log_entry.setdefault('final_decision_confidence', None)
-
-                verbose_steps.append(log_entry)
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON from log file {log_file_path}: {e} - Line: '{line.strip()}'")
-            except Exception as e:
-                print(f"Unexpected error processing log line from {log_file_path}: {e} - Line: '{line.strip()}'")
+    for line in lines:
+        try:
+            log_entry = json.loads(line.strip())
+            # No need to filter by transaction_id here, as the file itself is for that ID
+            # Ensure all fields expected by TraceStep Pydantic model are present,
+            # or provide sensible defaults if they might be missing.
+            log_entry.setdefault('timestamp', datetime.now().isoformat())
+            log_entry.setdefault('input_data', {})
+            log_entry.setdefault('policy_violation', False)
+            log_entry.setdefault('policy_id', None)
+            log_entry.setdefault('component', "Unknown")
+            log_entry.setdefault('description', "No description provided.")
+            log_entry.setdefault('confidence', 0.0)
+            log_entry.setdefault('step', 0)
+            log_entry.setdefault('final_decision_status', None)
+            log_entry.setdefault('final_decision_confidence', None)
+
+            verbose_steps.append(log_entry)
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON from log file {log_file_path}: {e} - Line: '{line.strip()}'")
+        except Exception as e:
+            print(f"Unexpected error processing log line from {log_file_path}: {e} - Line: '{line.strip()}'")
 
     verbose_steps.sort(key=lambda x: x.get('step', 0))
     
@@ -52,8 +102,19 @@ def get_trace_verbose(transaction_id: str) -> dict:
 def get_trace_summary(transaction_id: str) -> dict:
     """
     Retrieves a summary of the log entries for a given transaction ID.
-    Explicitly looks for the FinalDecisionAgent step for the authoritative decision.
+    Uses the summary materialized at decision time when there is one; otherwise
+    explicitly looks for the FinalDecisionAgent step for the authoritative decision.
     """
+    wait_for_trace_logs(transaction_id)
+    summary = _read_materialized_summary(transaction_id)
+    if summary is not None:
+        return summary
+
+    if TRACE_STORE_BACKEND == "sqlite":
+        summary = get_trace_store("sqlite").read_trace_summary(transaction_id)
+        if summary is not None:
+            return summary
+
     verbose_trace = get_trace_verbose(transaction_id)
     steps = verbose_trace.get("steps", [])
 
@@ -61,6 +122,9 @@ def get_trace_summary(transaction_id: str) -> dict:
     final_decision = "unknown"
     final_confidence = 0.0
     violations_count = 0
+    rule_set_version = None
+    stage_timings_ms = None
+    total_duration_ms = None
     
     if not steps:
         return {
@@ -82,6 +146,10 @@ def get_trace_summary(transaction_id: str) -> dict:
         if step_data.get("component") == "FinalDecisionAgent":
             final_decision = step_data.get("final_decision_status", "unknown")
             final_confidence = step_data.get("final_decision_confidence", 0.0)
+            rule_set_version = (step_data.get("input_data") or {}).get("rule_set_version")
+            # Stage timings as logged on the final decision step, like the materialized summary's
+            stage_timings_ms = (step_data.get("input_data") or {}).get("stage_durations_ms")
+            total_duration_ms = step_data.get("total_duration_ms")
             # If found, this is the authoritative decision. We continue iterating to collect all agents_triggered and violations_count.
 
     # If FinalDecisionAgent was not found (e.g., old logs or error), infer decision
@@ -103,5 +171,8 @@ def get_trace_summary(transaction_id: str) -> dict:
         "agents_triggered": sorted(list(agents_triggered)),
         "final_confidence": round(final_confidence, 2),
         "final_decision": final_decision,
-        "violations_count": violations_count
+        "violations_count": violations_count,
+        "stage_timings_ms": stage_timings_ms,
+        "total_duration_ms": total_duration_ms,
+        "rule_set_version": rule_set_version
     }
@@ -0,0 +1,552 @@
+# app/scope/trace_store.py
+import json
+import os
+import threading
+from collections import defaultdict, OrderedDict
+from datetime import datetime
+
+from sqlalchemy import inspect, select, func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.core.app_config import LOG_DIR, LOG_FILE_EXTENSION, TRACE_SEGMENT_DIR, TRACE_SEGMENT_MAX_BYTES, TRACE_SEGMENT_INDEX_CACHE
+from app.db.database import engine
+from app.db.models import AgentScopeLog, TraceSummary
+
+# Optional per-step timing and span fields, stored as nullable columns and left out of entries when null
+TIMING_FIELDS = ("duration_ms", "cpu_time_ms", "total_duration_ms", "total_cpu_time_ms")
+SPAN_FIELDS = ("trace_id", "span_id", "parent_span_id")
+OPTIONAL_STEP_FIELDS = TIMING_FIELDS + SPAN_FIELDS
+# Columns an agent_scope_logs / trace_summaries table created by an older version may lack
+ADDED_STEP_COLUMNS = ("timestamp", "final_decision_status", "final_decision_confidence") + OPTIONAL_STEP_FIELDS
+ADDED_SUMMARY_COLUMNS = ("rule_set_version", "total_duration_ms")
+
+class FileTraceStore:
+    """
+    Legacy layout: one <transaction_id>.jsonl file per transaction under the log directory.
+    """
+    def __init__(self, log_directory: str = LOG_DIR, log_file_extension: str = LOG_FILE_EXTENSION):
+        self.log_directory = log_directory
+        self.log_file_extension = log_file_extension
+        os.makedirs(self.log_directory, exist_ok=True)
+
+    def _get_transaction_log_path(self, transaction_id: str) -> str:
+        """Constructs the full path for a specific transaction's log file."""
+        file_name = f"{transaction_id}{self.log_file_extension}"
+        return os.path.join(self.log_directory, file_name)
+
+    def append(self, entries: list) -> list:
+        """
+        Appends step records, writing each transaction's file once.
+        Returns the paths that were written.
+        """
+        lines_by_path = defaultdict(list)
+        for entry in entries:
+            lines_by_path[self._get_transaction_log_path(entry["transaction_id"])].append(json.dumps(entry) + '\n')
+
+        written_paths = []
+        for path, lines in lines_by_path.items():
+            try:
+                with open(path, 'a') as f:
+                    f.write(''.join(lines))
+                written_paths.append(path)
+            except Exception as e:
+                print(f"ERROR: Failed to write {len(lines)} log records to {path}: {e}")
+        return written_paths
+
+    def read_trace_lines(self, transaction_id: str):
+        """Returns the raw JSONL lines of a trace, or None if the transaction has no log file."""
+        log_file_path = self._get_transaction_log_path(transaction_id)
+        if not os.path.exists(log_file_path):
+            return None
+        with open(log_file_path, 'r') as f:
+            return f.readlines()
+
+    def trace_version(self, transaction_id: str):
+        """(size, mtime) of the trace file and its summary; None if neither exists."""
+        version = []
+        for path in (self._get_transaction_log_path(transaction_id), self._get_summary_path(transaction_id)):
+            try:
+                stat = os.stat(path)
+                version.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version) if any(version) else None
+
+    def _get_summary_path(self, transaction_id: str) -> str:
+        return os.path.join(self.log_directory, "summaries", f"{transaction_id}.json")
+
+    def put_summaries(self, summaries: list) -> list:
+        """
+        Writes materialized trace summaries, replacing any previous summary
+        of the same transaction atomically. Returns the paths that were written.
+        """
+        written_paths = []
+        for summary in summaries:
+            path = self._get_summary_path(summary["transaction_id"])
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(summary, f)
+                os.replace(tmp_path, path)
+                written_paths.append(path)
+            except Exception as e:
+                print(f"ERROR: Failed to write trace summary to {path}: {e}")
+        return written_paths
+
+    def read_summary(self, transaction_id: str):
+        """Returns the materialized summary of a trace, or None if none was written."""
+        path = self._get_summary_path(transaction_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+class SegmentedTraceStore:
+    """
+    Appends the steps of all transactions to rolling segment files
+    (segment-<pid>-<n>.jsonl, up to max_segment_bytes each) and keeps a
+    compact trace_id -> [(segment, offset, length), ...] index, so a trace is
+    read with one seek per written batch instead of one file per transaction.
+    Materialized summaries go through the same segments, tagged "summary" in
+    the index; the latest one per trace wins.
+
+    Each process writes its own segments and index file (index-<pid>.tsv),
+    keeping both open between appends, so several uvicorn workers can share
+    the directory without coordination. Readers merge all index files,
+    tailing them incrementally, and keep the extents of the index_cache_size
+    most recently written or read traces in memory; older traces are found
+    by scanning the index files again.
+    """
+    def __init__(self, segment_directory: str = TRACE_SEGMENT_DIR, max_segment_bytes: int = TRACE_SEGMENT_MAX_BYTES,
+                 index_cache_size: int = TRACE_SEGMENT_INDEX_CACHE):
+        self.segment_directory = segment_directory
+        self.max_segment_bytes = max_segment_bytes
+        self.index_cache_size = index_cache_size
+        self._write_lock = threading.Lock()
+        self._pid = None
+        self._segment_number = 0
+        self._segment_size = 0
+        self._segment_file = None
+        self._index_file = None
+        # Reader state: trace_id -> [step extents, summary extent, complete] (least recently used first),
+        # how far each index file has been read, a fixed-size hash filter of evicted IDs
+        # and the IDs a scan of the index files did not find
+        self._read_lock = threading.Lock()
+        self._index = OrderedDict()
+        self._index_offsets = {}
+        self._evicted = bytearray(max(index_cache_size, 1) * 8)
+        self._missing = OrderedDict()
+
+    def _index_path(self) -> str:
+        return os.path.join(self.segment_directory, f"index-{self._pid}.tsv")
+
+    def _segment_name(self) -> str:
+        return f"segment-{self._pid}-{self._segment_number:06d}.jsonl"
+
+    def _close_writer(self):
+        for f in (self._segment_file, self._index_file):
+            if f is not None:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+        self._segment_file = None
+        self._index_file = None
+
+    def _open_segment(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+        # Unbuffered, so each batch is one write() and readers see it right away
+        self._segment_file = open(os.path.join(self.segment_directory, self._segment_name()), 'ab', buffering=0)
+
+    def _open_writer(self):
+        """(Re)initialises writer state for this process, e.g. after a fork."""
+        # After a fork these handles belong to the parent's files; closing them here only closes our copies
+        self._close_writer()
+        os.makedirs(self.segment_directory, exist_ok=True)
+        self._pid = os.getpid()
+        self._segment_number = 1
+        # Continue the latest segment this pid left behind, if any
+        while os.path.exists(os.path.join(self.segment_directory, self._segment_name())):
+            self._segment_number += 1
+        self._segment_number = max(1, self._segment_number - 1)
+        segment_path = os.path.join(self.segment_directory, self._segment_name())
+        self._segment_size = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+        self._open_segment()
+        self._index_file = open(self._index_path(), 'ab', buffering=0)
+
+    def append(self, entries: list) -> list:
+        """
+        Appends step records to the current segment with one write, grouping
+        each transaction's records into a single contiguous extent, then
+        appends the extents to the index. Returns the paths that were written.
+        """
+        lines_by_trace = defaultdict(list)
+        for entry in entries:
+            lines_by_trace[entry["transaction_id"]].append((json.dumps(entry) + '\n').encode('utf-8'))
+        chunks = [(transaction_id, b''.join(lines)) for transaction_id, lines in lines_by_trace.items()]
+        return self._append_chunks(chunks, "step")
+
+    def put_summaries(self, summaries: list) -> list:
+        """Appends materialized trace summaries. Returns the paths that were written."""
+        chunks = [(summary["transaction_id"], (json.dumps(summary) + '\n').encode('utf-8')) for summary in summaries]
+        return self._append_chunks(chunks, "summary")
+
+    def _append_chunks(self, chunks: list, kind: str) -> list:
+        """Writes (transaction_id, bytes) chunks with one segment write and one index write."""
+        with self._write_lock:
+            try:
+                if self._pid != os.getpid() or self._segment_file is None:
+                    self._open_writer()
+
+                batch_size = sum(len(chunk) for _, chunk in chunks)
+                if self._segment_size > 0 and self._segment_size + batch_size > self.max_segment_bytes:
+                    self._segment_number += 1
+                    self._segment_size = 0
+                    self._open_segment()
+            except Exception as e:
+                print(f"ERROR: Failed to open trace segment in {self.segment_directory}: {e}")
+                self._close_writer()
+                return []
+
+            segment_name = self._segment_name()
+            segment_path = os.path.join(self.segment_directory, segment_name)
+            # Step extents keep the original 4-column format; other kinds add a fifth column
+            kind_column = "" if kind == "step" else f"\t{kind}"
+            index_lines = []
+            offset = self._segment_size
+            for transaction_id, chunk in chunks:
+                index_lines.append(f"{transaction_id}\t{segment_name}\t{offset}\t{len(chunk)}{kind_column}\n")
+                offset += len(chunk)
+
+            try:
+                self._segment_file.write(b''.join(chunk for _, chunk in chunks))
+                self._segment_size = offset
+                # The index is written after the data, so readers never see an extent before its bytes
+                self._index_file.write(''.join(index_lines).encode('utf-8'))
+            except Exception as e:
+                print(f"ERROR: Failed to append {len(chunks)} {kind} records to segment {segment_path}: {e}")
+                # Reopen (and re-measure the segment) on the next append
+                self._close_writer()
+                return []
+            return [segment_path, self._index_path()]
+
+    def has_index(self) -> bool:
+        if not os.path.isdir(self.segment_directory):
+            return False
+        return any(name.startswith("index-") for name in os.listdir(self.segment_directory))
+
+    @staticmethod
+    def _parse_index_line(line: str):
+        """(transaction_id, kind, (segment, offset, length)) of an index line."""
+        fields = line.rstrip('\n').split('\t')
+        transaction_id, segment_name, offset, length = fields[:4]
+        kind = fields[4] if len(fields) > 4 else "step"
+        return transaction_id, kind, (segment_name, int(offset), int(length))
+
+    def _evicted_slot(self, transaction_id: str) -> int:
+        return hash(transaction_id) % len(self._evicted)
+
+    def _remember(self, transaction_id: str, entry: list):
+        self._index[transaction_id] = entry
+        self._index.move_to_end(transaction_id)
+        self._missing.pop(transaction_id, None)
+        while len(self._index) > self.index_cache_size:
+            evicted_id, _ = self._index.popitem(last=False)
+            self._evicted[self._evicted_slot(evicted_id)] = 1
+
+    def _add_extent(self, transaction_id: str, kind: str, extent: tuple):
+        entry = self._index.get(transaction_id)
+        if entry is None:
+            # A trace that may have been evicted can have older extents that are no longer in memory
+            entry = [[], None, not self._evicted[self._evicted_slot(transaction_id)]]
+        if kind == "summary":
+            entry[1] = extent
+        else:
+            entry[0].append(extent)
+        self._remember(transaction_id, entry)
+
+    def _refresh_index(self):
+        """Reads index lines appended since the last refresh."""
+        for name in os.listdir(self.segment_directory):
+            if not (name.startswith("index-") and name.endswith(".tsv")):
+                continue
+            index_path = os.path.join(self.segment_directory, name)
+            read_offset = self._index_offsets.get(name, 0)
+            if os.path.getsize(index_path) <= read_offset:
+                continue
+            with open(index_path, 'r') as f:
+                f.seek(read_offset)
+                while True:
+                    line = f.readline()
+                    if not line.endswith('\n'):
+                        break # Partially written line; picked up on the next refresh
+                    read_offset = f.tell()
+                    try:
+                        self._add_extent(*self._parse_index_line(line))
+                    except ValueError:
+                        print(f"Error parsing trace index line in {index_path}: '{line.strip()}'")
+            self._index_offsets[name] = read_offset
+
+    def _scan_index(self, transaction_id: str):
+        """Collects all extents of a trace from the index files, up to where they have been read."""
+        entry = [[], None, True]
+        prefix = (transaction_id + '\t').encode('utf-8')
+        for name, read_offset in self._index_offsets.items():
+            position = 0
+            with open(os.path.join(self.segment_directory, name), 'rb') as f:
+                for line in f:
+                    position += len(line)
+                    if position > read_offset:
+                        break
+                    if not line.startswith(prefix):
+                        continue
+                    try:
+                        _, kind, extent = self._parse_index_line(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    if kind == "summary":
+                        entry[1] = extent
+                    else:
+                        entry[0].append(extent)
+        return entry if entry[0] or entry[1] is not None else None
+
+    def _lookup(self, transaction_id: str):
+        """(step extents, summary extent) of a trace, or None if the index has no entry for it."""
+        with self._read_lock:
+            self._refresh_index()
+            entry = self._index.get(transaction_id)
+            if entry is None or not entry[2]:
+                # Evicted (or possibly evicted) traces are read from the index files again
+                if entry is None and (not self._evicted[self._evicted_slot(transaction_id)] or transaction_id in self._missing):
+                    return None
+                entry = self._scan_index(transaction_id)
+                if entry is None:
+                    # Cleared by _remember when lines for it arrive
+                    self._missing[transaction_id] = True
+                    while len(self._missing) > self.index_cache_size:
+                        self._missing.popitem(last=False)
+                    return None
+            self._remember(transaction_id, entry)
+            return list(entry[0]), entry[1]
+
+    def read_trace_lines(self, transaction_id: str):
+        """Returns the raw JSONL lines of a trace, or None if the index has no entry for it."""
+        if not os.path.isdir(self.segment_directory):
+            return None
+        entry = self._lookup(transaction_id)
+        if entry is None or not entry[0]:
+            return None
+
+        lines = []
+        for segment_name, offset, length in entry[0]:
+            with open(os.path.join(self.segment_directory, segment_name), 'rb') as f:
+                f.seek(offset)
+                lines.extend(f.read(length).decode('utf-8').splitlines(keepends=True))
+        return lines
+
+    def trace_version(self, transaction_id: str):
+        """Last step extent and summary extent of a trace; None if the index has neither."""
+        if not os.path.isdir(self.segment_directory):
+            return None
+        entry = self._lookup(transaction_id)
+        if entry is None:
+            return None
+        extents, summary_extent = entry
+        return (len(extents), extents[-1] if extents else None, summary_extent)
+
+    def read_summary(self, transaction_id: str):
+        """Returns the latest materialized summary of a trace, or None if none was written."""
+        if not os.path.isdir(self.segment_directory):
+            return None
+        entry = self._lookup(transaction_id)
+        if entry is None or entry[1] is None:
+            return None
+        segment_name, offset, length = entry[1]
+        with open(os.path.join(self.segment_directory, segment_name), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+class SQLiteTraceStore:
+    """
+    Writes steps into the agent_scope_logs table (AgentScopeLog) with one
+    executemany insert per batch. The engine runs SQLite in WAL mode, so trace
+    reads are indexed queries on transaction_id that do not block the writer.
+    Materialized summaries are upserted into trace_summaries (TraceSummary).
+    """
+    def __init__(self, db_engine=engine):
+        self.engine = db_engine
+        self.table = AgentScopeLog.__table__
+        self.summary_table = TraceSummary.__table__
+        self.table.create(bind=self.engine, checkfirst=True)
+        self.summary_table.create(bind=self.engine, checkfirst=True)
+        self._add_missing_columns(self.table, ADDED_STEP_COLUMNS)
+        self._add_missing_columns(self.summary_table, ADDED_SUMMARY_COLUMNS)
+        self._write_lock = threading.Lock() # Single writer; SQLite serialises writes anyway
+
+    def _add_missing_columns(self, table, names):
+        """Adds nullable columns that a table created by an older version lacks."""
+        existing = {column["name"] for column in inspect(self.engine).get_columns(table.name)}
+        with self.engine.begin() as conn:
+            for name in names:
+                if name not in existing:
+                    column = table.c[name]
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=self.engine.dialect)}"))
+
+    def append(self, entries: list) -> list:
+        """Inserts step records in one transaction. Returns no paths (nothing to fsync)."""
+        rows = []
+        for entry in entries:
+            rows.append({
+                "transaction_id": entry["transaction_id"],
+                "step": entry["step"],
+                "component": entry["component"],
+                "input_data": entry["input_data"],
+                "description": entry["description"],
+                "confidence": entry["confidence"],
+                "policy_violation": bool(entry.get("policy_violation")),
+                "policy_id": entry.get("policy_id"),
+                "timestamp": entry["timestamp"],
+                "final_decision_status": entry.get("final_decision_status"),
+                "final_decision_confidence": entry.get("final_decision_confidence"),
+                **{field: entry.get(field) for field in OPTIONAL_STEP_FIELDS},
+                "created_at": datetime.fromisoformat(entry["timestamp"]),
+            })
+        with self._write_lock:
+            with self.engine.begin() as conn:
+                conn.execute(self.table.insert(), rows)
+        return []
+
+    def put_summaries(self, summaries: list) -> list:
+        """Upserts materialized trace summaries in one statement. Returns no paths."""
+        rows = [{
+            "transaction_id": summary["transaction_id"],
+            "agents_triggered": summary["agents_triggered"],
+            "violations_count": summary["violations_count"],
+            "final_decision": summary["final_decision"],
+            "final_confidence": summary["final_confidence"],
+            "stage_timings_ms": summary.get("stage_timings_ms"),
+            "total_duration_ms": summary.get("total_duration_ms"),
+            "rule_set_version": summary.get("rule_set_version"),
+            "updated_at": datetime.utcnow(),
+        } for summary in summaries]
+        statement = sqlite_insert(self.summary_table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[self.summary_table.c.transaction_id],
+            set_={column: statement.excluded[column] for column in rows[0] if column != "transaction_id"}
+        )
+        with self._write_lock:
+            with self.engine.begin() as conn:
+                conn.execute(statement, rows)
+        return []
+
+    def read_summary(self, transaction_id: str):
+        """Returns the materialized summary of a trace (a primary-key lookup), or None."""
+        t = self.summary_table
+        with self.engine.connect() as conn:
+            row = conn.execute(select(
+                t.c.transaction_id, t.c.agents_triggered, t.c.final_confidence,
+                t.c.final_decision, t.c.violations_count, t.c.stage_timings_ms,
+                t.c.total_duration_ms, t.c.rule_set_version
+            ).where(t.c.transaction_id == transaction_id)).mappings().first()
+        return dict(row) if row else None
+
+    def trace_version(self, transaction_id: str):
+        """Row count and highest row id of a trace plus its summary update time; None if absent."""
+        t = self.table
+        with self.engine.connect() as conn:
+            count, max_id = conn.execute(
+                select(func.count(), func.max(t.c.id)).where(t.c.transaction_id == transaction_id)
+            ).one()
+            summary_updated_at = conn.execute(
+                select(self.summary_table.c.updated_at).where(self.summary_table.c.transaction_id == transaction_id)
+            ).scalar()
+        if not count and summary_updated_at is None:
+            return None
+        return (count, max_id, summary_updated_at.isoformat() if summary_updated_at else None)
+
+    def read_trace_entries(self, transaction_id: str):
+        """Returns the step records of a trace ordered by step, or None if the table has none."""
+        t = self.table
+        query = select(
+            t.c.timestamp, t.c.transaction_id, t.c.step, t.c.component, t.c.input_data,
+            t.c.description, t.c.confidence, t.c.policy_violation, t.c.policy_id,
+            t.c.final_decision_status, t.c.final_decision_confidence,
+            *(t.c[field] for field in OPTIONAL_STEP_FIELDS), t.c.created_at
+        ).where(t.c.transaction_id == transaction_id).order_by(t.c.step, t.c.id)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).mappings().all()
+        if not rows:
+            return None
+
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            created_at = entry.pop("created_at")
+            if entry["timestamp"] is None:
+                # Rows written before the timestamp column was added
+                entry["timestamp"] = created_at.isoformat() if created_at is not None else ""
+            if entry["final_decision_status"] is None:
+                del entry["final_decision_status"]
+            if entry["final_decision_confidence"] is None:
+                del entry["final_decision_confidence"]
+            for field in OPTIONAL_STEP_FIELDS:
+                if entry[field] is None:
+                    del entry[field]
+            entries.append(entry)
+        return entries
+
+    def read_trace_summary(self, transaction_id: str):
+        """
+        Builds a trace summary with indexed queries, without loading step payloads.
+        Returns None if the trace has no FinalDecisionAgent record.
+        """
+        t = self.table
+        with self.engine.connect() as conn:
+            final_row = conn.execute(
+                select(t.c.final_decision_status, t.c.final_decision_confidence, t.c.input_data, t.c.total_duration_ms)
+                .where(t.c.transaction_id == transaction_id, t.c.component == "FinalDecisionAgent")
+                .order_by(t.c.id.desc()).limit(1)
+            ).first()
+            if final_row is None:
+                return None
+            components = conn.execute(
+                select(t.c.component).where(t.c.transaction_id == transaction_id).distinct()
+            ).scalars().all()
+            violations_count = conn.execute(
+                select(func.count()).select_from(t)
+                .where(t.c.transaction_id == transaction_id, t.c.policy_violation.is_(True))
+            ).scalar()
+
+        return {
+            "transaction_id": transaction_id,
+            "agents_triggered": sorted(components),
+            "final_confidence": round(final_row.final_decision_confidence or 0.0, 2),
+            "final_decision": final_row.final_decision_status or "unknown",
+            "violations_count": violations_count,
+            # The same stage timings the pipeline logged on its final decision step
+            "stage_timings_ms": (final_row.input_data or {}).get("stage_durations_ms"),
+            "total_duration_ms": final_row.total_duration_ms,
+            "rule_set_version": (final_row.input_data or {}).get("rule_set_version")
+        }
+
+# Stores are shared per process so every StepLogger appends through the same writer state
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_trace_store(backend: str, log_directory: str = LOG_DIR, log_file_extension: str = LOG_FILE_EXTENSION):
+    """Returns the shared trace store for a backend name ("files", "segments" or "sqlite")."""
+    key = (backend, log_directory, log_file_extension)
+    with _stores_lock:
+        if key not in _stores:
+            if backend == "segments":
+                segment_directory = TRACE_SEGMENT_DIR if log_directory == LOG_DIR else os.path.join(log_directory, "segments")
+                _stores[key] = SegmentedTraceStore(segment_directory)
+            elif backend == "sqlite":
+                _stores[key] = SQLiteTraceStore()
+            else:
+                if backend != "files":
+                    print(f"Warning: Unknown trace store backend '{backend}'. Using per-transaction files.")
+                _stores[key] = FileTraceStore(log_directory, log_file_extension)
+        return _stores[key]
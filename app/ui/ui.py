@@ -546,7 +546,7 @@ def init_session_state():
         'amount': 0.0, 'card_type': '', 'merchant': '', 'merchant_location': '',
         'user_location': '', 'transaction_id': '', 'status': '', 'confidence': 0.0,
         'narrative': '', 'trace_summary_data': {}, 'trace_verbose_data': [],
-        'error_message': '', 'trace_mode': 'summary', 'processing': False,
+        'error_message': '', 'trace_mode': 'summary', 'trace_live': False, 'processing': False,
         'dashboard_data': None, 'total_transactions': 0, 'real_data': None
     }
     for key, value in defaults.items():
@@ -917,6 +917,29 @@ def fetch_trace(transaction_id):
             st.session_state.trace_verbose_data = data.get('steps', []) if isinstance(data, dict) else data
     except Exception as e:
         st.session_state.error_message = f"Error fetching trace: {str(e)}"
+
+def stream_trace(transaction_id, on_step):
+    """Follow /trace/stream: call on_step(step) for each step as it is logged, until the trace is done"""
+    if not transaction_id:
+        st.session_state.error_message = "No transaction ID provided"
+        return
+
+    st.session_state.trace_verbose_data = []
+    try:
+        with requests.get(f"{API_BASE_URL}/trace/stream/{transaction_id}", stream=True, timeout=(5, 90)) as response:
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:") and event == "step":
+                    step = json.loads(line[len("data:"):])
+                    st.session_state.trace_verbose_data.append(step)
+                    on_step(step)
+                elif line.startswith("data:") and event == "done":
+                    break
+    except Exception as e:
+        st.session_state.error_message = f"Error streaming trace: {str(e)}"
 # --- Page Render Functions ---
 
 def render_home():
@@ -1188,7 +1211,7 @@ def render_fraud_analysis():
                 if st.button(" View Timeline Debugger", use_container_width=True):
                     st.session_state.active_page = "debugger"
                     st.session_state.trace_mode = "verbose"
-                    fetch_trace(st.session_state.transaction_id)
+                    st.session_state.trace_live = True
                     st.rerun()
 
             # Display Summary Trace
@@ -1537,6 +1560,58 @@ def render_dashboard():
             use_container_width=True
         )
 
+def render_trace_step(step, i):
+    """One expander of the verbose timeline"""
+    title = f"**🔹 Step {step.get('step', i+1)}**: {step.get('component', 'Unknown Component')}"
+    if step.get('duration_ms') is not None:
+        title += f" · {step['duration_ms']:.1f} ms"
+    with st.expander(title, expanded=False):
+
+        col1, col2 = st.columns([2, 1])
+
+        with col1:
+            st.markdown(f"**Description:** {step.get('description', 'No description available')}")
+
+            if step.get('reasoning'):
+                st.markdown(f"**Reasoning:** {step.get('reasoning')}")
+
+            if step.get('policy_violation'):
+                st.error(f" **Policy Violation:** {step.get('policy_id', 'Unknown')} - {step.get('violation_description', 'No details')}")
+
+            if step.get('fallback_triggered'):
+                st.warning(f" **Fallback Triggered:** {step.get('fallback_reason', 'Unknown reason')}")
+
+        with col2:
+            confidence = step.get('confidence', 0.0)
+            st.markdown("**Confidence Score:**")
+            st.markdown(create_confidence_bar(confidence), unsafe_allow_html=True)
+
+            if step.get('timestamp'):
+                st.markdown(f"**Timestamp:** {step.get('timestamp')}")
+
+            if step.get('duration_ms') is not None:
+                st.markdown(f"**Stage Time at Step:** {step['duration_ms']:.2f} ms")
+                if step.get('cpu_time_ms') is not None:
+                    st.markdown(f"**CPU Time:** {step['cpu_time_ms']:.2f} ms")
+
+            if step.get('total_duration_ms') is not None:
+                st.markdown(f"**Pipeline Total:** {step['total_duration_ms']:.2f} ms")
+                if step.get('total_cpu_time_ms') is not None:
+                    st.markdown(f"**Pipeline CPU:** {step['total_cpu_time_ms']:.2f} ms")
+
+            stage_durations = (step.get('input_data') or {}).get('stage_durations_ms')
+            if stage_durations:
+                st.markdown("**Stage Durations:** " + ", ".join(f"{name} {ms:.2f} ms" for name, ms in stage_durations.items()))
+
+        # Input/Output Data
+        if step.get('input_data'):
+            st.markdown("**Input Data:**")
+            st.json(step['input_data'])
+
+        if step.get('output_data'):
+            st.markdown("**Output Data:**")
+            st.json(step['output_data'])
+
 def render_debugger():
     """Timeline Debugger page - detailed agent trace view"""
     st.markdown("""
@@ -1576,11 +1651,10 @@ def render_debugger():
             st.write(f"Trace summary data: {bool(st.session_state.trace_summary_data)}")
 
     with col3:
-        if st.button("🔄 Fresh Fetch", use_container_width=True):
-            st.session_state.trace_verbose_data = []
-            st.session_state.trace_summary_data = {}
-            fetch_trace(st.session_state.transaction_id)
-            st.rerun()
+        # Steps are pushed by the backend as they are logged, instead of re-reading the whole trace
+        if st.button("📡 Live Trace", use_container_width=True):
+            st.session_state.trace_mode = "verbose"
+            st.session_state.trace_live = True
     # Debug info (remove this after testing)
     st.write(f"DEBUG: Current transaction ID: {st.session_state.transaction_id}")
     
@@ -1594,12 +1668,25 @@ def render_debugger():
     with col2:
         if st.button(" Verbose View", use_container_width=True):
             st.session_state.trace_mode = "verbose"
-            fetch_trace(st.session_state.transaction_id)
+            st.session_state.trace_live = True
 
     st.markdown("---")
 
+    # Follow the trace stream, rendering each step as it arrives
+    if st.session_state.trace_mode == "verbose" and st.session_state.trace_live:
+        st.markdown("#### Detailed Agent Timeline (live)")
+        timeline = st.container()
+
+        def render_live_step(step):
+            with timeline:
+                render_trace_step(step, len(st.session_state.trace_verbose_data) - 1)
+
+        with st.spinner("Streaming agent steps..."):
+            stream_trace(st.session_state.transaction_id, render_live_step)
+        st.session_state.trace_live = False
+
     # Display Verbose Trace
-    if st.session_state.trace_mode == "verbose" and st.session_state.trace_verbose_data:
+    elif st.session_state.trace_mode == "verbose" and st.session_state.trace_verbose_data:
         st.markdown("#### Detailed Agent Timeline")
         
         # Use all trace data since API should return only 
@@ -1639,41 +1726,7 @@ def render_debugger():
         else:
             for i, step in enumerate(current_transaction_steps):
                 if isinstance(step, dict):
-                    with st.expander(f"**🔹 Step {step.get('step', i+1)}**: {step.get('component', 'Unknown Component')}", expanded=False):
-                        
-                        col1, col2 = st.columns([2, 1])
-                        
-                        with col1:
-                            st.markdown(f"**Description:** {step.get('description', 'No description available')}")
-                            
-                            if step.get('reasoning'):
-                                st.markdown(f"**Reasoning:** {step.get('reasoning')}")
-                            
-                            if step.get('policy_violation'):
-                                st.error(f" **Policy Violation:** {step.get('policy_id', 'Unknown')} - {step.get('violation_description', 'No details')}")
-                            
-                            if step.get('fallback_triggered'):
-                                st.warning(f" **Fallback Triggered:** {step.get('fallback_reason', 'Unknown reason')}")
-                        
-                        with col2:
-                            confidence = step.get('confidence', 0.0)
-                            st.markdown("**Confidence Score:**")
-                            st.markdown(create_confidence_bar(confidence), unsafe_allow_html=True)
-                            
-                            if step.get('timestamp'):
-                                st.markdown(f"**Timestamp:** {step.get('timestamp')}")
-                            
-                            if step.get('processing_time'):
-                                st.markdown(f"**Processing Time:** {step.get('processing_time')}ms")
-                        
-                        # Input/Output Data
-                        if step.get('input_data'):
-                            st.markdown("**Input Data:**")
-                            st.json(step['input_data'])
-                        
-                        if step.get('output_data'):
-                            st.markdown("**Output Data:**")
-                            st.json(step['output_data'])
+                    render_trace_step(step, i)
     
     elif st.session_state.trace_mode == "summary" and st.session_state.trace_summary_data:
         st.markdown("#### Trace Summary")
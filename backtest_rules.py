@@ -0,0 +1,66 @@
+# backtest_rules.py
+import argparse
+import os
+import time
+
+import pandas as pd
+
+from app.core.app_config import DEFAULT_POLICY_DOC
+from app.agents.compliance_agent import load_policy_rules, evaluate_policy_rules_frame
+from app.agents.rule_compiler import compile_policy_rules
+from app.agents.fraud_agent import normalize_transactions_frame
+from app.agents.decision_engine import compute_flags_frame
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_PATH = os.path.join(script_dir, "data", "transactions.csv")
+
+def backtest_rules(rules_path: str, data_path: str, output_path: str = None) -> pd.DataFrame:
+    """
+    Evaluates a candidate policy rule file over a historical transaction file
+    in one column-wise pass and prints per-rule hit counts and agreement with
+    the is_fraud label (when the file has one).
+    """
+    print(f"Rules: {rules_path}")
+    print(f"Data: {data_path}")
+
+    compiled_rules = compile_policy_rules(load_policy_rules(rules_path))
+    history = pd.read_csv(data_path)
+    print(f"Loaded {len(compiled_rules)} rules and {len(history)} transactions.")
+
+    start = time.perf_counter()
+    normalized = normalize_transactions_frame(history)
+    flags = compute_flags_frame(normalized)
+    results = evaluate_policy_rules_frame(pd.concat([normalized, flags], axis=1), compiled_rules)
+    elapsed = time.perf_counter() - start
+
+    labelled = "is_fraud" in history.columns
+    print(f"\nEvaluated in {elapsed * 1000:.1f} ms ({len(history) / max(elapsed, 1e-9):,.0f} transactions/s)\n")
+    for rule in compiled_rules:
+        hits = results["policy_id"] == rule.rule_id
+        line = f"{rule.rule_id:<12} {rule.action:<10} hits={int(hits.sum()):>7}"
+        if labelled and hits.any():
+            precision = history.loc[hits, "is_fraud"].mean()
+            line += f"  fraud_rate={precision:.2%}"
+        print(line)
+
+    violated = results["violated"]
+    print(f"\nTotal violations: {int(violated.sum())} of {len(history)}")
+    if labelled:
+        is_fraud = history["is_fraud"].astype(bool)
+        agreement = (violated == is_fraud).mean()
+        caught = (violated & is_fraud).sum() / max(is_fraud.sum(), 1)
+        print(f"Agreement with is_fraud: {agreement:.2%}  Fraud caught: {caught:.2%}")
+
+    if output_path:
+        report = pd.concat([history, results.add_prefix("policy_")], axis=1)
+        report.to_csv(output_path, index=False)
+        print(f"Per-transaction results written to {output_path}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest policy rules against historical transactions.")
+    parser.add_argument("--rules", default=DEFAULT_POLICY_DOC, help="Policy rule JSON file to evaluate.")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH, help="CSV of historical transactions.")
+    parser.add_argument("--output", default=None, help="Optional CSV path for per-transaction results.")
+    args = parser.parse_args()
+    backtest_rules(args.rules, args.data, args.output)
@@ -0,0 +1,131 @@
+# benchmarks/bench_groq_pool.py
+"""
+Starts a local OpenAI-compatible stub server and compares Groq calls that
+open a new connection per request (module-level requests.post) with the
+narrative agent's pooled keep-alive session and async client. The stub can
+charge a fixed cost per new connection to stand in for the TCP/TLS handshake
+with a remote API. Reports the throughput and how many connections the
+server accepted.
+
+    python -m benchmarks.bench_groq_pool --requests 500 --concurrency 16
+    python -m benchmarks.bench_groq_pool --latency-ms 20 --handshake-ms 0
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import app.agents.narrative_agent as narrative_agent
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep connections open unless the client closes them
+    disable_nagle_algorithm = True # Headers and body are separate writes; avoid delayed-ACK stalls on reused connections
+    latency = 0.0
+    handshake = 0.0
+    connections = None # multiprocessing.Value shared with the benchmark process
+
+    def setup(self):
+        super().setup()
+        with _StubHandler.connections.get_lock():
+            _StubHandler.connections.value += 1
+        # Stands in for the TCP/TLS round trips of a new connection to a remote API
+        if _StubHandler.handshake:
+            time.sleep(_StubHandler.handshake)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if _StubHandler.latency:
+            time.sleep(_StubHandler.latency)
+        content = f"Stub narrative for a prompt of {len(body['messages'][-1]['content'])} characters."
+        output = json.dumps({"choices": [{"message": {"role": "assistant", "content": content}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+def _serve(port, ready, connections, latency: float, handshake: float):
+    _StubHandler.connections = connections
+    _StubHandler.latency = latency
+    _StubHandler.handshake = handshake
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.daemon_threads = True
+    port.value = server.server_address[1]
+    ready.set()
+    server.serve_forever()
+
+def start_stub_server(latency: float, handshake: float) -> tuple:
+    """
+    Runs the stub in its own process, so its threads do not compete with the
+    clients being measured for the GIL. Returns (process, port, connections).
+    """
+    port, ready, connections = multiprocessing.Value("i", 0), multiprocessing.Event(), multiprocessing.Value("i", 0)
+    process = multiprocessing.Process(target=_serve, args=(port, ready, connections, latency, handshake), daemon=True)
+    process.start()
+    ready.wait()
+    return process, port.value, connections
+
+def _unpooled_call(prompt: str) -> str:
+    # The previous implementation: a fresh connection per call
+    response = requests.post(narrative_agent.GROQ_API_URL, headers={"Content-Type": "application/json"},
+                             data=json.dumps(narrative_agent._build_groq_payload(prompt)), timeout=10)
+    response.raise_for_status()
+    return narrative_agent._parse_groq_response(response.json())
+
+def _run_threads(call, count: int, concurrency: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, (f"prompt {i}" for i in range(count))))
+    return time.perf_counter() - start
+
+async def _run_async(count: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            return await narrative_agent.call_groq_api_async(f"prompt {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - start
+    await narrative_agent.close_async_client()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pooled vs per-call connections for Groq requests.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per variant.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent callers.")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated model latency of the stub server.")
+    parser.add_argument("--handshake-ms", type=float, default=20.0, help="Simulated setup cost of each new connection.")
+    args = parser.parse_args()
+
+    process, port, connections = start_stub_server(args.latency_ms / 1000, args.handshake_ms / 1000)
+    narrative_agent.GROQ_API_URL = f"http://127.0.0.1:{port}/v1/chat/completions"
+
+    variants = [
+        ("requests.post per call", lambda: _run_threads(_unpooled_call, args.requests, args.concurrency)),
+        ("shared session (sync)", lambda: _run_threads(narrative_agent.call_groq_api, args.requests, args.concurrency)),
+        ("pooled client (async)", lambda: asyncio.run(_run_async(args.requests, args.concurrency))),
+    ]
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"stub latency {args.latency_ms:g} ms, connection setup {args.handshake_ms:g} ms")
+    print(f"{'variant':<24} {'seconds':>8} {'req/s':>8} {'ms/req':>8} {'connections':>12}")
+    for name, run in variants:
+        connections_before = connections.value
+        elapsed = run()
+        print(f"{name:<24} {elapsed:>8.2f} {args.requests / elapsed:>8.0f} "
+              f"{elapsed / args.requests * args.concurrency * 1000:>8.2f} {connections.value - connections_before:>12}")
+    narrative_agent.close_http_session()
+    process.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/bench_rule_index.py
+"""
+Generates synthetic policy rule files (per-merchant, per-corridor and
+per-card-program rules plus a few global amount rules) and measures the
+per-transaction cost of the decision table with and without the rule index.
+
+    python -m benchmarks.bench_rule_index --sizes 100 1000 10000
+    python -m benchmarks.bench_rule_index --sizes 10000 --output /tmp/rules_10k.json
+"""
+import argparse
+import json
+import random
+import time
+
+from app.agents.rule_compiler import compile_policy_rules
+from app.agents.decision_engine import DEFAULT_THRESHOLDS, build_decision_table, compute_flags, decide
+from app.agents.rule_index import RuleIndex
+
+LOCATIONS = [f"city_{i}, country_{i % 40}" for i in range(200)]
+CARD_PROGRAMS = ["credit", "debit", "virtual", "prepaid"] + [f"program_{i}" for i in range(50)]
+
+def generate_rules(count: int, seed: int = 7) -> dict:
+    """Builds `count` synthetic rules in the fraud_rules.txt format."""
+    rng = random.Random(seed)
+    rules = {}
+    for i in range(count):
+        kind = rng.random()
+        low = rng.choice([0, 100, 500, 1000, 2500, 5000])
+        if kind < 0.5:
+            condition = f"merchant == 'merchant_{rng.randrange(count)}' and amount > {low}"
+        elif kind < 0.8:
+            condition = (f"user_location == '{rng.choice(LOCATIONS)}' and "
+                         f"merchant_location == '{rng.choice(LOCATIONS)}' and amount >= {low}")
+        elif kind < 0.995:
+            condition = f"card_type == '{rng.choice(CARD_PROGRAMS)}' and {low} <= amount < {low + rng.choice([500, 2000, 10000])}"
+        else:
+            condition = f"amount > {rng.choice([20000, 50000, 90000])} and location_flag"
+        rules[f"S{i}"] = {
+            "condition": condition,
+            "action": rng.choice(["fraud", "escalate"]),
+            "reason": f"Synthetic rule {i}.",
+            "confidence": round(rng.uniform(0.6, 0.99), 2),
+        }
+    return rules
+
+def generate_transactions(count: int, rule_count: int, seed: int = 11) -> list:
+    rng = random.Random(seed)
+    transactions = []
+    for _ in range(count):
+        transactions.append({
+            "amount": round(rng.uniform(1, 12000), 2),
+            "card_type": rng.choice(CARD_PROGRAMS),
+            "user_location": rng.choice(LOCATIONS),
+            "merchant": f"merchant_{rng.randrange(rule_count * 2)}",
+            "merchant_location": rng.choice(LOCATIONS),
+        })
+    return transactions
+
+def run_decisions(transactions: list, table: list, rule_index=None) -> tuple:
+    decisions = []
+    start = time.perf_counter()
+    for fields in transactions:
+        flags = compute_flags(fields["amount"], fields["card_type"], fields["user_location"],
+                              fields["merchant"], fields["merchant_location"])
+        row, _, _ = decide(fields, flags, 0.3, False, table, DEFAULT_THRESHOLDS, rule_index)
+        decisions.append(row.row_id if row is not None else None)
+    return decisions, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the predicate-indexed rule engine.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Rule counts to test.")
+    parser.add_argument("--transactions", type=int, default=2000, help="Transactions evaluated per size.")
+    parser.add_argument("--output", default=None, help="Write the largest generated rule file here.")
+    args = parser.parse_args()
+
+    print(f"{'rules':>7} {'buckets':>8} {'index build':>12} {'linear us/txn':>14} {'indexed us/txn':>15} {'speedup':>8}")
+    rules = {}
+    for size in args.sizes:
+        rules = generate_rules(size)
+        compiled_rules = compile_policy_rules(rules)
+        table = build_decision_table(compiled_rules)
+
+        start = time.perf_counter()
+        rule_index = RuleIndex([row.rule for row in table], DEFAULT_THRESHOLDS)
+        build_seconds = time.perf_counter() - start
+
+        transactions = generate_transactions(args.transactions, size)
+        linear_decisions, linear_seconds = run_decisions(transactions, table)
+        indexed_decisions, indexed_seconds = run_decisions(transactions, table, rule_index)
+        if linear_decisions != indexed_decisions:
+            raise SystemExit(f"Indexed decisions differ from the linear scan for {size} rules.")
+
+        linear_us = linear_seconds / len(transactions) * 1e6
+        indexed_us = indexed_seconds / len(transactions) * 1e6
+        print(f"{size:>7} {rule_index.stats()['buckets']:>8} {build_seconds * 1000:>10.1f}ms "
+              f"{linear_us:>14.1f} {indexed_us:>15.1f} {linear_us / indexed_us:>7.1f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rules, f, indent=2)
+        print(f"Wrote {len(rules)} rules to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# build_merchant_blacklist.py
+import argparse
+import csv
+import os
+import time
+
+from app.core.app_config import MERCHANT_BLACKLIST_PATH, MERCHANT_BLACKLIST_BLOOM_BITS_PER_KEY, MERCHANT_FUZZY_INDEX_PATH, MERCHANT_FUZZY_MAX_DISTANCE
+from app.agents.merchant_blacklist import build_blacklist
+from app.agents.merchant_fuzzy_index import build_fuzzy_index
+
+def read_merchants(input_path: str, column: str = None):
+    """Yields merchant identifiers from a text file (one per line) or a CSV column."""
+    with open(input_path, "r", newline="") as f:
+        if column:
+            for row in csv.DictReader(f):
+                merchant = (row.get(column) or "").strip()
+                if merchant:
+                    yield merchant
+        else:
+            for line in f:
+                merchant = line.strip()
+                if merchant:
+                    yield merchant
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped merchant blacklist from a feed file.")
+    parser.add_argument("input", help="Text file with one merchant per line, or a CSV file with --column.")
+    parser.add_argument("--column", default=None, help="CSV column holding the merchant identifier.")
+    parser.add_argument("--output", default=MERCHANT_BLACKLIST_PATH, help="Blacklist file to write (swapped in atomically).")
+    parser.add_argument("--bloom-bits-per-key", type=int, default=MERCHANT_BLACKLIST_BLOOM_BITS_PER_KEY,
+                        help="Bloom filter size per key; 0 disables the filter.")
+    parser.add_argument("--fuzzy-output", default=MERCHANT_FUZZY_INDEX_PATH, help="Fuzzy-match deletion index file to write.")
+    parser.add_argument("--max-distance", type=int, default=MERCHANT_FUZZY_MAX_DISTANCE,
+                        help="Max edit distance for fuzzy matches; 0 removes the fuzzy index.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = build_blacklist(read_merchants(args.input, args.column), args.output, args.bloom_bits_per_key)
+    print(f"Wrote {count} merchant keys to {args.output} in {time.perf_counter() - start:.1f}s")
+
+    if args.max_distance > 0:
+        start = time.perf_counter()
+        count = build_fuzzy_index(read_merchants(args.input, args.column), args.fuzzy_output, args.max_distance)
+        print(f"Wrote fuzzy index of {count} merchants (max distance {args.max_distance}) to {args.fuzzy_output} "
+              f"in {time.perf_counter() - start:.1f}s")
+    elif os.path.exists(args.fuzzy_output):
+        # An index left from an earlier feed would keep matching names that are not on this one
+        os.remove(args.fuzzy_output)
+        print(f"Removed fuzzy index {args.fuzzy_output} (fuzzy matching off for this blacklist)")